@@ -0,0 +1,240 @@
+import re
+import csv
+import json
+import argparse
+from collections import defaultdict, namedtuple
+from multiprocessing import Pool, cpu_count
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from annotation_parser import STRUCTURED_SUFFIX, iter_annotation_models, load_structured_annotation
+from compute_bps_by_hinges_tab import ACCEPTED_PAIRINGS
+from ncm_store import list_all_fragments, open_fragment
+from pdb_reader import is_cif_file
+
+# Tables d'une base d'annotations, sous forme de DataFrames à colonnes catégorielles :
+#   residues    : ncm, file, model, residue, name
+#   base_pairs  : ncm, file, model, residue1, residue2, base1, base2, description, family, orientation, cis_trans
+#   stackings   : ncm, file, model, residue1, residue2, description, adjacent
+AnnotationTables = namedtuple("AnnotationTables", ["residues", "base_pairs", "stackings"])
+
+# Colonnes de chaque table ; les colonnes textuelles sont stockées en codes entiers + catégories
+TABLE_COLUMNS = {
+    "residues": ["ncm", "file", "model", "residue", "name"],
+    "base_pairs": ["ncm", "file", "model", "residue1", "residue2", "base1", "base2", "description",
+                   "family", "orientation", "cis_trans"],
+    "stackings": ["ncm", "file", "model", "residue1", "residue2", "description", "adjacent"],
+}
+NUMERIC_COLUMNS = {"model", "adjacent"}
+
+# Famille Leontis-Westhof : faces des deux bases (ex: Ww/Ww, Hh/Ss, Ss/O2P)
+FAMILY_PATTERN = re.compile(r"^[A-Za-z0-9']+/[A-Za-z0-9']+$")
+
+def parse_pairing_description(description):
+    """
+    Décompose la description mc-annotate d'une paire de bases.
+
+    :return: Tuple (famille, orientation, cis/trans), '' pour les éléments absents.
+    """
+    tokens = description.split()
+    family = next((token for token in tokens if FAMILY_PATTERN.match(token)), "")
+    orientation = next((token for token in tokens if token in ("parallel", "antiparallel")), "")
+    cis_trans = next((token for token in tokens if token in ("cis", "trans")), "")
+    return family, orientation, cis_trans
+
+def parse_annotation_fragment(args):
+    """
+    Analyse un fichier .mc-annotate (répertoire ou archive NCM) dans un processus de calcul.
+
+    :param args: Tuple (répertoire de NCMs, type de NCM, nom du fichier).
+    :return: Tuple (type de NCM, nom du fichier, lignes des tables {table: liste de tuples}, erreur ou None).
+    """
+    root, ncm, file_name = args
+    rows = {table: [] for table in TABLE_COLUMNS}
+    try:
+        with open_fragment(root, ncm, file_name) as f:
+            if file_name.endswith(STRUCTURED_SUFFIX):
+                models = load_structured_annotation(f)[0]
+            else:
+                models = iter_annotation_models(f)
+            for model_index, model in enumerate(models, start=1):
+                for residue, name in model.residues:
+                    rows["residues"].append((model_index, residue, name))
+                for residue1, residue2, base1, base2, description in model.base_pairs:
+                    rows["base_pairs"].append((model_index, residue1, residue2, base1, base2, description)
+                                              + parse_pairing_description(description))
+                for residue1, residue2, description, adjacent in model.stackings:
+                    rows["stackings"].append((model_index, residue1, residue2, description, int(adjacent)))
+    except Exception as e:
+        return ncm, file_name, rows, str(e)
+    return ncm, file_name, rows, None
+
+def encode_column(values):
+    """Encode une colonne textuelle : catégories triées et codes entiers (int32)."""
+    categories, codes = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+    return codes.astype(np.int32), categories
+
+def build_annotation_db(root, output_path, num_workers=1):
+    """
+    Analyse une seule fois chaque fichier .mc-annotate d'une base de NCMs et écrit les tables en colonnes.
+
+    Le fichier produit (.npz) contient, pour chaque colonne textuelle, un tableau de codes et
+    le tableau des catégories correspondantes.
+
+    :param root: Répertoire de NCMs (sous-répertoires ou archives ncm_store).
+    :param output_path: Fichier .npz de sortie.
+    :param num_workers: Nombre de processus d'analyse.
+    """
+    tasks = [(root, ncm, file_name)
+             for ncm, files in sorted(list_all_fragments(root).items())
+             for file_name in sorted(files) if not file_name.endswith(".pdb") and not is_cif_file(file_name)]
+    chunksize = max(1, len(tasks) // (num_workers * 4))
+
+    columns = {table: defaultdict(list) for table in TABLE_COLUMNS}
+    with Pool(processes=num_workers) as pool:
+        for ncm, file_name, rows, error in tqdm(pool.imap(parse_annotation_fragment, tasks, chunksize),
+                                                total=len(tasks), desc="Analyse des annotations"):
+            if error is not None:
+                print(f"Erreur lors de la lecture de {ncm}/{file_name}: {error}")
+            for table, table_rows in rows.items():
+                if not table_rows:
+                    continue
+                table_columns = columns[table]
+                table_columns["ncm"].extend([ncm] * len(table_rows))
+                table_columns["file"].extend([file_name] * len(table_rows))
+                for name, values in zip(TABLE_COLUMNS[table][2:], zip(*table_rows)):
+                    table_columns[name].extend(values)
+
+    arrays = {}
+    for table, names in TABLE_COLUMNS.items():
+        for name in names:
+            values = columns[table][name]
+            if name in NUMERIC_COLUMNS:
+                arrays[f"{table}.{name}"] = np.asarray(values, dtype=np.int32)
+            else:
+                arrays[f"{table}.{name}"], arrays[f"{table}.{name}.categories"] = encode_column(values)
+    np.savez_compressed(output_path, **arrays)
+    print(f"{len(columns['base_pairs']['ncm'])} paires de bases, {len(columns['residues']['ncm'])} résidus "
+          f"enregistrés dans {output_path}")
+
+def load_annotation_db(path):
+    """
+    Charge une base d'annotations écrite par build_annotation_db.
+
+    :return: AnnotationTables de DataFrames (colonnes textuelles de type category).
+    """
+    with np.load(path, allow_pickle=False) as data:
+        tables = {}
+        for table, names in TABLE_COLUMNS.items():
+            frame = {}
+            for name in names:
+                if name in NUMERIC_COLUMNS:
+                    frame[name] = data[f"{table}.{name}"]
+                else:
+                    frame[name] = pd.Categorical.from_codes(data[f"{table}.{name}"],
+                                                            data[f"{table}.{name}.categories"])
+            tables[table] = pd.DataFrame(frame)
+    return AnnotationTables(**tables)
+
+def accepted_description_mask(descriptions, accepted_pairings=ACCEPTED_PAIRINGS):
+    """
+    Indique pour chaque description si elle se termine par une des paires acceptées.
+
+    Le test est fait une seule fois par catégorie de description, puis propagé aux lignes.
+    C'est la règle appliquée par pairing_pattern dans compute_bps_by_hinges_tab
+    (sans tenir compte de la casse).
+    """
+    suffixes = tuple(pairing.lower() for pairing in accepted_pairings)
+    categories = descriptions.cat.categories
+    accepted = np.array([str(description).lower().endswith(suffixes) for description in categories], dtype=bool)
+    codes = descriptions.cat.codes.to_numpy()
+    return accepted[codes] & (codes >= 0)
+
+def accepted_base_pairs(base_pairs, accepted_pairings=ACCEPTED_PAIRINGS):
+    """
+    Ensemble des paires de bases acceptées (ex: 'G-C') de chaque fichier, sans doublons.
+
+    :return: DataFrame (ncm, file, pair) trié.
+    """
+    standard = base_pairs["base1"].isin(list("ACGU")) & base_pairs["base2"].isin(list("ACGU"))
+    mask = accepted_description_mask(base_pairs["description"], accepted_pairings) & standard.to_numpy()
+    selected = base_pairs.loc[mask, ["ncm", "file", "base1", "base2"]]
+    pairs = pd.DataFrame({
+        "ncm": selected["ncm"].astype(str),
+        "file": selected["file"].astype(str),
+        "pair": selected["base1"].astype(str) + "-" + selected["base2"].astype(str),
+    })
+    return pairs.drop_duplicates().sort_values(["ncm", "file", "pair"], ignore_index=True)
+
+def count_hinges_from_db(tables, accepted_pairings=ACCEPTED_PAIRINGS):
+    """
+    Compte les hinges par jointure vectorisée, sans relire les fichiers texte.
+
+    Deux types de NCM forment un hinge sur une paire de bases lorsqu'un même fichier contient
+    cette paire acceptée dans les deux types. Le résultat est celui de count_hinges.
+
+    :return: Dictionnaire {'ncm1-ncm2': {paire: occurrences}}, dans l'ordre de count_hinges.
+    """
+    pairs = accepted_base_pairs(tables.base_pairs, accepted_pairings)
+    merged = pairs.merge(pairs, on=["file", "pair"], suffixes=("1", "2"))
+    merged = merged[merged["ncm1"] < merged["ncm2"]]
+    counts = merged.groupby(["ncm1", "ncm2", "pair"], sort=True).size()
+
+    hinge_counts = {}
+    for (ncm1, ncm2, pair), count in counts.items():
+        hinge_counts.setdefault(f"{ncm1}-{ncm2}", {})[pair] = int(count)
+    print(f"Nombre total de paires de bases trouvées : {int(counts.sum())}")
+    return hinge_counts
+
+def count_pairing_types(tables):
+    """
+    Compte les paires de bases de chaque type de NCM par famille, orientation et cis/trans.
+
+    :return: DataFrame (ncm, family, orientation, cis_trans, count).
+    """
+    columns = ["ncm", "family", "orientation", "cis_trans"]
+    return (tables.base_pairs.groupby(columns, observed=True).size()
+            .rename("count").reset_index().sort_values(columns, ignore_index=True))
+
+def main():
+    parser = argparse.ArgumentParser(description="Base d'annotations mc-annotate en colonnes (NumPy).")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Analyse les fichiers .mc-annotate d'une base de NCMs")
+    build_parser.add_argument("root", help="Répertoire de NCMs (sous-répertoires ou archives ncm_store)")
+    build_parser.add_argument("-o", "--output", required=True, help="Fichier .npz de sortie")
+    build_parser.add_argument("-n", "--num_workers", type=int, default=max(1, cpu_count() // 2),
+                              help="Nombre de processus d'analyse (par défaut : moitié des cœurs CPU)")
+
+    hinge_parser = subparsers.add_parser("hinges", help="Compte les hinges (même sortie que compute_bps_by_hinges_tab)")
+    hinge_parser.add_argument("database", help="Base d'annotations (.npz)")
+    hinge_parser.add_argument("-o", "--output", required=True, help="Fichier JSON de sortie")
+    hinge_parser.add_argument("--pairings", default=None,
+                              help="Fichier des paires acceptées, une par ligne (défaut: ACCEPTED_PAIRINGS)")
+
+    pairing_parser = subparsers.add_parser("pairings", help="Compte les types de paires de bases par NCM")
+    pairing_parser.add_argument("database", help="Base d'annotations (.npz)")
+    pairing_parser.add_argument("-o", "--output", required=True, help="Fichier CSV de sortie")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        build_annotation_db(args.root, args.output, args.num_workers)
+    elif args.command == "hinges":
+        accepted_pairings = ACCEPTED_PAIRINGS
+        if args.pairings:
+            with open(args.pairings, "r") as f:
+                accepted_pairings = [line.strip() for line in f if line.strip()]
+        hinge_counts = count_hinges_from_db(load_annotation_db(args.database), accepted_pairings)
+        with open(args.output, "w") as f:
+            json.dump(hinge_counts, f, indent=4)
+        print(f"Résultat enregistré dans {args.output}")
+    else:
+        counts = count_pairing_types(load_annotation_db(args.database))
+        with open(args.output, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(counts.columns)
+            writer.writerows(counts.itertuples(index=False))
+        print(f"Résultat enregistré dans {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import re
+import json
+from collections import namedtuple
+
+# Un modèle annoté par mc-annotate :
+#   residues    : liste de (identifiant, nom du résidu), dans l'ordre du fichier
+#   base_pairs  : liste de (identifiant 1, identifiant 2, base 1, base 2, description)
+#   stackings   : liste de (identifiant 1, identifiant 2, description, adjacent)
+AnnotationModel = namedtuple("AnnotationModel", ["residues", "base_pairs", "stackings"])
+
+# Identifiant de résidu : chaîne (un caractère, éventuellement entre apostrophes), numéro, code d'insertion
+RESIDUE_ID = r"(?:'.'|[A-Za-z0-9])-?\d+(?:\.\w)?"
+RESIDUE_ID_PATTERN = re.compile(r"^(?:'(.)'|([A-Za-z0-9]))(-?\d+)(?:\.(\w))?$")
+RESIDUE_LINE_PATTERN = re.compile(rf"^({RESIDUE_ID})\s*:\s*(\S+)")
+BASE_PAIR_LINE_PATTERN = re.compile(rf"^({RESIDUE_ID})-({RESIDUE_ID})\s*:\s*([A-Za-z]+)-([A-Za-z]+)\s*(.*)$")
+STACKING_LINE_PATTERN = re.compile(rf"^({RESIDUE_ID})-({RESIDUE_ID})\s*:\s*(.*)$")
+
+# Résultat structuré d'une annotation (voir dump_structured_annotation), écrit à la place du texte brut
+STRUCTURED_SUFFIX = ".mc-annotate.json"
+
+# En-têtes de sections de la sortie de mc-annotate
+SECTION_HEADERS = (
+    ("Residue conformations", "residues"),
+    ("Adjacent stackings", "adjacent_stackings"),
+    ("Non-Adjacent stackings", "non_adjacent_stackings"),
+    ("Base-pairs", "base_pairs"),
+)
+
+def parse_residue_id(res_id):
+    """
+    Décompose un identifiant de résidu mc-annotate (ex: 'A12', "'0'5", 'B7.A').
+
+    :return: Tuple (chaîne, numéro, code d'insertion), ou None si l'identifiant n'est pas reconnu.
+    """
+    match = RESIDUE_ID_PATTERN.match(res_id)
+    if not match:
+        return None
+    quoted_chain, chain, number, icode = match.groups()
+    return quoted_chain if quoted_chain is not None else chain, int(number), icode or ""
+
+class AnnotationStreamParser:
+    """
+    Analyse incrémentale d'une sortie de mc-annotate : les lignes sont transmises une à une
+    avec feed(), par exemple pendant l'exécution du programme.
+    """
+
+    def __init__(self):
+        self.model = None
+        self.section = None
+
+    def feed(self, line):
+        """Analyse une ligne et retourne le modèle qu'elle termine, ou None."""
+        line = line.strip()
+        if not line:
+            return None
+        header = next((name for prefix, name in SECTION_HEADERS if line.startswith(prefix)), None)
+        if header is not None:
+            completed = None
+            model = self.model
+            if model is None or (header == "residues" and (model.residues or model.base_pairs)):
+                completed = model
+                self.model = AnnotationModel([], [], [])
+            self.section = header
+            return completed
+        if self.model is None:
+            return None
+
+        section = self.section
+        if section == "residues":
+            match = RESIDUE_LINE_PATTERN.match(line)
+            if match:
+                self.model.residues.append((match.group(1), match.group(2)))
+        elif section == "base_pairs":
+            match = BASE_PAIR_LINE_PATTERN.match(line)
+            if match:
+                res1, res2, base1, base2, description = match.groups()
+                self.model.base_pairs.append((res1, res2, base1.upper(), base2.upper(), description.strip()))
+        elif section in ("adjacent_stackings", "non_adjacent_stackings"):
+            match = STACKING_LINE_PATTERN.match(line)
+            if match:
+                res1, res2, description = match.groups()
+                self.model.stackings.append((res1, res2, description.strip(), section == "adjacent_stackings"))
+        return None
+
+    def close(self):
+        """Termine l'analyse et retourne le dernier modèle, ou None."""
+        model, self.model = self.model, None
+        return model
+
+def iter_annotation_models(lines):
+    """
+    Analyse une sortie de mc-annotate ligne par ligne.
+
+    Les lignes peuvent provenir d'un fichier ou directement de la sortie du programme :
+    chaque modèle est produit dès que le modèle suivant commence.
+
+    :param lines: Itérable de lignes de texte.
+    :return: Générateur d'AnnotationModel, un par modèle.
+    """
+    parser = AnnotationStreamParser()
+    for line in lines:
+        model = parser.feed(line)
+        if model is not None:
+            yield model
+    model = parser.close()
+    if model is not None:
+        yield model
+
+def read_annotation(file_path):
+    """Lit un fichier .mc-annotate (ou son résultat structuré .mc-annotate.json) et retourne ses modèles."""
+    if file_path.endswith(STRUCTURED_SUFFIX):
+        with open(file_path, "r") as f:
+            return load_structured_annotation(f)[0]
+    with open(file_path, "r") as f:
+        return list(iter_annotation_models(f))
+
+def dump_structured_annotation(models, accepted_pairs, f):
+    """
+    Écrit le résultat structuré d'une annotation (JSON) : modèles analysés et paires de bases acceptées.
+
+    :param models: Liste d'AnnotationModel.
+    :param accepted_pairs: Ensemble des paires de bases acceptées (ex: {'G-C', 'A-U'}).
+    :param f: Fichier ouvert en écriture texte.
+    """
+    json.dump({
+        "models": [{"residues": model.residues, "base_pairs": model.base_pairs, "stackings": model.stackings}
+                   for model in models],
+        "accepted_pairs": sorted(accepted_pairs),
+    }, f, separators=(",", ":"))
+
+def load_structured_annotation(f):
+    """
+    Lit un résultat structuré écrit par dump_structured_annotation.
+
+    :return: Tuple (liste d'AnnotationModel, ensemble des paires de bases acceptées).
+    """
+    data = json.load(f)
+    models = [AnnotationModel([tuple(r) for r in model["residues"]],
+                              [tuple(bp) for bp in model["base_pairs"]],
+                              [tuple(st) for st in model["stackings"]])
+              for model in data["models"]]
+    return models, set(data["accepted_pairs"])
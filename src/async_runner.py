@@ -0,0 +1,122 @@
+import os
+import time
+import asyncio
+import subprocess
+from collections import namedtuple
+
+# Commande externe à exécuter : la sortie standard est écrite directement dans stdout_path
+# (ou héritée du processus courant si stdout_path vaut None).
+# Avec stdout_handler, la sortie est plutôt transmise ligne par ligne pendant l'exécution :
+# stdout_handler() crée, pour chaque tentative, un objet doté de feed(ligne) et close(succès),
+# dont la valeur de retour de close est placée dans JobResult.output.
+Job = namedtuple("Job", ["command", "stdout_path", "tag", "cwd", "stdout_handler"],
+                 defaults=(None, None, None, None))
+
+# Résultat d'une commande : returncode vaut None si le processus n'a pas pu se terminer
+JobResult = namedtuple("JobResult", ["job", "returncode", "elapsed", "attempts", "error", "output"],
+                       defaults=(None,))
+
+async def _run_once(job, timeout):
+    """Lance une commande une fois et retourne (code de retour, message d'erreur, erreur transitoire, sortie)."""
+    if job.stdout_handler is not None:
+        consumer = job.stdout_handler()
+        try:
+            returncode, error, transient = await _run_process(job, None, timeout, consumer)
+        except BaseException:
+            consumer.close(False)
+            raise
+        return returncode, error, transient, consumer.close(returncode == 0)
+
+    partial_path = job.stdout_path + ".part" if job.stdout_path else None
+    returncode, error, transient = await _run_process(job, partial_path, timeout)
+    if partial_path:
+        if returncode == 0:
+            os.replace(partial_path, job.stdout_path)
+        elif os.path.exists(partial_path):
+            os.remove(partial_path)
+    return returncode, error, transient, None
+
+async def _feed_lines(stream, consumer):
+    """Transmet la sortie d'un processus au consommateur, ligne par ligne, au fil de l'exécution."""
+    async for line in stream:
+        consumer.feed(line.decode(errors="replace"))
+
+async def _run_process(job, partial_path, timeout, consumer=None):
+    stdout = open(partial_path, "wb") if partial_path else None
+    try:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *job.command, stdout=subprocess.PIPE if consumer is not None else stdout,
+                stderr=subprocess.PIPE, cwd=job.cwd)
+        except (FileNotFoundError, PermissionError) as e:
+            return None, str(e), False
+        except OSError as e:
+            # Ex: trop de fichiers ouverts ou mémoire insuffisante au lancement
+            return None, str(e), True
+        try:
+            if consumer is None:
+                _, stderr = await asyncio.wait_for(process.communicate(), timeout)
+            else:
+                _, stderr, _ = await asyncio.wait_for(
+                    asyncio.gather(_feed_lines(process.stdout, consumer), process.stderr.read(), process.wait()),
+                    timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            return None, f"délai dépassé ({timeout} s)", True
+    finally:
+        if stdout is not None:
+            stdout.close()
+
+    if process.returncode == 0:
+        return 0, None, False
+    lines = stderr.decode(errors="replace").strip().splitlines()
+    message = f"code de retour {process.returncode}" + (f" : {lines[-1]}" if lines else "")
+    # Un code négatif signifie que le processus a été tué par un signal (ex: manque de mémoire)
+    return process.returncode, message, process.returncode < 0
+
+async def _run_job(job, timeout, retries, retry_delay):
+    """Exécute une commande en la relançant en cas d'échec transitoire."""
+    start_time = time.time()
+    attempts = 0
+    while True:
+        attempts += 1
+        returncode, error, transient, output = await _run_once(job, timeout)
+        if not transient or attempts > retries:
+            return JobResult(job, returncode, time.time() - start_time, attempts, error, output)
+        await asyncio.sleep(retry_delay * attempts)
+
+async def _run_all(jobs, max_concurrency, timeout, retries, retry_delay, on_result):
+    jobs = iter(jobs)
+    results = []
+
+    async def worker():
+        # Chaque tâche consomme les commandes une à une : au plus max_concurrency processus actifs
+        for job in jobs:
+            result = await _run_job(job, timeout, retries, retry_delay)
+            results.append(result)
+            if on_result is not None:
+                on_result(result)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, max_concurrency))))
+    return results
+
+def run_jobs(jobs, max_concurrency, timeout=None, retries=0, retry_delay=1.0, on_result=None):
+    """
+    Exécute des commandes externes en parallèle depuis une seule boucle asyncio.
+
+    Les exécutables sont lancés directement, sans processus Python intermédiaire. La sortie
+    standard est écrite au fil de l'eau dans un fichier temporaire, renommé en stdout_path
+    uniquement si la commande réussit, ou transmise ligne par ligne à Job.stdout_handler. Les
+    dépassements de délai, les échecs de lancement dus aux ressources système et les processus
+    tués par un signal sont considérés comme transitoires et relancés.
+
+    :param jobs: Itérable de Job (consommé au fur et à mesure).
+    :param max_concurrency: Nombre maximal de processus exécutés simultanément.
+    :param timeout: Délai maximal par tentative, en secondes (None : pas de limite).
+    :param retries: Nombre de nouvelles tentatives après un échec transitoire.
+    :param retry_delay: Délai de base entre deux tentatives, en secondes.
+    :param on_result: Fonction appelée avec chaque JobResult dès qu'il est connu.
+    :return: Liste des JobResult, dans l'ordre de fin d'exécution.
+    """
+    return asyncio.run(_run_all(jobs, max_concurrency, timeout, retries, retry_delay, on_result))
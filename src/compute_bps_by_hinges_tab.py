@@ -5,6 +5,10 @@ import argparse
 from collections import defaultdict
 from multiprocessing import Pool, cpu_count
 from tqdm import tqdm
+from annotation_parser import STRUCTURED_SUFFIX, load_structured_annotation
+from count_shards import counted_structures, filter_file_map, make_shard, resolve_structures, write_shard
+from sharding import add_shard_argument
+from ncm_store import list_all_fragments, open_fragment
 
 # Liste des paires de bases acceptées
 ACCEPTED_PAIRINGS = [
@@ -27,87 +31,211 @@ ACCEPTED_PAIRINGS = [
 pairing_regex = "|".join(map(re.escape, ACCEPTED_PAIRINGS))
 pairing_pattern = re.compile(rf"([AUGC])-([AUGC]).*?({pairing_regex})(?:\\s|$)", re.IGNORECASE)
 
-def extract_base_pairs(file_path):
+def extract_base_pairs_from_lines(lines):
+    """Retourne l'ensemble des paires de bases acceptées d'une annotation lue ligne par ligne."""
+    base_pairs = set()
+    inside_bp_section = False
+    for line in lines:
+        line = line.strip()
+        if line.startswith("Base-pairs"):
+            inside_bp_section = True
+            continue
+        elif line.startswith("Residue conformations"):
+            inside_bp_section = False
+        if inside_bp_section:
+            match = pairing_pattern.search(line)
+            if match:
+                base1, base2, _ = match.groups()
+                base_pairs.add(f"{base1.upper()}-{base2.upper()}")
+    return base_pairs
+
+def accepted_pairs_from_models(models):
+    """Retourne l'ensemble des paires de bases acceptées de modèles déjà analysés (AnnotationModel)."""
     base_pairs = set()
+    for model in models:
+        for _, _, base1, base2, description in model.base_pairs:
+            match = pairing_pattern.search(f"{base1}-{base2} {description}")
+            if match:
+                base1, base2, _ = match.groups()
+                base_pairs.add(f"{base1.upper()}-{base2.upper()}")
+    return base_pairs
+
+def read_base_pairs(f, file_name):
+    """Lit les paires de bases acceptées d'un fichier texte mc-annotate ou d'un résultat structuré (.json)."""
+    if file_name.endswith(STRUCTURED_SUFFIX):
+        return load_structured_annotation(f)[1]
+    return extract_base_pairs_from_lines(f)
+
+def extract_base_pairs(file_path):
     try:
         with open(file_path, "r") as f:
-            inside_bp_section = False
-            for line in f:
-                line = line.strip()
-                if line.startswith("Base-pairs"):
-                    inside_bp_section = True
-                    continue
-                elif line.startswith("Residue conformations"):
-                    inside_bp_section = False
-                if inside_bp_section:
-                    match = pairing_pattern.search(line)
-                    if match:
-                        base1, base2, _ = match.groups()
-                        base_pairs.add(f"{base1.upper()}-{base2.upper()}")
+            return read_base_pairs(f, file_path)
     except Exception as e:
         print(f"Erreur lors de la lecture de {file_path}: {e}")
-    return base_pairs
+        return set()
 
-def process_hinge_pair(args):
-    dir1, dir2, root_directory, file_map = args
+def parse_annotation_file(args):
+    """Analyse un fichier d'annotation (répertoire ou archive NCM) et retourne sa clé d'index avec ses paires de bases."""
+    dir_name, file_name, root_directory = args
+    try:
+        with open_fragment(root_directory, dir_name, file_name) as f:
+            base_pairs = read_base_pairs(f, file_name)
+    except Exception as e:
+        print(f"Erreur lors de la lecture de {os.path.join(root_directory, dir_name, file_name)}: {e}")
+        base_pairs = set()
+    return (dir_name, file_name), frozenset(base_pairs)
+
+def build_annotation_index(root_directory, file_map, num_processes, use_multiprocessing=True):
+    """
+    Analyse chaque fichier d'annotation une seule fois.
+
+    Seuls les fichiers présents dans au moins deux répertoires peuvent participer
+    à un hinge : les autres ne sont pas lus.
+
+    :param root_directory: Répertoire contenant les sous-répertoires de motifs.
+    :param file_map: Dictionnaire {répertoire: ensemble des noms de fichiers}.
+    :param num_processes: Nombre maximal de processus à utiliser.
+    :param use_multiprocessing: Active l'analyse parallèle des fichiers.
+    :return: Dictionnaire {(répertoire, fichier): frozenset des paires de bases acceptées}.
+    """
+    occurrences = defaultdict(int)
+    for files in file_map.values():
+        for file_name in files:
+            occurrences[file_name] += 1
+    tasks = [(dir_name, file_name, root_directory)
+             for dir_name in sorted(file_map)
+             for file_name in sorted(file_map[dir_name]) if occurrences[file_name] > 1]
+
+    bp_index = {}
+    if use_multiprocessing and tasks:
+        num_processes = min(num_processes, len(tasks), cpu_count())
+        chunksize = max(1, len(tasks) // (num_processes * 4))
+        with Pool(processes=num_processes) as pool:
+            for key, base_pairs in tqdm(pool.imap_unordered(parse_annotation_file, tasks, chunksize=chunksize),
+                                        total=len(tasks), desc="Lecture des annotations"):
+                bp_index[key] = base_pairs
+    else:
+        for args in tqdm(tasks, desc="Lecture des annotations"):
+            key, base_pairs = parse_annotation_file(args)
+            bp_index[key] = base_pairs
+    return bp_index
+
+def process_hinge_pair(dir1, dir2, file_map, bp_index):
+    """Compte les paires de bases communes aux fichiers partagés par deux répertoires de motifs."""
     hinge_counts = defaultdict(int)
     hinge_key = f"{dir1}-{dir2}"
     common_files = file_map[dir1] & file_map[dir2]
     total_bps = 0
     for file_name in common_files:
-        path1 = os.path.join(root_directory, dir1, file_name)
-        path2 = os.path.join(root_directory, dir2, file_name)
-        bp_set1 = extract_base_pairs(path1)
-        bp_set2 = extract_base_pairs(path2)
-        common_pairs = bp_set1 & bp_set2
+        common_pairs = bp_index[(dir1, file_name)] & bp_index[(dir2, file_name)]
         total_bps += len(common_pairs)
         for pair in common_pairs:
             hinge_counts[pair] += 1
     return hinge_key, hinge_counts, total_bps
 
-def count_hinges(root_directory, num_processes, use_multiprocessing=True):
+def list_motif_files(root_directory, structures=None):
+    """
+    Retourne la liste triée des répertoires de motifs et le dictionnaire {répertoire: fichiers}.
+
+    root_directory peut contenir des sous-répertoires de fichiers ou des archives ncm_store.
+    Si structures est donné, seuls les fichiers de ces structures sont retenus (voir count_shards).
+    """
+    file_map = filter_file_map(list_all_fragments(root_directory), structures)
+    return sorted(file_map), file_map
+
+def count_hinges(root_directory, num_processes, use_multiprocessing=True, structures=None):
     hinge_counts = defaultdict(lambda: defaultdict(int))
-    directories = sorted([d for d in os.listdir(root_directory) if os.path.isdir(os.path.join(root_directory, d))])
-    file_map = {d: set(os.listdir(os.path.join(root_directory, d))) for d in directories}
-    tasks = [(directories[i], directories[j], root_directory, file_map)
-             for i in range(len(directories)) for j in range(i + 1, len(directories))]
-    
+    directories, file_map = list_motif_files(root_directory, structures)
+    bp_index = build_annotation_index(root_directory, file_map, num_processes, use_multiprocessing)
+
     total_bps = 0
-    
-    if use_multiprocessing:
-        num_processes = min(num_processes, len(tasks), cpu_count())
-        with Pool(processes=num_processes) as pool:
-            for hinge_key, counts, bps in tqdm(pool.imap_unordered(process_hinge_pair, tasks),
-                                               total=len(tasks), desc="Traitement des hinges"):
-                total_bps += bps
-                for pair, count in counts.items():
-                    hinge_counts[hinge_key][pair] += count
-    else:
-        for args in tqdm(tasks, desc="Traitement des hinges"):
-            hinge_key, counts, bps = process_hinge_pair(args)
+    for i in tqdm(range(len(directories)), desc="Traitement des hinges"):
+        for j in range(i + 1, len(directories)):
+            hinge_key, counts, bps = process_hinge_pair(directories[i], directories[j], file_map, bp_index)
             total_bps += bps
-            for pair, count in counts.items():
-                hinge_counts[hinge_key][pair] += count
+            # Ordre des paires fixé pour une sortie JSON reproductible
+            for pair in sorted(counts):
+                hinge_counts[hinge_key][pair] += counts[pair]
     
     print(f"Nombre total de paires de bases trouvées : {total_bps}")
     return hinge_counts
 
+def count_hinges_inverted(root_directory, num_processes, use_multiprocessing=True, structures=None):
+    """
+    Compte les hinges à partir d'un index inversé (fichier, paire de bases) -> répertoires.
+
+    Seules les combinaisons de répertoires qui partagent réellement une paire de bases
+    sont visitées. Le résultat est identique à celui de count_hinges.
+    """
+    _, file_map = list_motif_files(root_directory, structures)
+    bp_index = build_annotation_index(root_directory, file_map, num_processes, use_multiprocessing)
+
+    inverted_index = defaultdict(list)
+    for (dir_name, file_name), base_pairs in bp_index.items():
+        for pair in base_pairs:
+            inverted_index[(file_name, pair)].append(dir_name)
+
+    pair_counts = defaultdict(lambda: defaultdict(int))
+    total_bps = 0
+    for (_, pair), dir_names in tqdm(inverted_index.items(), desc="Traitement des hinges"):
+        dir_names.sort()
+        for i in range(len(dir_names)):
+            for j in range(i + 1, len(dir_names)):
+                pair_counts[(dir_names[i], dir_names[j])][pair] += 1
+                total_bps += 1
+
+    # Même ordre de clés que count_hinges (répertoires triés, puis paires triées)
+    hinge_counts = defaultdict(lambda: defaultdict(int))
+    for dir1, dir2 in sorted(pair_counts):
+        counts = pair_counts[(dir1, dir2)]
+        for pair in sorted(counts):
+            hinge_counts[f"{dir1}-{dir2}"][pair] = counts[pair]
+
+    print(f"Nombre total de paires de bases trouvées : {total_bps}")
+    return hinge_counts
+
 def main():
     parser = argparse.ArgumentParser(description="Analyse les hinges entre motifs NCMs à partir de fichiers .mc-annotate.")
-    parser.add_argument("root_directory", help="Répertoire contenant les sous-répertoires de motifs (ex: 2_2, 4_3, etc.).")
+    parser.add_argument("root_directory", help="Répertoire contenant les sous-répertoires de motifs (ex: 2_2, 4_3, etc.) "
+                                               "ou leurs archives ncm_store.")
     parser.add_argument("-o", "--output", required=True, help="Fichier de sortie pour enregistrer les résultats en JSON.")
     parser.add_argument("-p", "--processes", type=int, default=max(1, cpu_count() // 2),
                         help="Nombre maximal de processus à utiliser (par défaut : moitié des cœurs CPU).")
     parser.add_argument("--multiprocessing", action="store_true",
-                        help="Activer le multiprocessing pour accélérer le traitement.")
+                        help="Activer le multiprocessing pour accélérer la lecture des annotations.")
+    parser.add_argument("--inverted-index", action="store_true",
+                        help="Compter via un index inversé (fichier, paire) -> répertoires plutôt que "
+                             "sur toutes les paires de répertoires.")
+    parser.add_argument("--annotation-db", action="store_true",
+                        help="root_directory est une base d'annotations (.npz) construite par annotation_db.py : "
+                             "les hinges sont comptés sans relire les fichiers texte.")
+    parser.add_argument("--files", default=None,
+                        help="Fichier listant les structures à compter (une par ligne) ; par défaut toutes.")
+    parser.add_argument("--shard-output", default=None,
+                        help="Écrire aussi les comptes dans un shard fusionnable (voir count_shards.py).")
+    add_shard_argument(parser)
     args = parser.parse_args()
-    
-    hinge_counts = count_hinges(args.root_directory, args.processes, args.multiprocessing)
+    if args.annotation_db and (args.files or args.shard_output or args.shard):
+        parser.error("--files, --shard et --shard-output ne s'appliquent qu'à un répertoire de NCMs")
+    structures = resolve_structures(args.root_directory, args.files, args.shard)
+
+    if args.annotation_db:
+        # Import local : annotation_db importe ACCEPTED_PAIRINGS depuis ce module
+        from annotation_db import count_hinges_from_db, load_annotation_db
+        hinge_counts = count_hinges_from_db(load_annotation_db(args.root_directory))
+    else:
+        count_function = count_hinges_inverted if args.inverted_index else count_hinges
+        hinge_counts = count_function(args.root_directory, args.processes, args.multiprocessing, structures)
 
     with open(args.output, "w") as f:
         json.dump(hinge_counts, f, indent=4)
     print(f"Résultat enregistré dans {args.output}")
 
+    if args.shard_output:
+        _, file_map = list_motif_files(args.root_directory, structures)
+        write_shard(make_shard("hinges", counted_structures(file_map), hinge_counts), args.shard_output)
+        print(f"Shard enregistré dans {args.shard_output}")
+
 if __name__ == "__main__":
     main()
 
@@ -1,39 +1,27 @@
 import csv
 import argparse
-import numpy as np
+import pandas as pd
+from table_engine import count_matrix, normalize
 
-def read_bp_counts(input_file):
-    """Lit le fichier CSV et retourne un dictionnaire des comptes des paires de bases."""
-    bases = ["A", "C", "G", "U"]
-    bp_counts = { (b1, b2): 0 for b1 in bases for b2 in bases }
-    total_pairs = 0
-
-    with open(input_file, newline="") as csvfile:
-        reader = csv.reader(csvfile)
-        next(reader)  # Ignorer l'en-tête
-
-        for row in reader:
-            pair, count, _ = row
-            count = int(count)
-            b1, b2 = pair.split("-")
-
-            # Ne pas fusionner (b1, b2) et (b2, b1)
-            if (b1, b2) in bp_counts:
-                bp_counts[(b1, b2)] += count
-            total_pairs += count
+BASES = ["A", "C", "G", "U"]
 
-    return bp_counts, total_pairs
+def read_bp_counts(input_file):
+    """
+    Lit le fichier CSV (paire, occurrences, ...) et retourne la matrice 4x4 des comptes des paires de bases.
+
+    :return: Matrice des comptes (lignes : première base, colonnes : seconde base, dans l'ordre de BASES)
+             et total de toutes les paires du fichier, y compris celles hors de la matrice.
+    """
+    table = pd.read_csv(input_file, usecols=[0, 1], header=0, names=["pair", "count"],
+                        dtype={"pair": str, "count": "int64"}, keep_default_na=False)
+    bases = table["pair"].str.split("-", n=1, expand=True).reindex(columns=[0, 1])
+    # Ne pas fusionner (b1, b2) et (b2, b1)
+    bp_counts = count_matrix(bases[0], bases[1], table["count"], BASES, BASES)
+    return bp_counts, int(table["count"].sum())
 
 def compute_probabilities(bp_counts, total_pairs):
     """Calcule la matrice des probabilités des paires de bases."""
-    bases = ["A", "C", "G", "U"]
-    bp_probabilities = np.zeros((4, 4))
-
-    for i, b1 in enumerate(bases):
-        for j, b2 in enumerate(bases):
-            bp_probabilities[i, j] = bp_counts[(b1, b2)] / total_pairs if total_pairs > 0 else 0
-
-    return bp_probabilities
+    return normalize(bp_counts, total=total_pairs)
 
 def save_matrix_to_csv(output_file, matrix):
     """Sauvegarde la matrice des probabilités dans un fichier CSV."""
@@ -54,8 +42,9 @@ def main():
 
     # Afficher les paires trouvées et leur total
     print("\nPaires de bases trouvées et occurrences :")
-    for pair, count in bp_counts.items():
-        print(f"{pair}: {count}")
+    for i, b1 in enumerate(BASES):
+        for j, b2 in enumerate(BASES):
+            print(f"{(b1, b2)}: {bp_counts[i, j]}")
     print(f"\nSomme totale des paires: {total_pairs}\n")
 
     # Calculer les probabilités
@@ -1,6 +1,6 @@
 import json
 import argparse
-import numpy as np
+from table_engine import count_matrix, normalize
 
 # Définition des NCMs d'intérêt
 NCM_ORDER = [
@@ -8,35 +8,24 @@ NCM_ORDER = [
     "1_2", "2_1", "1_3", "3_1", "2_5", "5_2", "3_4", "4_3", "4_4", "3_5", "5_3"
 ]
 
-def read_junction_counts(input_file):
-    """Lit le fichier JSON et retourne un dictionnaire des comptes des jonctions."""
-    junction_counts = { (ncm1, ncm2): 0 for ncm1 in NCM_ORDER for ncm2 in NCM_ORDER }
-    total_pairs = 0
+def read_junction_counts(input_file, ncm_order=NCM_ORDER):
+    """
+    Lit le fichier JSON et retourne la matrice des comptes des jonctions entre les NCMs de ncm_order.
 
+    :return: Matrice des comptes (lignes : premier NCM, colonnes : second NCM) et total des jonctions retenues.
+    """
     with open(input_file, "r") as jsonfile:
         data = json.load(jsonfile)
 
-        for junction, bp_dict in data.items():
-            ncm1, ncm2 = junction.split("-")
-
-            # Vérifier si les NCMs sont dans la liste d'intérêt
-            if ncm1 in NCM_ORDER and ncm2 in NCM_ORDER:
-                count = sum(bp_dict.values())  # Total des paires pour cette jonction
-                junction_counts[(ncm1, ncm2)] += count
-                total_pairs += count  # Ajouter au total général
-
-    return junction_counts, total_pairs
+    junctions = [junction.split("-") for junction in data]
+    # Total des paires pour chaque jonction ; les NCMs hors de ncm_order sont ignorés
+    junction_counts = count_matrix([ncm1 for ncm1, _ in junctions], [ncm2 for _, ncm2 in junctions],
+                                   [sum(bp_dict.values()) for bp_dict in data.values()], ncm_order, ncm_order)
+    return junction_counts, int(junction_counts.sum())
 
 def compute_probabilities(junction_counts, total_pairs):
     """Calcule la matrice des probabilités des jonctions."""
-    size = len(NCM_ORDER)
-    junction_probabilities = np.zeros((size, size))
-
-    for i, ncm1 in enumerate(NCM_ORDER):
-        for j, ncm2 in enumerate(NCM_ORDER):
-            junction_probabilities[i, j] = junction_counts[(ncm1, ncm2)] / total_pairs if total_pairs > 0 else 0
-
-    return junction_probabilities
+    return normalize(junction_counts, total=total_pairs)
 
 def save_matrix_to_csv(output_file, matrix):
     """Sauvegarde la matrice des probabilités dans un fichier CSV."""
@@ -48,17 +37,24 @@ def main():
     parser = argparse.ArgumentParser(description="Calcul des probabilités d'apparition des jonctions entre NCMs.")
     parser.add_argument("-i", "--input", required=True, help="Fichier JSON contenant les jonctions et leurs occurrences.")
     parser.add_argument("-o", "--output", required=True, help="Fichier de sortie pour enregistrer la matrice des probabilités.")
+    parser.add_argument("--ncm-order", default=None,
+                        help="Fichier listant les NCMs de la matrice, un par ligne (défaut: NCM_ORDER).")
     
     args = parser.parse_args()
+    ncm_order = NCM_ORDER
+    if args.ncm_order:
+        with open(args.ncm_order, "r") as f:
+            ncm_order = [line.strip() for line in f if line.strip()]
 
     # Lire les occurrences des jonctions
-    junction_counts, total_pairs = read_junction_counts(args.input)
+    junction_counts, total_pairs = read_junction_counts(args.input, ncm_order)
 
     # Afficher les jonctions trouvées et leur total
     print("\nJonctions trouvées et occurrences :")
-    for junction, count in junction_counts.items():
-        if count > 0:
-            print(f"{junction}: {count}")
+    for i, ncm1 in enumerate(ncm_order):
+        for j, ncm2 in enumerate(ncm_order):
+            if junction_counts[i, j] > 0:
+                print(f"{(ncm1, ncm2)}: {junction_counts[i, j]}")
     print(f"\nSomme totale des paires dans les jonctions valides: {total_pairs}\n")
 
     # Calculer les probabilités
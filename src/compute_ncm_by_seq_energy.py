@@ -1,7 +1,8 @@
 import argparse
 import csv
-import math
-from collections import defaultdict
+import numpy as np
+from seq_codec import dense_tables_to_frame, load_dense_tables, save_dense_tables, table_length
+from table_engine import DEFAULT_CHUNK_SIZE, format_rounded, iter_row_chunks, normalize, probabilities_to_energies
 
 # Ordre des colonnes souhaité
 ORDERED_NCM_COLUMNS = [
@@ -9,78 +10,158 @@ ORDERED_NCM_COLUMNS = [
     "2_1", "1_3", "3_1", "2_5", "5_2", "3_4", "4_3"
 ]
 
-def compute_probabilities(input_file, output_file, compute_energy):
-    """Calcule P(NCM | seq) ou l'énergie associée et produit un CSV."""
-    
-    # Chargement des données depuis le fichier CSV
-    with open(input_file, "r") as f:
+def iter_count_chunks(input_file, header, valid_ncm_columns, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Lit la table des occurrences par blocs de lignes.
+
+    Comme l'association colonne par colonne avec l'en-tête : une ligne courte est complétée par des
+    occurrences nulles, les valeurs au-delà de l'en-tête sont ignorées ; les lignes vides sont sautées.
+
+    :return: Itérateur de (séquences, matrice des occurrences (lignes, valid_ncm_columns)).
+    """
+    width = len(header)
+    # Une colonne répétée dans l'en-tête est additionnée
+    positions = [[i for i, col in enumerate(header) if i > 0 and col == ncm] for ncm in valid_ncm_columns]
+    with open(input_file, "r", newline="") as f:
         reader = csv.reader(f)
-        header = next(reader)  # Lire la première ligne (nom des colonnes)
-        
-        # Filtrer les colonnes valides en conservant l'ordre demandé
-        valid_ncm_columns = [col for col in ORDERED_NCM_COLUMNS if col in header]
-        
-        sequences = []
-        data = defaultdict(lambda: defaultdict(int))  # {sequence: {NCM: count}}
-        total_counts = defaultdict(int)  # {NCM: total_count}
-        total_sequences = 0  # Nombre total de NCM observés
-        
-        for row in reader:
-            seq = row[0]
-            sequences.append(seq)
-            for col, count in zip(header[1:], row[1:]):
-                if col not in valid_ncm_columns:  
-                    continue  # Ignorer les colonnes non requises
-                
-                count = int(count)
-                data[seq][col] += count
-                total_counts[col] += count
-                total_sequences += count
-
-    # Calcul des probabilités ou des énergies
-    results = []
-
-    for seq in sequences:
-        seq_prob = 1.0  # Probabilité de la séquence (supposition d'une distribution uniforme des nucléotides)
-        for nt in seq:
-            seq_prob *= (1 / 4)  # Hypothèse de nucléotides (A, U, G, C) équiprobables
-        
-        row_result = [seq]  # Ligne pour le CSV
-        for ncm in valid_ncm_columns:
-            if total_counts[ncm] == 0:  
-                P_ci_given_si = 0.0  # Éviter la division par zéro
-            else:
-                P_si_given_ci = data[seq][ncm] / total_counts[ncm]  # P(si | ci)
-                P_ci = total_counts[ncm] / total_sequences  # P(ci)
-                P_si = seq_prob  # P(si), basé sur les nucléotides
-                
-                P_ci_given_si = (P_si_given_ci * P_ci) / P_si if P_si > 0 else 0.0  # Bayes
+        next(reader, None)
+        for chunk in iter_row_chunks((row for row in reader if row), chunk_size):
+            cells = np.array([(row + ["0"] * width)[:width] for row in chunk], dtype=object)
+            counts = np.zeros((len(chunk), len(valid_ncm_columns)), dtype=np.int64)
+            for j, columns in enumerate(positions):
+                counts[:, j] = cells[:, columns].astype(np.int64).sum(axis=1)
+            yield cells[:, 0], counts
+
+def sum_repeated_sequences(input_file, header, valid_ncm_columns, repeated, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Additionne les occurrences des séquences présentes sur plusieurs lignes.
+
+    :param repeated: Ensemble des séquences répétées.
+    :return: Dictionnaire {séquence répétée: occurrences (valid_ncm_columns)}.
+    """
+    sums = {}
+    for sequences, counts in iter_count_chunks(input_file, header, valid_ncm_columns, chunk_size):
+        for seq, row in zip(sequences.tolist(), counts):
+            if seq in repeated:
+                sums[seq] = sums[seq] + row if seq in sums else row.copy()
+    return sums
+
+def compute_probabilities(input_file, output_file, compute_energy, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Calcule P(NCM | seq) ou l'énergie associée et produit un CSV.
+
+    Le fichier est lu deux fois par blocs de chunk_size lignes (totaux par NCM, puis calcul) : seul
+    l'ensemble des séquences est gardé en mémoire. Une séquence présente sur plusieurs lignes est
+    écrite sur chacune, avec la somme de ses occurrences (une lecture de plus dans ce cas).
+    """
+    with open(input_file, "r", newline="") as f:
+        header = next(csv.reader(f))  # Lire la première ligne (nom des colonnes)
+
+    # Filtrer les colonnes valides en conservant l'ordre demandé
+    valid_ncm_columns = [col for col in ORDERED_NCM_COLUMNS if col in header]
+
+    # Premier passage : nombre d'occurrences de chaque NCM et séquences répétées
+    total_counts = np.zeros(len(valid_ncm_columns), dtype=np.int64)
+    seen, repeated = set(), set()
+    for sequences, counts in iter_count_chunks(input_file, header, valid_ncm_columns, chunk_size):
+        total_counts += counts.sum(axis=0)
+        for seq in sequences.tolist():
+            if seq in seen:
+                repeated.add(seq)
+            seen.add(seq)
+    del seen
+    P_ci = normalize(total_counts)  # P(ci)
+    repeated_counts = (sum_repeated_sequences(input_file, header, valid_ncm_columns, repeated, chunk_size)
+                       if repeated else {})
+
+    with open(output_file, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["sequence"] + valid_ncm_columns)  # Écrire l'en-tête
+
+        # Second passage : calcul des probabilités ou des énergies
+        for sequences, counts in iter_count_chunks(input_file, header, valid_ncm_columns, chunk_size):
+            if repeated_counts:
+                for k, seq in enumerate(sequences.tolist()):
+                    if seq in repeated_counts:
+                        counts[k] = repeated_counts[seq]
+            # P(si), basé sur des nucléotides (A, U, G, C) équiprobables : 4^-len(seq)
+            lengths = np.fromiter((len(seq) for seq in sequences), dtype=np.int64, count=len(sequences))
+            P_si = np.ldexp(1.0, -2 * lengths)[:, None]
+            P_si_given_ci = normalize(counts, axis=0, total=total_counts)  # P(si | ci)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                P_ci_given_si = np.where(P_si > 0, (P_si_given_ci * P_ci) / P_si, 0.0)  # Bayes
+            P_ci_given_si[:, total_counts == 0] = 0.0  # Éviter la division par zéro
 
             if compute_energy:
-                # Calcul de l'énergie si P > 0, sinon valeur infinie
-                energy = -0.616 * math.log(P_ci_given_si * 66) if P_ci_given_si > 0 else float("inf")
-                row_result.append(round(energy, 6))  # Arrondi à 6 décimales
+                # Calcul de l'énergie si P > 0, sinon valeur infinie ; arrondi à 6 décimales
+                values = format_rounded(probabilities_to_energies(P_ci_given_si), 6)
             else:
-                row_result.append(round(P_ci_given_si, 6))  # Probabilité
+                values = format_rounded(P_ci_given_si, 6)  # Probabilité
+            writer.writerows([seq] + row for seq, row in zip(sequences.tolist(), values.tolist()))
 
-        results.append(row_result)
+def compute_dense_probabilities(count_tables, compute_energy):
+    """
+    Calcule P(NCM | seq) ou l'énergie associée à partir de tableaux denses d'occurrences
+    (compute_ncm_by_seq_tab --dense-output), pour toutes les séquences de la longueur de chaque NCM.
 
-    # Écriture des résultats dans le fichier de sortie CSV
+    :param count_tables: Dictionnaire {NCM: occurrences indexées par rang (seq_codec)}.
+    :return: Dictionnaire {NCM: probabilités ou énergies indexées par rang}, dans l'ordre ORDERED_NCM_COLUMNS.
+    """
+    valid_ncm_columns = [col for col in ORDERED_NCM_COLUMNS if col in count_tables]
+    total_counts = np.array([count_tables[ncm].sum() for ncm in valid_ncm_columns], dtype=np.int64)
+    P_ci = normalize(total_counts)  # P(ci)
+
+    tables = {}
+    for j, ncm in enumerate(valid_ncm_columns):
+        # Même calcul que compute_probabilities, colonne par colonne : P(si) = 4^-len(ncm)
+        P_si = np.ldexp(1.0, -2 * table_length(count_tables[ncm]))
+        P_si_given_ci = normalize(count_tables[ncm], total=total_counts[j])  # P(si | ci)
+        P_ci_given_si = (P_si_given_ci * P_ci[j]) / P_si  # Bayes
+        tables[ncm] = probabilities_to_energies(P_ci_given_si) if compute_energy else P_ci_given_si
+    return tables
+
+def write_dense_csv(tables, output_file, compute_energy):
+    """Écrit des tableaux denses de probabilités ou d'énergies au format CSV de compute_probabilities."""
+    # Une séquence d'une autre longueur que le NCM n'y est jamais observée : P = 0
+    frame = dense_tables_to_frame(tables, fill=np.inf if compute_energy else 0.0)
     with open(output_file, "w", newline="") as f:
         writer = csv.writer(f)
-        writer.writerow(["sequence"] + valid_ncm_columns)  # Écrire l'en-tête
-        writer.writerows(results)  # Écrire les données
+        writer.writerow(["sequence"] + list(frame.columns))
+        values = format_rounded(frame.to_numpy(), 6)
+        writer.writerows([seq] + row for seq, row in zip(frame.index.tolist(), values.tolist()))
 
 def main():
     parser = argparse.ArgumentParser(description="Calcule P(NCM | seq) ou l'énergie associée en utilisant la formule de Bayes.")
-    parser.add_argument("input_file", help="Fichier CSV contenant les séquences et occurrences des NCMs.")
-    parser.add_argument("-o", "--output_file", required=True, help="Fichier de sortie CSV contenant les résultats.")
+    parser.add_argument("input_file", nargs="?", help="Fichier CSV contenant les séquences et occurrences des NCMs.")
+    parser.add_argument("-o", "--output_file", help="Fichier de sortie CSV contenant les résultats.")
     parser.add_argument("-energy", action="store_true", help="Si activé, calcule l'énergie au lieu de la probabilité.")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f"Nombre de lignes traitées à la fois (défaut: {DEFAULT_CHUNK_SIZE}).")
+    parser.add_argument("--dense-input", default=None,
+                        help="Occurrences en tableaux denses (.npz de compute_ncm_by_seq_tab --dense-output) "
+                             "à la place du fichier CSV : toutes les séquences de chaque longueur sont traitées.")
+    parser.add_argument("--dense-output", default=None,
+                        help="Écrire les résultats en tableaux denses indexés par rang (.npz, nécessite --dense-input).")
 
     args = parser.parse_args()
-    
-    compute_probabilities(args.input_file, args.output_file, args.energy)
-    print(f"Résultats sauvegardés dans {args.output_file}")
+    if bool(args.input_file) == bool(args.dense_input):
+        parser.error("indiquer soit un fichier CSV, soit --dense-input")
+    if args.dense_output and not args.dense_input:
+        parser.error("--dense-output nécessite --dense-input")
+    if not args.output_file and not args.dense_output:
+        parser.error("indiquer au moins une sortie (-o ou --dense-output)")
+
+    if args.dense_input:
+        tables = compute_dense_probabilities(load_dense_tables(args.dense_input), args.energy)
+        if args.dense_output:
+            save_dense_tables(args.dense_output, tables)
+            print(f"Tableaux denses sauvegardés dans {args.dense_output}")
+        if args.output_file:
+            write_dense_csv(tables, args.output_file, args.energy)
+            print(f"Résultats sauvegardés dans {args.output_file}")
+    else:
+        compute_probabilities(args.input_file, args.output_file, args.energy, args.chunk_size)
+        print(f"Résultats sauvegardés dans {args.output_file}")
 
 if __name__ == "__main__":
     main()
@@ -1,82 +1,189 @@
 import os
 import argparse
+from collections import defaultdict
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 from multiprocessing import Pool
-from Bio.PDB import PDBParser
+from count_shards import counted_structures, filter_file_map, make_shard, resolve_structures, write_shard
+from sharding import add_shard_argument
+from ncm_store import iter_fragments, list_all_fragments
+from pdb_reader import read_model_sequences
+from seq_codec import encode_ranks, ncm_sequence_length, save_dense_tables
 
-def extract_sequences_from_pdb(pdb_file):
+def extract_sequences_from_pdb(pdb_file, use_biopython=False, text=None):
     """
     Extrait les séquences de tous les modèles dans un fichier PDB.
 
     :param pdb_file: chemin vers le fichier PDB
-    :return: liste de séquences (une par modèle)
+    :param use_biopython: si True, analyse le fichier avec Bio.PDB au lieu du lecteur par colonnes
+    :param text: contenu du fichier s'il a déjà été lu (ex: depuis une archive ncm_store)
+    :return: liste de séquences (une par chaîne de chaque modèle)
     """
-    parser = PDBParser(QUIET=True)
     try:
-        structure = parser.get_structure(os.path.basename(pdb_file), pdb_file)
+        models = read_model_sequences(pdb_file, use_biopython, text)
     except Exception as e:
         print(f"Erreur lors de l'analyse de {pdb_file}: {e}")
         return []
-    
-    model_sequences = []
 
-    for model in structure:
-        chain_sequences = []
-        for chain in model:
-            chain_seq = ""
-            for residue in chain:
-                res_id = residue.get_id()[1]  # Extraction du numéro de résidu (ex: 271 dans 'A271')
-                if isinstance(res_id, int):  # Vérifier que c'est bien un entier
-                    chain_seq += residue.get_resname().strip()
+    model_sequences = []
+    for chains in models:
+        for _, residue_names in chains:
+            chain_seq = "".join(residue_names)
             if chain_seq:
-                chain_sequences.append(chain_seq)
-        model_sequences.extend(chain_sequences)
+                model_sequences.append(chain_seq)
 
     return model_sequences
 
 
 
-def count_occurrences(ncm_type, ncm_sequences, query_sequences):
+def count_kmers(sequences, k, overlapping=False):
+    """
+    Compte toutes les sous-séquences de longueur k en un seul passage sur chaque séquence.
+
+    Par défaut, les occurrences d'une même sous-séquence ne se chevauchent pas et sont
+    retenues de gauche à droite, ce qui donne exactement le résultat de seq.count(kmer).
+
+    :param sequences: Liste des séquences à parcourir.
+    :param k: Longueur des sous-séquences.
+    :param overlapping: Si True, compte aussi les occurrences chevauchantes.
+    :return: Dictionnaire {sous-séquence: nombre d'occurrences}
+    """
+    counts = defaultdict(int)
+    if k <= 0:
+        return counts
+
+    for seq in sequences:
+        if overlapping:
+            for i in range(len(seq) - k + 1):
+                counts[seq[i:i + k]] += 1
+        else:
+            next_start = {}  # Première position où chaque sous-séquence peut être recomptée
+            for i in range(len(seq) - k + 1):
+                kmer = seq[i:i + k]
+                if i >= next_start.get(kmer, 0):
+                    counts[kmer] += 1
+                    next_start[kmer] = i + k
+    return counts
+
+
+def get_ncm_length(ncm_type):
+    """
+    Retourne le nombre de nucléotides d'un NCM à partir de son nom.
+
+    :param ncm_type: Nom du NCM ('n_m' pour double-strands ou 'p' pour single-strands).
+    :return: Longueur du NCM, ou None si le nom n'est pas valide.
+    """
+    try:
+        # Cas des NCM de type "n_m" (double-strands) ou "p" (single-strands, ex: "3", "4")
+        return ncm_sequence_length(ncm_type)
+    except ValueError:
+        print(f"⚠️ Ignoring invalid NCM type: {ncm_type}")
+        return None
+
+
+def count_occurrences(ncm_type, ncm_sequences, query_sequences, overlapping=False):
     """
     Compte les occurrences de chaque séquence dans un NCM donné.
 
     :param ncm_type: Nom du NCM ('n_m' pour double-strands ou 'p' pour single-strands).
     :param ncm_sequences: Liste des séquences contenues dans ce NCM.
     :param query_sequences: Liste des séquences recherchées.
+    :param overlapping: Si True, compte aussi les occurrences chevauchantes.
     :return: Dictionnaire {séquence: nombre d'occurrences dans ce NCM}
     """
-    # Vérifier si c'est un double-strand ou un single-strand
-    if "_" in ncm_type:  # Cas des NCM de type "n_m"
-        try:
-            n, m = map(int, ncm_type.split("_"))
-            ncm_length = n + m
-        except ValueError:
-            print(f"⚠️ Ignoring invalid NCM type: {ncm_type}")
-            return {}
-    else:  # Cas des single-strands (ex: "3", "4", etc.)
-        try:
-            ncm_length = int(ncm_type)
-        except ValueError:
-            print(f"⚠️ Ignoring invalid NCM type: {ncm_type}")
-            return {}
+    ncm_length = get_ncm_length(ncm_type)
+    if ncm_length is None:
+        return {}
+
+    # Toutes les requêtes ont la même longueur : un seul passage par séquence suffit
+    kmer_counts = count_kmers(ncm_sequences, ncm_length, overlapping)
+    return {seq: kmer_counts.get(seq, 0) for seq in query_sequences if len(seq) == ncm_length}
+
+
+# Paramètres partagés par les processus de calcul, initialisés une seule fois par init_worker
+_worker_queries = None
+_worker_use_biopython = False
+_worker_overlapping = False
+_worker_dense = False
+
+
+def init_worker(query_sequences, use_biopython, overlapping, dense=False):
+    """Transmet une seule fois par processus l'ensemble des séquences recherchées et les options."""
+    global _worker_queries, _worker_use_biopython, _worker_overlapping, _worker_dense
+    _worker_queries = set(query_sequences)
+    _worker_use_biopython = use_biopython
+    _worker_overlapping = overlapping
+    _worker_dense = dense
+
 
-    # Initialiser le comptage des occurrences
-    sequence_counts = {seq: 0 for seq in query_sequences if len(seq) == ncm_length}
+def iter_readable_fragments(database, ncm, pdb_files):
+    """
+    Parcourt les fichiers d'un lot comme iter_fragments, en isolant chaque fichier : un fichier
+    illisible est signalé puis ignoré, et la lecture reprend au fichier suivant.
+    """
+    names = sorted(pdb_files)
+    position = {name: k for k, name in enumerate(names)}
+    done = 0
+    while done < len(names):
+        try:
+            for pdb, text in iter_fragments(database, ncm, names[done:]):
+                done = position[pdb] + 1
+                yield pdb, text
+            return
+        except Exception as e:
+            print(f"Erreur lors de l'analyse de {os.path.join(database, ncm, names[done])}: {e}")
+            done += 1
+
+def process_pdb_chunk(task):
+    """
+    Analyse un lot de fichiers PDB d'un même NCM et compte les séquences recherchées.
 
-    for seq in ncm_sequences:
-        for query in sequence_counts:
-            sequence_counts[query] += seq.count(query)
+    Les fichiers du lot sont lus à la suite, depuis le répertoire du NCM ou son archive.
 
-    return sequence_counts
+    :param task: Tuple (base de NCMs, nom du NCM, liste de noms de fichiers PDB).
+    :return: Tuple (nom du NCM, nombre de fichiers traités, {séquence: occurrences non nulles},
+             rangs et occurrences de toutes les sous-séquences si les tableaux denses sont demandés).
+    """
+    database, ncm, pdb_files = task
+    ncm_length = get_ncm_length(ncm)
+    if ncm_length is None:
+        return ncm, len(pdb_files), {}, None
+
+    ncm_sequences = []
+    for pdb, text in iter_readable_fragments(database, ncm, pdb_files):
+        ncm_sequences.extend(extract_sequences_from_pdb(os.path.join(database, ncm, pdb), _worker_use_biopython, text))
+    kmer_counts = count_kmers(ncm_sequences, ncm_length, _worker_overlapping)
+    dense_counts = None
+    if _worker_dense:
+        # Sous-séquences codées sur 2 bits ; celles qui contiennent un autre caractère que A/C/G/U sont ignorées
+        ranks = encode_ranks(kmer_counts.keys(), ncm_length)
+        counts = np.fromiter(kmer_counts.values(), dtype=np.int64, count=len(ranks))
+        dense_counts = (ranks[ranks >= 0], counts[ranks >= 0])
+    return (ncm, len(pdb_files), {seq: count for seq, count in kmer_counts.items() if seq in _worker_queries},
+            dense_counts)
 
 
 def main():
     parser = argparse.ArgumentParser(description="Analyse les occurrences des séquences NCM dans des fichiers PDB")
-    parser.add_argument("-d", "--database", required=True, help="Répertoire contenant les NCMs")
+    parser.add_argument("-d", "--database", required=True,
+                        help="Répertoire contenant les NCMs (sous-répertoires ou archives ncm_store)")
     parser.add_argument("-s", "--sequences", required=True, help="Fichier contenant les séquences à rechercher")
     parser.add_argument("-o", "--output", required=True, help="Fichier CSV de sortie")
     parser.add_argument("-n", "--num_workers", type=int, default=4, help="Nombre de cœurs pour le multiprocessing")
+    parser.add_argument("--chunk_size", type=int, default=64, help="Nombre de fichiers PDB par tâche")
+    parser.add_argument("--biopython", action="store_true",
+                        help="Analyser les fichiers PDB avec Bio.PDB (plus lent) au lieu du lecteur par colonnes")
+    parser.add_argument("--overlapping", action="store_true",
+                        help="Compter aussi les occurrences chevauchantes (par défaut : comme str.count)")
+    parser.add_argument("--files", default=None,
+                        help="Fichier listant les structures à compter (une par ligne) ; par défaut toutes")
+    parser.add_argument("--shard-output", default=None,
+                        help="Écrire aussi les comptes dans un shard fusionnable (voir count_shards.py)")
+    add_shard_argument(parser)
+    parser.add_argument("--dense-output", default=None,
+                        help="Écrire aussi les occurrences de toutes les séquences, en tableaux denses indexés "
+                             "par rang (.npz, un tableau de 4^n valeurs par NCM, voir seq_codec.py)")
 
     args = parser.parse_args()
 
@@ -84,34 +191,53 @@ def main():
     with open(args.sequences, "r") as f:
         query_sequences = [line.strip() for line in f.readlines()]
 
-    # Récupérer les types de NCM disponibles
-    ncm_types = [d for d in os.listdir(args.database) if os.path.isdir(os.path.join(args.database, d))]
+    # Récupérer les types de NCM disponibles et leurs fichiers
+    structures = resolve_structures(args.database, args.files, args.shard)
+    files_by_ncm = filter_file_map(list_all_fragments(args.database), structures)
+    ncm_types = sorted(files_by_ncm)
 
-    # Construire les tâches pour multiprocessing
+    # Construire les tâches : des lots de fichiers, lus directement par les processus
     tasks = []
     for ncm in ncm_types:
-        pdb_files = [os.path.join(args.database, ncm, f) for f in os.listdir(os.path.join(args.database, ncm)) if f.endswith(".pdb")]
-        ncm_sequences = []
-        for pdb in pdb_files:
-            ncm_sequences.extend(extract_sequences_from_pdb(pdb))
-        tasks.append((ncm, ncm_sequences, query_sequences))
-
-    # Exécution parallèle avec barre de progression
-    with Pool(processes=args.num_workers) as pool:
-        results = list(tqdm(pool.starmap(count_occurrences, tasks), total=len(tasks), desc="Analyse des NCMs"))
-
-    # Fusion des résultats
-    final_counts = {seq: {ncm: 0 for ncm in ncm_types} for seq in query_sequences}
-    for ncm, result in zip(ncm_types, results):
-        for seq, count in result.items():
-            final_counts[seq][ncm] = count
-
-    # Sauvegarde en CSV
-    df = pd.DataFrame.from_dict(final_counts, orient="index")
+        pdb_files = sorted(f for f in files_by_ncm[ncm] if f.endswith(".pdb"))
+        for i in range(0, len(pdb_files), args.chunk_size):
+            tasks.append((args.database, ncm, pdb_files[i:i + args.chunk_size]))
+    total_files = sum(len(pdb_files) for _, _, pdb_files in tasks)
+
+    # Exécution parallèle : les comptes partiels sont fusionnés au fur et à mesure
+    merged_counts = {ncm: defaultdict(int) for ncm in ncm_types}
+    dense_tables = {}
+    if args.dense_output:
+        lengths = {ncm: get_ncm_length(ncm) for ncm in ncm_types}
+        dense_tables = {ncm: np.zeros(4 ** length, dtype=np.int64) for ncm, length in lengths.items() if length}
+    with Pool(processes=args.num_workers, initializer=init_worker,
+              initargs=(query_sequences, args.biopython, args.overlapping, bool(args.dense_output))) as pool:
+        with tqdm(total=total_files, desc="Analyse des NCMs", unit="fichier") as progress:
+            for ncm, num_files, counts, dense_counts in pool.imap_unordered(process_pdb_chunk, tasks):
+                for seq, count in counts.items():
+                    merged_counts[ncm][seq] += count
+                if dense_counts is not None:
+                    np.add.at(dense_tables[ncm], *dense_counts)
+                progress.update(num_files)
+
+    # Sauvegarde en CSV (une ligne par séquence recherchée, une colonne par NCM)
+    index = pd.Index(list(dict.fromkeys(query_sequences)))
+    df = pd.DataFrame({ncm: pd.Series(merged_counts[ncm], dtype="int64").reindex(index, fill_value=0)
+                       for ncm in ncm_types}, index=index)
     df.to_csv(args.output)
 
     print(f"✅ Analyse terminée. Résultats enregistrés dans {args.output}")
 
+    if args.dense_output:
+        save_dense_tables(args.dense_output, dense_tables)
+        print(f"Tableaux denses enregistrés dans {args.dense_output}")
+
+    if args.shard_output:
+        shard = make_shard("ncm_by_seq", counted_structures(files_by_ncm), merged_counts,
+                           ncm_types=ncm_types, queries=query_sequences)
+        write_shard(shard, args.shard_output)
+        print(f"Shard enregistré dans {args.shard_output}")
+
 
 if __name__ == "__main__":
     main()
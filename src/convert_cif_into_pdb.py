@@ -1,7 +1,22 @@
 import argparse
 import os
+import struct
+from multiprocessing import Pool, cpu_count
 from Bio import PDB
+from Bio.Data.IUPACData import atom_weights
 import string
+from pdb_reader import iter_cif_category, CIF_UNASSIGNED
+from sharding import add_shard_argument, select_shard
+
+# Enregistrements au format fixe produits par PDBIO
+ATOM_FORMAT = "%s%5i %-4s%c%3s %c%4i%c   %8.3f%8.3f%8.3f%6.2f%s      %4s%2s%2s\n"
+TER_FORMAT = "TER   %5i      %3s %c%4i%c" + " " * 54 + "\n"
+
+# Les coordonnées sont stockées en simple précision par Biopython : on reproduit l'arrondi
+FLOAT32_COORDS = struct.Struct("3f")
+
+class StreamingConversionUnsupported(Exception):
+    """Cas rare que la conversion directe ne reproduit pas : la conversion passe alors par Biopython."""
 
 def get_existing_chain_ids(structure):
     """Récupère tous les identifiants de chaînes existants dans une structure PDB."""
@@ -39,43 +54,235 @@ def convert_cif_to_pdb(cif_file, pdb_file):
     io.set_structure(structure)
     io.save(pdb_file)
 
-def batch_convert_cif_to_pdb(source_dir, dest_dir, issues_dir):
-    """Convertit tous les fichiers CIF d'un répertoire en fichiers PDB et gère les erreurs."""
+def format_b_factor(value):
+    """Formate un facteur B sur 6 caractères, comme PDBIO."""
+    if value < 1000:
+        text = f"{value:.2f}"
+        return f"{value:6.1f}" if len(text) > 6 else f"{value:6.2f}"
+    if value < 10000:
+        text = f"{value:.1f}"
+        return f"{value:6.0f}" if len(text) > 6 else f"{value:6.1f}"
+    return f"{int(min(value, 999999)):6d}"
+
+def read_cif_models(cif_file):
+    """
+    Lit la catégorie _atom_site d'un fichier CIF en regroupant les atomes comme MMCIFParser.
+
+    :return: Liste de modèles (numéro, {chaîne: {identifiant du résidu: (nom, {atome: atome ou {altloc: atome}})}}),
+             où chaque atome est un tuple (nom, altloc, x, y, z, occupation, facteur B, élément).
+    """
+    models = []
+    current_serial = None
+    current_chain = None
+    current_residue = None
+    with open(cif_file, "r") as f:
+        for row in iter_cif_category(f, "_atom_site"):
+            resseq = row.get("auth_seq_id", row.get("label_seq_id"))
+            if resseq == ".":
+                continue
+            if "pdbx_PDB_model_num" not in row:
+                raise StreamingConversionUnsupported("numéro de modèle absent")
+            element = row.get("type_symbol", "").upper()
+            if element.capitalize() not in atom_weights:
+                raise StreamingConversionUnsupported(f"élément non reconnu : {element}")
+
+            serial = int(row["pdbx_PDB_model_num"])
+            if not models or serial != current_serial:
+                current_serial = serial
+                models.append((serial, {}))
+                current_chain = current_residue = None
+            chains = models[-1][1]
+
+            chain_id = row["auth_asym_id"]
+            if chain_id != current_chain:
+                current_chain = chain_id
+                current_residue = None
+            residues = chains.setdefault(chain_id, {})
+
+            resname = row["label_comp_id"]
+            icode = row["pdbx_PDB_ins_code"]
+            if icode in CIF_UNASSIGNED:
+                icode = " "
+            if row["group_PDB"] == "HETATM":
+                hetero_flag = "W" if resname in ("HOH", "WAT") else "H_" + resname
+            else:
+                hetero_flag = " "
+            residue_id = (hetero_flag, int(resseq), icode)
+            if (residue_id, resname) != current_residue:
+                current_residue = (residue_id, resname)
+                if residue_id in residues:
+                    if hetero_flag != " ":
+                        raise ValueError(f"Résidu {residue_id} défini deux fois dans la chaîne {chain_id}")
+                    if residues[residue_id][0] != resname:
+                        raise StreamingConversionUnsupported(f"mutation ponctuelle au résidu {residue_id}")
+                else:
+                    residues[residue_id] = (resname, {})
+            atoms = residues[residue_id][1]
+
+            name = row["label_atom_id"]
+            altloc = row["label_alt_id"]
+            if altloc in CIF_UNASSIGNED:
+                altloc = " "
+            atom = (name, altloc, float(row["Cartn_x"]), float(row["Cartn_y"]), float(row["Cartn_z"]),
+                    float(row["occupancy"]), float(row["B_iso_or_equiv"]), element)
+            previous = atoms.get(name)
+            if altloc == " ":
+                # Atome déjà présent : le doublon est ignoré, comme dans MMCIFParser
+                if previous is None:
+                    atoms[name] = atom
+            elif previous is None:
+                atoms[name] = {altloc: atom}
+            elif isinstance(previous, dict):
+                previous[altloc] = atom
+            else:
+                atoms[name] = {previous[1]: previous, altloc: atom}
+    return models
+
+def iter_atoms(atoms):
+    """Déplie les atomes d'un résidu, les positions alternatives étant triées par altloc."""
+    for atom in atoms.values():
+        if isinstance(atom, dict):
+            for altloc in sorted(atom, key=ord):
+                yield atom[altloc]
+        else:
+            yield atom
+
+def convert_cif_to_pdb_streaming(cif_file, pdb_file):
+    """
+    Convertit un fichier CIF en fichier PDB sans construire la structure Biopython.
+
+    Les lignes de _atom_site sont regroupées puis écrites directement en enregistrements
+    ATOM/HETATM à colonnes fixes, identiques à ceux de PDBIO (les enregistrements ANISOU
+    ne sont pas écrits). Les identifiants de chaîne trop longs sont remplacés comme dans
+    convert_cif_to_pdb.
+    """
+    models = read_cif_models(cif_file)
+    existing_chain_ids = {chain_id for _, chains in models for chain_id in chains}
+
+    lines = []
+    model_flag = len(models) > 1
+    for serial, chains in models:
+        atom_number = 1
+        if model_flag:
+            lines.append(f"MODEL      {serial}\n")
+        for chain_id, residues in chains.items():
+            # Si l'ID de chaîne est trop long (> 1 char), on le remplace
+            if len(chain_id) > 1:
+                print(f"Identifiant de chaîne trop long détecté : {chain_id}")
+                new_chain_id = generate_unique_chain_id(existing_chain_ids)
+                print(f"Remplacement par un identifiant unique : {new_chain_id}")
+                chain_id = new_chain_id
+                existing_chain_ids.add(new_chain_id)
+            for (hetero_flag, resseq, icode), (resname, atoms) in residues.items():
+                if resseq > 9999:
+                    raise ValueError(f"Numéro de résidu ({resseq}) trop grand pour le format PDB")
+                record_type = "ATOM  " if hetero_flag == " " else "HETATM"
+                for name, altloc, x, y, z, occupancy, bfactor, element in iter_atoms(atoms):
+                    if atom_number > 99999:
+                        raise ValueError(f"Numéro d'atome ({atom_number}) trop grand pour le format PDB")
+                    if len(name) < 4 and name[:1].isalpha() and len(element) < 2:
+                        name = " " + name
+                    x, y, z = FLOAT32_COORDS.unpack(FLOAT32_COORDS.pack(x, y, z))
+                    lines.append(ATOM_FORMAT % (record_type, atom_number, name, altloc, resname, chain_id,
+                                                resseq, icode, x, y, z, occupancy, format_b_factor(bfactor),
+                                                " ", element, "  "))
+                    atom_number += 1
+            lines.append(TER_FORMAT % (atom_number, resname, chain_id, resseq, icode))
+        if model_flag:
+            lines.append("ENDMDL\n")
+    lines.append("END   \n")
+
+    with open(pdb_file, "w") as f:
+        f.writelines(lines)
+
+def is_up_to_date(cif_file, pdb_file):
+    """Indique si le fichier PDB existe et est plus récent que le fichier CIF source."""
+    return os.path.exists(pdb_file) and os.path.getmtime(pdb_file) >= os.path.getmtime(cif_file)
+
+def convert_file(args):
+    """
+    Convertit un fichier dans un processus de calcul.
+
+    Le fichier PDB est d'abord écrit sous un nom temporaire : un fichier interrompu
+    n'est jamais considéré comme à jour lors d'un lancement suivant.
+
+    :param args: Tuple (fichier CIF, fichier PDB, utiliser Biopython).
+    :return: Tuple (fichier CIF, fichier PDB, message d'erreur ou None).
+    """
+    cif_file, pdb_file, use_biopython = args
+    partial_file = pdb_file + ".part"
+    try:
+        if use_biopython:
+            convert_cif_to_pdb(cif_file, partial_file)
+        else:
+            try:
+                convert_cif_to_pdb_streaming(cif_file, partial_file)
+            except StreamingConversionUnsupported:
+                convert_cif_to_pdb(cif_file, partial_file)
+        os.replace(partial_file, pdb_file)
+        return cif_file, pdb_file, None
+    except Exception as e:
+        if os.path.exists(partial_file):
+            os.remove(partial_file)
+        return cif_file, pdb_file, str(e)
+
+def batch_convert_cif_to_pdb(source_dir, dest_dir, issues_dir, num_workers=1, force=False, use_biopython=False,
+                             shard=None):
+    """
+    Convertit tous les fichiers CIF d'un répertoire en fichiers PDB et gère les erreurs.
+
+    :param num_workers: Nombre de processus de conversion.
+    :param force: Si True, reconvertit aussi les fichiers dont le PDB est déjà à jour.
+    :param use_biopython: Si True, convertit avec MMCIFParser et PDBIO (plus lent).
+    :param shard: Partie des fichiers à convertir (sharding.ShardSpec), ou None pour tous.
+    """
     if not os.path.exists(dest_dir):
         os.makedirs(dest_dir)
     if not os.path.exists(issues_dir):
         os.makedirs(issues_dir)
 
-    for filename in os.listdir(source_dir):
+    tasks = []
+    skipped = 0
+    for filename in select_shard(sorted(os.listdir(source_dir)), shard):
         if filename.endswith(".cif"):
             cif_file = os.path.join(source_dir, filename)
             pdb_file = os.path.join(dest_dir, filename.replace(".cif", ".pdb"))
-            try:
-                convert_cif_to_pdb(cif_file, pdb_file)
+            if not force and is_up_to_date(cif_file, pdb_file):
+                skipped += 1
+                continue
+            tasks.append((cif_file, pdb_file, use_biopython))
+    if skipped:
+        print(f"{skipped} fichiers déjà convertis et à jour ignorés")
+
+    chunksize = max(1, len(tasks) // (num_workers * 4))
+    with Pool(processes=num_workers) as pool:
+        for cif_file, pdb_file, error in pool.imap_unordered(convert_file, tasks, chunksize):
+            if error is None:
                 print(f"Conversion terminée : {pdb_file}")
-            except Exception as e:
-                print(f"Erreur lors de la conversion de {filename}: {e}")
+            else:
+                filename = os.path.basename(cif_file)
+                print(f"Erreur lors de la conversion de {filename}: {error}")
                 issue_file = os.path.join(issues_dir, filename)
                 os.rename(cif_file, issue_file)
                 print(f"Fichier déplacé dans le répertoire des problèmes : {issue_file}")
 
-def get_dotb(lst, ln):
-
-    dotb = '.' * ln
-    for (i,j) in enumerate(lst):
-        dotb[i-1] = i
-        dotb[j-1] = j
-    return dotb
-
 if __name__ == "__main__":
     # Définir les arguments pour l'appel via la ligne de commande
     parser = argparse.ArgumentParser(description="Convertit des fichiers CIF en fichiers PDB.")
     parser.add_argument("source_dir", help="Répertoire contenant les fichiers CIF à convertir")
     parser.add_argument("dest_dir", help="Répertoire de destination pour les fichiers PDB convertis")
     parser.add_argument("issues_dir", help="Répertoire pour stocker les fichiers qui posent problème lors de la conversion")
+    parser.add_argument("-n", "--num_workers", type=int, default=cpu_count(),
+                        help="Nombre de processus de conversion (défaut: nombre de cœurs CPU)")
+    parser.add_argument("--force", action="store_true",
+                        help="Reconvertit aussi les fichiers dont le PDB est plus récent que le CIF")
+    parser.add_argument("--biopython", action="store_true",
+                        help="Convertit avec MMCIFParser et PDBIO plutôt qu'en lecture directe (plus lent)")
+    add_shard_argument(parser)
 
     # Analyser les arguments fournis
     args = parser.parse_args()
 
     # Appel de la fonction pour convertir les fichiers
-    batch_convert_cif_to_pdb(args.source_dir, args.dest_dir, args.issues_dir)
+    batch_convert_cif_to_pdb(args.source_dir, args.dest_dir, args.issues_dir,
+                             args.num_workers, args.force, args.biopython, args.shard)
@@ -2,72 +2,106 @@ import os
 import csv
 import argparse
 import multiprocessing
+from collections import Counter
 from tqdm import tqdm
+from count_shards import counted_structures, filter_file_map, make_shard, resolve_structures, write_shard
+from sharding import add_shard_argument
+from ncm_store import list_all_fragments, open_fragment
 
-def parse_pdb_models(pdb_file):
-    """Parse un fichier PDB et retourne une liste de numéros de résidus par modèle."""
+def parse_pdb_model_lines(lines):
+    """Parse les lignes d'un fichier PDB et retourne une liste de numéros de résidus par modèle."""
     models = []
     current_model = []
+    for line in lines:
+        if line.startswith("MODEL"):
+            current_model = []
+        elif line.startswith("ATOM") or line.startswith("HETATM"):
+            res_id = line[22:26].strip()
+            if res_id.isdigit():
+                current_model.append(int(res_id))
+        elif line.startswith("ENDMDL"):
+            if current_model:
+                models.append(current_model)
+    return models
+
+def parse_pdb_models(pdb_file):
+    """Parse un fichier PDB et retourne une liste de numéros de résidus par modèle."""
     try:
         with open(pdb_file, "r") as f:
-            for line in f:
-                if line.startswith("MODEL"):
-                    current_model = []
-                elif line.startswith("ATOM") or line.startswith("HETATM"):
-                    res_id = line[22:26].strip()
-                    if res_id.isdigit():
-                        current_model.append(int(res_id))
-                elif line.startswith("ENDMDL"):
-                    if current_model:
-                        models.append(current_model)
-        return models
+            return parse_pdb_model_lines(f)
     except Exception as e:
         print(f"Erreur avec le fichier {pdb_file}: {e}")
         return []
 
-def detect_junctions(pdb_path1, pdb_path2):
-    """Détecte le nombre de jonctions entre deux fichiers PDB."""
-    models1 = parse_pdb_models(pdb_path1)
-    models2 = parse_pdb_models(pdb_path2)
-
-    jonctions = 0
-    for model1 in models1:
-        last_res = model1[-1] if model1 else None
-        for model2 in models2:
-            first_res = model2[0] if model2 else None
-            if last_res is not None and first_res is not None and last_res + 1 == first_res:
-                jonctions += 1
-    return jonctions
-
-def process_ncm_pair(ncm1, ncm2, base_path, pdb_files):
+def summarize_pdb_models(args):
+    """
+    Résume un fichier PDB (répertoire ou archive NCM) par les bornes de ses modèles.
+
+    :return: clé (ncm, fichier), liste des derniers résidus et compteur des premiers résidus.
+    """
+    ncm, pdb_file, base_path = args
+    try:
+        with open_fragment(base_path, ncm, pdb_file) as f:
+            models = parse_pdb_model_lines(f)
+    except Exception as e:
+        print(f"Erreur avec le fichier {os.path.join(base_path, ncm, pdb_file)}: {e}")
+        models = []
+    last_residues = [model[-1] for model in models if model]
+    first_residues = Counter(model[0] for model in models if model)
+    return (ncm, pdb_file), (last_residues, first_residues)
+
+def detect_junctions(summary1, summary2):
+    """Détecte le nombre de jonctions entre deux fichiers PDB résumés par summarize_pdb_models."""
+    last_residues, _ = summary1
+    _, first_residues = summary2
+    return sum(first_residues[last_res + 1] for last_res in last_residues)
+
+def process_ncm_pair(ncm1, ncm2, pdb_files, summaries):
     """Compte les jonctions entre deux types de NCM."""
     total_junctions = 0
     for pdb_file in pdb_files:
-        pdb_path1 = os.path.join(base_path, ncm1, pdb_file)
-        pdb_path2 = os.path.join(base_path, ncm2, pdb_file)
-
-        if os.path.exists(pdb_path1) and os.path.exists(pdb_path2):
-            total_junctions += detect_junctions(pdb_path1, pdb_path2)
+        total_junctions += detect_junctions(summaries[(ncm1, pdb_file)], summaries[(ncm2, pdb_file)])
 
     return f"{ncm1}-{ncm2}", total_junctions
 
-def main(base_path, output_file=None, num_workers=4):
-    """Compte les jonctions entre toutes les paires de NCMs et les enregistre."""
-    ncm_types = sorted([d for d in os.listdir(base_path) if os.path.isdir(os.path.join(base_path, d))])
-    pdb_files_by_ncm = {ncm: os.listdir(os.path.join(base_path, ncm)) for ncm in ncm_types}
+def summarize_ncm_files(base_path, pdb_files_by_ncm, num_workers):
+    """Lit une seule fois chaque fichier présent dans au moins deux types de NCM."""
+    occurrences = Counter(f for files in pdb_files_by_ncm.values() for f in files)
+    tasks = [(ncm, pdb_file, base_path)
+             for ncm, files in pdb_files_by_ncm.items()
+             for pdb_file in sorted(files) if occurrences[pdb_file] > 1]
+
+    summaries = {}
+    if not tasks:
+        return summaries
+    chunksize = max(1, len(tasks) // (num_workers * 4))
+    with multiprocessing.Pool(processes=num_workers) as pool:
+        for key, summary in tqdm(pool.imap_unordered(summarize_pdb_models, tasks, chunksize=chunksize),
+                                 total=len(tasks), desc="Lecture des fichiers PDB"):
+            summaries[key] = summary
+    return summaries
+
+def main(base_path, output_file=None, num_workers=4, structures=None, shard_output=None):
+    """
+    Compte les jonctions entre toutes les paires de NCMs et les enregistre.
+
+    :param structures: Si donné, seuls les fichiers de ces structures sont comptés (voir count_shards).
+    :param shard_output: Si donné, écrit aussi les comptes dans un shard fusionnable.
+    """
+    # base_path peut contenir des sous-répertoires de fichiers ou des archives ncm_store
+    pdb_files_by_ncm = filter_file_map(list_all_fragments(base_path), structures)
+    ncm_types = sorted(pdb_files_by_ncm)
+    summaries = summarize_ncm_files(base_path, pdb_files_by_ncm, num_workers)
 
-    tasks = []
+    results = []
+    common_counts = {}
     for i in range(len(ncm_types)):
         for j in range(i + 1, len(ncm_types)):  # Évite les doublons (ex: 2_3-5_2 == 5_2-2_3)
             ncm1, ncm2 = ncm_types[i], ncm_types[j]
-            common_pdbs = set(pdb_files_by_ncm[ncm1]) & set(pdb_files_by_ncm[ncm2])  # Fichiers communs
+            common_pdbs = pdb_files_by_ncm[ncm1] & pdb_files_by_ncm[ncm2]  # Fichiers communs
             if common_pdbs:
-                tasks.append((ncm1, ncm2, base_path, common_pdbs))
-
-    results = []
-    with multiprocessing.Pool(processes=num_workers) as pool:
-        for result in tqdm(pool.starmap(process_ncm_pair, tasks), total=len(tasks), desc="Analyse des jonctions"):
-            results.append(result)
+                results.append(process_ncm_pair(ncm1, ncm2, common_pdbs, summaries))
+                common_counts[results[-1][0]] = len(common_pdbs)
 
     # Écriture des résultats dans un CSV
     if output_file:
@@ -77,11 +111,22 @@ def main(base_path, output_file=None, num_workers=4):
             writer.writerows(results)
         print(f"Résultats enregistrés dans {output_file}")
 
+    if shard_output:
+        counts = {key: {"junctions": total, "common_files": common_counts[key]} for key, total in results}
+        write_shard(make_shard("junctions", counted_structures(pdb_files_by_ncm), counts), shard_output)
+        print(f"Shard enregistré dans {shard_output}")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Compteur de jonctions entre paires de NCMs")
-    parser.add_argument("base_path", help="Chemin vers la base de données contenant les répertoires de NCMs")
+    parser.add_argument("base_path", help="Chemin vers la base de données contenant les répertoires (ou archives) de NCMs")
     parser.add_argument("-o", "--output", help="Fichier de sortie CSV", default="ncm_junctions.csv")
     parser.add_argument("-n", "--num-workers", type=int, default=4, help="Nombre de processus parallèles")
+    parser.add_argument("--files", default=None,
+                        help="Fichier listant les structures à compter (une par ligne) ; par défaut toutes")
+    parser.add_argument("--shard-output", default=None,
+                        help="Écrire aussi les comptes dans un shard fusionnable (voir count_shards.py)")
+    add_shard_argument(parser)
 
     args = parser.parse_args()
-    main(args.base_path, args.output, args.num_workers)
+    structures = resolve_structures(args.base_path, args.files, args.shard)
+    main(args.base_path, args.output, args.num_workers, structures, args.shard_output)
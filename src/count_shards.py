@@ -0,0 +1,225 @@
+import os
+import csv
+import json
+import argparse
+import pandas as pd
+from annotation_parser import STRUCTURED_SUFFIX
+from ncm_store import list_all_fragments
+from sharding import in_shard, structure_key
+
+# Fichier de comptes partiels (shard) : JSON de schéma fixe
+#   format     : SHARD_FORMAT
+#   version    : SHARD_VERSION
+#   kind       : 'hinges', 'junctions' ou 'ncm_by_seq'
+#   structures : liste triée des structures comptées (voir structure_key)
+#   counts     : comptes à deux niveaux, entiers non nuls uniquement
+#       hinges     : {'ncm1-ncm2': {paire de bases: occurrences}}
+#       junctions  : {'ncm1-ncm2': {'junctions': jonctions, 'common_files': fichiers communs}}
+#       ncm_by_seq : {ncm: {séquence: occurrences}}
+#   ncm_types  : (ncm_by_seq) colonnes de la table, tous les types de NCM de la base
+#   queries    : (ncm_by_seq) séquences recherchées, dans l'ordre du fichier d'entrée
+# Les comptes sont additifs par structure : des shards de structures disjointes s'additionnent,
+# et le shard d'une structure retirée se soustrait.
+SHARD_FORMAT = "mcff-count-shard"
+SHARD_VERSION = 1
+SHARD_KINDS = ("hinges", "junctions", "ncm_by_seq")
+
+# Suffixes des fichiers lus par les scripts de comptage ; seuls ces fichiers désignent une structure
+STRUCTURE_SUFFIXES = (".pdb", ".mc-annotate", STRUCTURED_SUFFIX)
+
+class ShardMismatch(Exception):
+    """Shards incompatibles (type, séquences recherchées ou structures)."""
+
+def read_structure_list(path):
+    """Lit un fichier de structures (une par ligne, nom de fichier ou identifiant) et retourne leurs identifiants."""
+    with open(path, "r") as f:
+        return {structure_key(line.strip()) for line in f if line.strip()}
+
+def resolve_structures(root, files=None, shard=None):
+    """
+    Structures à compter d'après les options --files et --shard d'un script de comptage.
+
+    :param root: Répertoire de NCMs (sous-répertoires ou archives ncm_store).
+    :param files: Fichier listant les structures (une par ligne), ou None pour toutes.
+    :param shard: Partie de la partition (sharding.ShardSpec), ou None.
+    :return: Ensemble d'identifiants de structures, ou None pour toutes.
+    """
+    structures = read_structure_list(files) if files else None
+    if shard is None:
+        return structures
+    return {key for key in counted_structures(list_all_fragments(root))
+            if in_shard(key, shard) and (structures is None or key in structures)}
+
+def filter_file_map(file_map, structures=None):
+    """
+    Restreint {type de NCM: fichiers} aux fichiers des structures données.
+
+    Les types de NCM sans fichier retenu sont conservés (ensemble vide).
+    """
+    if structures is None:
+        return file_map
+    return {ncm: {f for f in files if structure_key(f) in structures} for ncm, files in file_map.items()}
+
+def is_structure_file(name):
+    """Indique si un fichier est lu par les scripts de comptage (fragment .pdb ou annotation)."""
+    return name.endswith(STRUCTURE_SUFFIXES)
+
+def counted_structures(file_map):
+    """Liste triée des structures présentes dans {type de NCM: fichiers} (fichiers annexes exclus)."""
+    return sorted({structure_key(f) for files in file_map.values() for f in files if is_structure_file(f)})
+
+def pair_sort_key(key):
+    """Ordre des clés 'ncm1-ncm2' des compteurs : celui des types de NCM triés."""
+    return tuple(key.split("-"))
+
+def make_shard(kind, structures, counts, ncm_types=None, queries=None):
+    """
+    Construit un shard à partir de comptes à deux niveaux.
+
+    :param kind: Type de comptes (SHARD_KINDS).
+    :param structures: Structures comptées.
+    :param counts: Dictionnaire {clé: {sous-clé: entier}} ; les valeurs nulles sont ignorées.
+    :param ncm_types: (ncm_by_seq) Types de NCM de la base.
+    :param queries: (ncm_by_seq) Séquences recherchées.
+    """
+    if kind not in SHARD_KINDS:
+        raise ValueError(f"Type de shard inconnu : {kind}")
+    shard = {
+        "format": SHARD_FORMAT,
+        "version": SHARD_VERSION,
+        "kind": kind,
+        "structures": sorted(structures),
+        "counts": _combine({}, counts, 1),
+    }
+    if kind == "ncm_by_seq":
+        shard["ncm_types"] = sorted(ncm_types or [])
+        shard["queries"] = list(queries or [])
+    return shard
+
+def write_shard(shard, path):
+    """Écrit un shard (écriture atomique)."""
+    tmp_path = path + ".part"
+    with open(tmp_path, "w") as f:
+        json.dump(shard, f, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def load_shard(path):
+    """Lit et valide un shard."""
+    with open(path, "r") as f:
+        shard = json.load(f)
+    if shard.get("format") != SHARD_FORMAT or shard.get("version") != SHARD_VERSION:
+        raise ShardMismatch(f"{path} n'est pas un shard de comptes (version {SHARD_VERSION})")
+    if shard.get("kind") not in SHARD_KINDS:
+        raise ShardMismatch(f"{path} : type de shard inconnu {shard.get('kind')}")
+    return shard
+
+def _combine(total, counts, sign):
+    """Ajoute (sign=1) ou retire (sign=-1) des comptes à deux niveaux ; les zéros sont supprimés."""
+    result = {key: dict(values) for key, values in total.items()}
+    for key, values in counts.items():
+        target = result.setdefault(key, {})
+        for sub_key, value in values.items():
+            value = target.get(sub_key, 0) + sign * int(value)
+            if value < 0:
+                raise ShardMismatch(f"Compte négatif pour {key} / {sub_key}")
+            if value:
+                target[sub_key] = value
+            else:
+                target.pop(sub_key, None)
+        if not target:
+            del result[key]
+    return result
+
+def _check_compatible(shard1, shard2):
+    if shard1["kind"] != shard2["kind"]:
+        raise ShardMismatch(f"Types de shards différents : {shard1['kind']} et {shard2['kind']}")
+    if shard1["kind"] == "ncm_by_seq" and shard1["queries"] != shard2["queries"]:
+        raise ShardMismatch("Les shards n'ont pas été calculés sur les mêmes séquences recherchées")
+
+def merge_shards(shards):
+    """
+    Additionne des shards de même type portant sur des structures disjointes.
+
+    L'addition est associative et commutative : l'ordre des shards n'a pas d'importance.
+    """
+    merged = shards[0]
+    for shard in shards[1:]:
+        _check_compatible(merged, shard)
+        overlap = set(merged["structures"]) & set(shard["structures"])
+        if overlap:
+            raise ShardMismatch(f"{len(overlap)} structure(s) comptée(s) deux fois, ex: {sorted(overlap)[0]}")
+        merged = dict(merged,
+                      structures=sorted(set(merged["structures"]) | set(shard["structures"])),
+                      counts=_combine(merged["counts"], shard["counts"], 1))
+        if merged["kind"] == "ncm_by_seq":
+            merged["ncm_types"] = sorted(set(merged["ncm_types"]) | set(shard["ncm_types"]))
+    return merged
+
+def subtract_shard(total, removed):
+    """Retire d'un shard les comptes d'un shard de structures qu'il contient."""
+    _check_compatible(total, removed)
+    missing = set(removed["structures"]) - set(total["structures"])
+    if missing:
+        raise ShardMismatch(f"{len(missing)} structure(s) absente(s) du shard total, ex: {sorted(missing)[0]}")
+    return dict(total,
+                structures=sorted(set(total["structures"]) - set(removed["structures"])),
+                counts=_combine(total["counts"], removed["counts"], -1))
+
+def export_shard(shard, output_path):
+    """
+    Écrit les comptes d'un shard dans le format du script de comptage correspondant.
+
+    hinges : JSON de compute_bps_by_hinges_tab ; junctions : CSV de count_ncm_jonctions ;
+    ncm_by_seq : CSV de compute_ncm_by_seq_tab.
+    """
+    counts = shard["counts"]
+    if shard["kind"] == "hinges":
+        hinge_counts = {key: {pair: counts[key][pair] for pair in sorted(counts[key])}
+                        for key in sorted(counts, key=pair_sort_key)}
+        with open(output_path, "w") as f:
+            json.dump(hinge_counts, f, indent=4)
+    elif shard["kind"] == "junctions":
+        with open(output_path, "w", newline="") as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(["Jonction", "Occurrences"])
+            for key in sorted(counts, key=pair_sort_key):
+                writer.writerow([key, counts[key].get("junctions", 0)])
+    else:
+        index = pd.Index(list(dict.fromkeys(shard["queries"])))
+        df = pd.DataFrame({ncm: pd.Series(counts.get(ncm, {}), dtype="int64").reindex(index, fill_value=0)
+                           for ncm in shard["ncm_types"]}, index=index)
+        df.to_csv(output_path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Fusion, soustraction et export de comptes partiels (shards).")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    merge_parser = subparsers.add_parser("merge", help="Additionne des shards de structures disjointes")
+    merge_parser.add_argument("shards", nargs="+", help="Shards à additionner")
+    merge_parser.add_argument("-o", "--output", required=True, help="Shard de sortie")
+
+    subtract_parser = subparsers.add_parser("subtract", help="Retire d'un shard les comptes d'autres shards")
+    subtract_parser.add_argument("total", help="Shard total")
+    subtract_parser.add_argument("removed", nargs="+", help="Shards des structures à retirer")
+    subtract_parser.add_argument("-o", "--output", required=True, help="Shard de sortie")
+
+    export_parser = subparsers.add_parser("export", help="Écrit un shard dans le format du script de comptage")
+    export_parser.add_argument("shard", help="Shard à exporter")
+    export_parser.add_argument("-o", "--output", required=True, help="Fichier de sortie (JSON ou CSV)")
+
+    args = parser.parse_args()
+    if args.command == "merge":
+        shard = merge_shards([load_shard(path) for path in args.shards])
+        write_shard(shard, args.output)
+    elif args.command == "subtract":
+        shard = load_shard(args.total)
+        for path in args.removed:
+            shard = subtract_shard(shard, load_shard(path))
+        write_shard(shard, args.output)
+    else:
+        shard = load_shard(args.shard)
+        export_shard(shard, args.output)
+    print(f"{shard['kind']} : {len(shard['structures'])} structures, résultat enregistré dans {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+import os
+import csv
+import json
+import struct
+import argparse
+import numpy as np
+import pandas as pd
+from compute_bps_tab import BASES
+from compute_j2j_tab import NCM_ORDER
+from seq_codec import encode_keys, length_offset, load_dense_tables, table_length
+
+# Fichier binaire regroupant les tables d'énergie et de probabilités :
+#   en-tête fixe : BUNDLE_MAGIC, version (uint32), taille de l'en-tête JSON (uint64)
+#   en-tête JSON : vocabulaires (NCMs, paires, séquences...) et description de chaque tableau
+#                  (dtype, forme, position dans le fichier)
+#   tableaux     : données brutes, chacune alignée sur BUNDLE_ALIGNMENT octets
+# Les séquences de la table seq_energy sont identifiées par leur clé entière (seq_codec.encode_keys),
+# triée : la ligne d'une séquence est clé - première clé quand les clés sont contiguës.
+# Le fichier est projeté en mémoire (mmap) : les tableaux sont des vues sans copie, partagées
+# entre processus par le cache de pages.
+BUNDLE_MAGIC = b"MCFFBNDL"
+BUNDLE_VERSION = 2
+BUNDLE_ALIGNMENT = 64
+PREAMBLE = struct.Struct("<8sIQ")
+
+class BundleFormatError(Exception):
+    """Fichier qui n'est pas un bundle de tables, ou d'une version non prise en charge."""
+
+def _aligned(offset):
+    return -(-offset // BUNDLE_ALIGNMENT) * BUNDLE_ALIGNMENT
+
+def write_bundle(path, arrays, vocabularies, sources=None):
+    """
+    Écrit un bundle (écriture atomique).
+
+    :param path: Fichier de sortie.
+    :param arrays: Dictionnaire {nom: tableau NumPy}.
+    :param vocabularies: Dictionnaire {nom: liste d'étiquettes} (indices entiers des tableaux).
+    :param sources: Fichiers d'origine de chaque table, conservés pour information.
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    descriptions = {}
+    header = b""
+    # La position des tableaux dépend de la taille de l'en-tête, qui dépend des positions :
+    # on recalcule jusqu'à ce que l'en-tête (et donc les positions qu'il contient) ne change plus
+    while True:
+        offset = _aligned(PREAMBLE.size + len(header))
+        for name, array in arrays.items():
+            descriptions[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+            offset = _aligned(offset + array.nbytes)
+        new_header = json.dumps({"arrays": descriptions, "vocabularies": vocabularies,
+                                 "sources": sources or {}}, sort_keys=True).encode("utf-8")
+        if new_header == header:
+            break
+        header = new_header
+
+    tmp_path = path + ".part"
+    with open(tmp_path, "wb") as f:
+        f.write(PREAMBLE.pack(BUNDLE_MAGIC, BUNDLE_VERSION, len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            if f.tell() > descriptions[name]["offset"]:
+                raise BundleFormatError(f"{path} : position du tableau {name} incohérente avec l'en-tête")
+            f.write(b"\0" * (descriptions[name]["offset"] - f.tell()))
+            f.write(array.tobytes())
+    _check_round_trip(tmp_path, arrays)
+    os.replace(tmp_path, path)
+
+def _check_round_trip(path, arrays):
+    """Relit un bundle écrit et vérifie que chaque tableau est retrouvé à l'identique."""
+    bundle = EnergyBundle(path)
+    for name, array in arrays.items():
+        stored = bundle[name]
+        if (stored.dtype != array.dtype or stored.shape != array.shape
+                or not np.array_equal(stored.reshape(-1).view(np.uint8), array.reshape(-1).view(np.uint8))):
+            raise BundleFormatError(f"{path} : le tableau {name} relu diffère du tableau écrit")
+
+class EnergyBundle:
+    """
+    Lecture d'un bundle de tables projeté en mémoire.
+
+    Les tableaux sont des vues en lecture seule sur le fichier ; les recherches par NCM ou par
+    paire de bases passent par des dictionnaires (O(1)), celles par séquence par la clé entière de
+    la séquence (O(1) si les clés sont contiguës, recherche dichotomique sinon).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        if len(self._buffer) < PREAMBLE.size:
+            raise BundleFormatError(f"{path} : fichier trop court")
+        magic, version, header_size = PREAMBLE.unpack(self._buffer[:PREAMBLE.size].tobytes())
+        if magic != BUNDLE_MAGIC:
+            raise BundleFormatError(f"{path} n'est pas un bundle de tables")
+        if version != BUNDLE_VERSION:
+            raise BundleFormatError(f"{path} : version {version} non prise en charge (attendu : {BUNDLE_VERSION})")
+        header = json.loads(self._buffer[PREAMBLE.size:PREAMBLE.size + header_size].tobytes())
+        self.vocabularies = header["vocabularies"]
+        self.sources = header["sources"]
+        self.arrays = {}
+        for name, description in header["arrays"].items():
+            dtype = np.dtype(description["dtype"])
+            count = int(np.prod(description["shape"], dtype=np.int64))
+            start = description["offset"]
+            self.arrays[name] = (self._buffer[start:start + count * dtype.itemsize]
+                                 .view(dtype).reshape(description["shape"]))
+        self.ncm_index = {ncm: i for i, ncm in enumerate(self.vocabularies.get("ncms", []))}
+        self.base_index = {base: i for i, base in enumerate(self.vocabularies.get("bases", []))}
+        self.pair_index = {pair: i for i, pair in enumerate(self.vocabularies.get("pairs", []))}
+        self.transition_index = {key: i for i, key in enumerate(self.vocabularies.get("transitions", []))}
+        keys = self.arrays.get("sequence_keys")
+        self._contiguous_keys = keys is not None and (len(keys) == 0 or int(keys[-1]) - int(keys[0]) == len(keys) - 1)
+
+    def __contains__(self, name):
+        return name in self.arrays
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def sequence_indices(self, keys):
+        """Indices de clés de séquences (seq_codec.encode_keys) dans la table seq_energy ; -1 si absentes."""
+        table_keys = self.arrays["sequence_keys"]
+        keys = np.asarray(keys, dtype=np.int64)
+        if len(table_keys) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        if self._contiguous_keys:
+            indices = keys - table_keys[0]
+            return np.where((keys >= 0) & (indices >= 0) & (indices < len(table_keys)), indices, -1)
+        indices = np.minimum(np.searchsorted(table_keys, keys), len(table_keys) - 1)
+        return np.where((keys >= 0) & (table_keys[indices] == keys), indices, -1)
+
+    def sequence_index(self, sequence):
+        """Indice d'une séquence dans la table seq_energy, ou None si elle est absente."""
+        i = int(self.sequence_indices(encode_keys([sequence]))[0])
+        return None if i < 0 else i
+
+    def base_pair_energy(self, base1, base2):
+        """Énergie de la paire de bases base1-base2 (get_energy_tab sur compute_bps_tab)."""
+        return float(self.arrays["bp_energy"][self.base_index[base1], self.base_index[base2]])
+
+    def junction_energy(self, ncm1, ncm2):
+        """Énergie de la jonction ncm1-ncm2 (NaN si elle n'est pas dans la table)."""
+        return float(self.arrays["junction_energy"][self.ncm_index[ncm1], self.ncm_index[ncm2]])
+
+    def ncm_sequence_energy(self, ncm, sequence):
+        """Énergie d'une séquence dans un NCM (compute_ncm_by_seq_energy), NaN si elle est absente."""
+        i = self.sequence_index(sequence)
+        return float("nan") if i is None else float(self.arrays["seq_energy"][i, self.ncm_index[ncm]])
+
+    def hinge_probability(self, ncm1, ncm2, pair):
+        """P(paire | hinge ncm1-ncm2) (compute_pair_by_hinges_prob), NaN si absente."""
+        return float(self.arrays["hinge_prob"][self.ncm_index[ncm1], self.ncm_index[ncm2], self.pair_index[pair]])
+
+    def transition_probability(self, ncm1, ncm2, key):
+        """Probabilité de transition de la jonction ncm1-ncm2 (generate_transition_tab), NaN si absente."""
+        return float(self.arrays["transition_prob"][self.ncm_index[ncm1], self.ncm_index[ncm2],
+                                                    self.transition_index[key]])
+
+def read_matrix_csv(path):
+    """Lit une matrice CSV sans en-tête (ex: sortie de get_energy_tab) ; 'inf' est conservé."""
+    with open(path, "r", newline="") as f:
+        rows = [[float(value) for value in row] for row in csv.reader(f) if row]
+    return np.array(rows, dtype=np.float64).reshape(len(rows), -1)
+
+def read_sequence_table(path):
+    """
+    Lit une table séquence x NCM (sortie de compute_ncm_by_seq_energy) : clés des séquences, NCMs, valeurs.
+
+    Un fichier .npz (compute_ncm_by_seq_energy --dense-output) donne toutes les séquences des
+    longueurs des NCMs ; une séquence d'une autre longueur que le NCM y vaut NaN.
+    """
+    if path.endswith(".npz"):
+        tables = load_dense_tables(path)
+        columns = list(tables)
+        lengths = sorted({table_length(table) for table in tables.values()})
+        keys = np.concatenate([length_offset(n) + np.arange(4 ** n, dtype=np.int64) for n in lengths])
+        values = np.full((len(keys), len(columns)), np.nan)
+        starts = dict(zip(lengths, np.cumsum([0] + [4 ** n for n in lengths]).tolist()))
+        for j, ncm in enumerate(columns):
+            start = starts[table_length(tables[ncm])]
+            values[start:start + len(tables[ncm]), j] = tables[ncm]
+        return keys, columns, values
+    table = pd.read_csv(path, dtype={0: str}, keep_default_na=False, float_precision="round_trip")
+    keys = encode_keys(table.iloc[:, 0].tolist())
+    if (keys < 0).any():
+        print(f"⚠️ {int((keys < 0).sum())} séquence(s) non codable(s) ignorée(s) dans {path}")
+    values = table.iloc[:, 1:].to_numpy(dtype=np.float64)
+    return keys[keys >= 0], [str(ncm) for ncm in table.columns[1:]], values[keys >= 0]
+
+def read_nested_json(path):
+    """Lit une table JSON {'ncm1-ncm2': {clé: valeur}} en triplets (ncm1, ncm2, clé, valeur)."""
+    with open(path, "r") as f:
+        data = json.load(f)
+    entries = []
+    for junction, values in data.items():
+        ncm1, ncm2 = junction.split("-")
+        entries.extend((ncm1, ncm2, key, float(value)) for key, value in values.items())
+    return entries
+
+def nested_array(entries, ncm_index, key_index):
+    """Tableau (NCM, NCM, clé) rempli par des triplets ; les entrées absentes valent NaN."""
+    array = np.full((len(ncm_index), len(ncm_index), len(key_index)), np.nan, dtype=np.float64)
+    if entries:
+        ncm1, ncm2, key, value = zip(*entries)
+        array[[ncm_index[n] for n in ncm1], [ncm_index[n] for n in ncm2], [key_index[k] for k in key]] = value
+    return array
+
+def build_bundle(output_path, bp_energy=None, junction_energy=None, junction_ncm_order=NCM_ORDER,
+                 seq_energy=None, hinge_prob=None, transition_prob=None):
+    """
+    Regroupe les tables disponibles dans un bundle.
+
+    Les NCMs, paires de bases et clés de transition sont encodés par des indices entiers communs à
+    toutes les tables ; les séquences sont remplacées par leur clé entière (seq_codec), triée.
+
+    :param bp_energy: Matrice 4x4 (CSV, ordre BASES) des énergies des paires de bases.
+    :param junction_energy: Matrice (CSV) des énergies des jonctions, dans l'ordre junction_ncm_order.
+    :param seq_energy: Table séquence x NCM (CSV ou .npz dense de compute_ncm_by_seq_energy).
+    :param hinge_prob: JSON de compute_pair_by_hinges_prob.
+    :param transition_prob: JSON de generate_transition_tab.
+    """
+    sources = {}
+    tables = {}
+    if bp_energy:
+        tables["bp_energy"] = read_matrix_csv(bp_energy)
+        sources["bp_energy"] = bp_energy
+    if junction_energy:
+        tables["junction_energy"] = read_matrix_csv(junction_energy)
+        sources["junction_energy"] = junction_energy
+    if seq_energy:
+        tables["seq_energy"] = read_sequence_table(seq_energy)
+        sources["seq_energy"] = seq_energy
+    if hinge_prob:
+        tables["hinge_prob"] = read_nested_json(hinge_prob)
+        sources["hinge_prob"] = hinge_prob
+    if transition_prob:
+        tables["transition_prob"] = read_nested_json(transition_prob)
+        sources["transition_prob"] = transition_prob
+
+    # Vocabulaire commun des NCMs
+    ncms = set()
+    if "junction_energy" in tables:
+        ncms.update(junction_ncm_order)
+    if "seq_energy" in tables:
+        ncms.update(tables["seq_energy"][1])
+    for name in ("hinge_prob", "transition_prob"):
+        for ncm1, ncm2, _, _ in tables.get(name, []):
+            ncms.update((ncm1, ncm2))
+    ncms = sorted(ncms)
+    ncm_index = {ncm: i for i, ncm in enumerate(ncms)}
+    vocabularies = {"ncms": ncms, "bases": BASES}
+
+    arrays = {}
+    if "bp_energy" in tables:
+        arrays["bp_energy"] = tables["bp_energy"]
+    if "junction_energy" in tables:
+        matrix = tables["junction_energy"]
+        order = [ncm_index[ncm] for ncm in junction_ncm_order]
+        if matrix.shape != (len(order), len(order)):
+            raise ValueError(f"Matrice des jonctions {matrix.shape} incompatible avec {len(order)} NCMs")
+        arrays["junction_energy"] = np.full((len(ncms), len(ncms)), np.nan)
+        arrays["junction_energy"][np.ix_(order, order)] = matrix
+    if "seq_energy" in tables:
+        keys, columns, values = tables["seq_energy"]
+        order = np.argsort(keys, kind="stable")
+        arrays["sequence_keys"] = keys[order]
+        arrays["seq_energy"] = np.full((len(keys), len(ncms)), np.nan)
+        arrays["seq_energy"][:, [ncm_index[ncm] for ncm in columns]] = values[order]
+    if "hinge_prob" in tables:
+        vocabularies["pairs"] = sorted({key for _, _, key, _ in tables["hinge_prob"]})
+        pair_index = {pair: i for i, pair in enumerate(vocabularies["pairs"])}
+        arrays["hinge_prob"] = nested_array(tables["hinge_prob"], ncm_index, pair_index)
+    if "transition_prob" in tables:
+        vocabularies["transitions"] = sorted({key for _, _, key, _ in tables["transition_prob"]})
+        transition_index = {key: i for i, key in enumerate(vocabularies["transitions"])}
+        arrays["transition_prob"] = nested_array(tables["transition_prob"], ncm_index, transition_index)
+
+    write_bundle(output_path, arrays, vocabularies, sources)
+    return arrays
+
+def main():
+    parser = argparse.ArgumentParser(description="Regroupe les tables d'énergie et de probabilités dans un bundle binaire.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Construit un bundle à partir des tables CSV et JSON")
+    build_parser.add_argument("-o", "--output", required=True, help="Fichier bundle de sortie")
+    build_parser.add_argument("--bp-energy", help="Énergies des paires de bases (get_energy_tab sur compute_bps_tab)")
+    build_parser.add_argument("--junction-energy", help="Énergies des jonctions (get_energy_tab sur compute_j2j_tab)")
+    build_parser.add_argument("--junction-ncm-order", default=None,
+                              help="NCMs de la matrice des jonctions, un par ligne (défaut: NCM_ORDER)")
+    build_parser.add_argument("--seq-energy", help="Table séquence x NCM (compute_ncm_by_seq_energy, CSV ou .npz)")
+    build_parser.add_argument("--hinge-prob", help="P(paire | hinge) (compute_pair_by_hinges_prob)")
+    build_parser.add_argument("--transition-prob", help="Probabilités de transition (generate_transition_tab)")
+
+    info_parser = subparsers.add_parser("info", help="Affiche le contenu d'un bundle")
+    info_parser.add_argument("bundle", help="Fichier bundle")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        junction_ncm_order = NCM_ORDER
+        if args.junction_ncm_order:
+            with open(args.junction_ncm_order, "r") as f:
+                junction_ncm_order = [line.strip() for line in f if line.strip()]
+        arrays = build_bundle(args.output, args.bp_energy, args.junction_energy, junction_ncm_order,
+                              args.seq_energy, args.hinge_prob, args.transition_prob)
+        print(f"{len(arrays)} tableaux enregistrés dans {args.output}")
+    else:
+        bundle = EnergyBundle(args.bundle)
+        for name, array in bundle.arrays.items():
+            print(f"{name}: {array.dtype} {array.shape} ({bundle.sources.get(name, '-')})")
+        for name, labels in bundle.vocabularies.items():
+            print(f"{name}: {len(labels)} étiquettes")
+
+if __name__ == "__main__":
+    main()
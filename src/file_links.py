@@ -0,0 +1,53 @@
+import os
+import errno
+import shutil
+
+# Requête ioctl de clonage de fichier (reflink) sous Linux : btrfs, XFS, ...
+FICLONE = 0x40049409
+
+def reflink(source, destination):
+    """Crée destination comme clone copy-on-write de source (lève OSError si non supporté)."""
+    import fcntl
+
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(destination)
+            raise
+
+def link_or_copy(source, destination, allow_link=True):
+    """
+    Place source en destination sans dupliquer les données lorsque c'est possible.
+
+    Essaie dans l'ordre un lien physique, un clone copy-on-write (reflink) puis une copie.
+    Le fichier est créé sous un nom temporaire puis renommé : une destination existante
+    est remplacée.
+
+    :param allow_link: Si False, fait toujours une copie (les fichiers liés partagent leur contenu).
+    :return: Méthode utilisée : 'hardlink', 'reflink' ou 'copy'.
+    """
+    if os.path.isdir(destination):
+        destination = os.path.join(destination, os.path.basename(source))
+    tmp_path = destination + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    method = "copy"
+    if allow_link:
+        try:
+            os.link(source, tmp_path)
+            method = "hardlink"
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EACCES):
+                raise
+            try:
+                reflink(source, tmp_path)
+                method = "reflink"
+            except (OSError, ImportError):
+                pass
+    if method == "copy":
+        shutil.copy(source, tmp_path)
+    os.replace(tmp_path, destination)
+    return method
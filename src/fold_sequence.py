@@ -0,0 +1,600 @@
+import sys
+import csv
+import argparse
+from collections import namedtuple
+from multiprocessing import Pool, cpu_count
+import numpy as np
+from tqdm import tqdm
+from energy_bundle import EnergyBundle
+from seq_codec import ALPHABET, length_offset, ncm_sequence_length
+from table_engine import ENERGY_SCALE, probabilities_to_energies
+
+# Modèle de repliement : une structure est une suite d'hélices indépendantes sur la boucle externe ;
+# chaque hélice est une chaîne de NCMs emboîtés, terminée par un NCM tige-boucle.
+# Deux NCMs consécutifs partagent une paire de bases (hinge) :
+#   NCM 'p'   fermé par la paire (i, j) : j = i + p - 1
+#   NCM 'n_m' fermé par la paire (i, j) : brins i..i+n-1 et j-m+1..j, paire interne (i+n-1, j-m+1)
+# Énergie d'une structure :
+#   + énergie de chaque NCM pour sa séquence (brins concaténés, compute_ncm_by_seq_energy)
+#   + pour chaque hinge : énergie de la jonction des deux NCMs (get_energy_tab sur compute_j2j_tab)
+#     et énergie de la paire de bases dans ce hinge (P(paire | hinge), à défaut énergie de la paire)
+#   + énergie de la paire de bases qui ferme chaque hélice (get_energy_tab sur compute_bps_tab)
+# Une table absente du bundle compte pour 0 ; une entrée absente d'une table présente interdit le NCM,
+# la jonction ou la paire correspondante.
+# Le mode fonction de partition (FoldingModel.partition) somme les poids exp(-E / kT) des mêmes
+# décompositions : probabilités des paires de bases et tirages de structures (Ensemble).
+
+# Énergie thermique kT des poids de Boltzmann exp(-E / kT), celle de la conversion des probabilités
+# en énergies (table_engine)
+KT = ENERGY_SCALE
+
+# Paire de bases : indice 4 * code de la première base + code de la seconde (ordre ALPHABET)
+NUM_PAIRS = len(ALPHABET) ** 2
+
+# NCM d'une structure repliée : type et paire (i, j) qui le ferme, numérotée à partir de 1
+FoldedNcm = namedtuple("FoldedNcm", ["ncm", "i", "j"])
+
+# Résultat du repliement d'une séquence
+FoldResult = namedtuple("FoldResult", ["sequence", "structure", "energy", "ncms"])
+
+def get_dotb(lst, ln):
+    """
+    Structure en notation parenthésée (dot-bracket).
+
+    :param lst: Paires de bases (i, j), numérotées à partir de 1.
+    :param ln: Longueur de la séquence.
+    """
+    dotb = ["."] * ln
+    for i, j in lst:
+        i, j = min(i, j), max(i, j)
+        dotb[i - 1] = "("
+        dotb[j - 1] = ")"
+    return "".join(dotb)
+
+def ncm_strands(ncm_type):
+    """
+    Longueurs des brins d'un NCM repliable : (p,) pour une tige-boucle, (n, m) pour un double brin.
+
+    Retourne None pour un nom invalide ou un NCM dont un brin ne contient qu'une base (ex: '1_2') :
+    ses deux paires partageraient un nucléotide.
+    """
+    try:
+        strands = tuple(map(int, ncm_type.split("_")))
+    except ValueError:
+        return None
+    if len(strands) not in (1, 2) or min(strands) < 2:
+        return None
+    return strands
+
+def sequence_codes(sequence):
+    """Codes des nucléotides d'une séquence (ordre ALPHABET, T lu comme U) ; -1 pour un autre caractère."""
+    sequence = sequence.upper().replace("T", "U")
+    return np.array([ALPHABET.find(base) for base in sequence], dtype=np.int64)
+
+def window_ranks(codes, length):
+    """Rangs (seq_codec) des sous-séquences de longueur length à chaque position ; -1 si non codable."""
+    count = len(codes) - length + 1
+    if count <= 0:
+        return np.zeros(0, dtype=np.int64)
+    ranks = np.zeros(count, dtype=np.int64)
+    valid = np.ones(count, dtype=bool)
+    for k in range(length):
+        ranks = ranks * 4 + codes[k:k + count]
+        valid &= codes[k:k + count] >= 0
+    return np.where(valid, ranks, -1)
+
+def pair_indices(codes, i, j):
+    """Indices (NUM_PAIRS) des paires (i, j) ; -1 si une des bases n'est pas codable."""
+    return np.where((codes[i] >= 0) & (codes[j] >= 0), codes[i] * 4 + codes[j], -1)
+
+def logsumexp(values, axis):
+    """log(sum(exp(values))) selon un axe, sans dépassement ; -inf si toutes les valeurs valent -inf."""
+    peak = np.max(values, axis=axis, keepdims=True)
+    peak = np.where(np.isfinite(peak), peak, 0.0)
+    with np.errstate(divide="ignore"):
+        return np.log(np.sum(np.exp(values - peak), axis=axis)) + np.squeeze(peak, axis=axis)
+
+def gumbel_argmax(log_weights, rng):
+    """Tire un indice par ligne, avec une probabilité proportionnelle à exp(log_weights) (astuce de Gumbel)."""
+    return np.argmax(log_weights + rng.gumbel(size=log_weights.shape), axis=1)
+
+def _symmetric(matrix, combine):
+    """
+    Les tables de jonctions et de hinges n'ont qu'une orientation 'ncm1-ncm2' (NCMs triés) :
+    complète chaque entrée absente (NaN) par celle de l'orientation inverse.
+    """
+    transposed = np.swapaxes(matrix, 0, 1)
+    return np.where(np.isnan(matrix), transposed, combine(matrix, transposed))
+
+class FoldingModel:
+    """
+    Tables d'énergie du repliement, indexées par des entiers, tirées d'un bundle (energy_bundle).
+
+    Attributs :
+        types           : noms des NCMs repliables (ceux qui ont des énergies de séquences)
+        strands         : longueurs des brins de chaque type (voir ncm_strands)
+        sequence_energy : pour chaque type, énergies indexées par rang de séquence (seq_codec)
+        hinge_energy    : (type externe, type interne, paire) énergie d'un hinge
+        closing_energy  : (paire) énergie de la paire qui ferme une hélice
+    """
+
+    def __init__(self, bundle):
+        if "seq_energy" not in bundle:
+            raise ValueError(f"{bundle.path} : table des énergies des séquences (seq_energy) absente")
+        ncms = bundle.vocabularies["ncms"]
+        seq_energy = bundle["seq_energy"]
+        self.types, self.strands, self.sequence_energy = [], [], []
+        for column, ncm in enumerate(ncms):
+            strands = ncm_strands(ncm)
+            if strands is None or np.isnan(seq_energy[:, column]).all():
+                continue
+            length = ncm_sequence_length(ncm)
+            rows = bundle.sequence_indices(length_offset(length) + np.arange(4 ** length, dtype=np.int64))
+            energies = np.where(rows >= 0, seq_energy[np.maximum(rows, 0), column], np.nan)
+            self.types.append(ncm)
+            self.strands.append(strands)
+            self.sequence_energy.append(np.nan_to_num(energies, nan=np.inf, posinf=np.inf))
+        if not self.types:
+            raise ValueError(f"{bundle.path} : aucun type de NCM repliable (tige-boucle ou double brin) "
+                             f"dans la table seq_energy")
+        columns = [bundle.ncm_index[ncm] for ncm in self.types]
+        num_types = len(self.types)
+
+        # Énergie de la paire de bases seule (matrice 4x4, ordre BASES = ALPHABET)
+        if "bp_energy" in bundle:
+            pair_energy = np.asarray(bundle["bp_energy"], dtype=np.float64).ravel()
+            pair_energy = np.nan_to_num(pair_energy, nan=np.inf, posinf=np.inf)
+        else:
+            pair_energy = np.zeros(NUM_PAIRS)
+        self.closing_energy = pair_energy
+
+        if "junction_energy" in bundle:
+            junction = _symmetric(bundle["junction_energy"][np.ix_(columns, columns)], np.fmin)
+            junction = np.nan_to_num(junction, nan=np.inf, posinf=np.inf)
+        else:
+            junction = np.zeros((num_types, num_types))
+
+        if "hinge_prob" in bundle:
+            probabilities = _symmetric(bundle["hinge_prob"][np.ix_(columns, columns)], np.fmax)
+            pair_hinge = np.full((num_types, num_types, NUM_PAIRS), np.inf)
+            for pair, k in bundle.pair_index.items():
+                bases = pair.split("-")
+                if len(bases) == 2 and all(len(base) == 1 and base in ALPHABET for base in bases):
+                    index = ALPHABET.index(bases[0]) * 4 + ALPHABET.index(bases[1])
+                    pair_hinge[:, :, index] = probabilities_to_energies(np.nan_to_num(probabilities[:, :, k], nan=0.0))
+        else:
+            pair_hinge = np.tile(pair_energy, (num_types, num_types, 1))
+
+        # compute_bps_by_hinges_tab ne compte que les hinges entre NCMs de types différents : un hinge
+        # entre deux NCMs de même type (ex: empilement 2_2-2_2) n'a que l'énergie de sa paire
+        same = np.arange(num_types)
+        junction[same, same] = np.where(np.isfinite(junction[same, same]), junction[same, same], 0.0)
+        counted = np.isfinite(pair_hinge[same, same]).any(axis=1)
+        pair_hinge[same, same] = np.where(counted[:, None], pair_hinge[same, same], pair_energy)
+        self.hinge_energy = junction[:, :, None] + pair_hinge
+
+    @classmethod
+    def from_bundle(cls, path):
+        """Charge le modèle d'un fichier bundle."""
+        return cls(EnergyBundle(path))
+
+    def windows(self, codes):
+        """Rangs des sous-séquences de chaque longueur de brin, à chaque position (voir window_ranks)."""
+        return {length: window_ranks(codes, length) for length in {s for strands in self.strands for s in strands}}
+
+    def inner_span(self, t, d):
+        """Écart j - i de la paire interne d'un NCM t fermé par une paire d'écart d (None : tige-boucle)."""
+        strands = self.strands[t]
+        return None if len(strands) == 1 else d - (strands[0] - 1) - (strands[1] - 1)
+
+    def ncm_energies(self, codes, windows, d):
+        """
+        Énergies de séquence des NCMs fermés par les paires (i, i + d), pour tout i.
+
+        :return: Tableau (N - d, types) ; inf si le NCM ne peut pas être fermé par la paire.
+        """
+        count = len(codes) - d
+        energies = np.full((count, len(self.types)), np.inf)
+        for t, strands in enumerate(self.strands):
+            if len(strands) == 1:
+                if strands[0] - 1 != d:
+                    continue
+                ranks = windows[strands[0]][:count]
+            else:
+                n, m = strands
+                if self.inner_span(t, d) < 1:
+                    continue
+                first = windows[n][:count]
+                second = windows[m][d - m + 1:d - m + 1 + count]
+                ranks = np.where((first >= 0) & (second >= 0), first * 4 ** m + second, -1)
+            energies[:, t] = np.where(ranks >= 0, self.sequence_energy[t][np.maximum(ranks, 0)], np.inf)
+        return energies
+
+    def diagonal_pairs(self, codes, d):
+        """Paires (i, i + d) pour tout i (indices NUM_PAIRS, -1 si non codable) et énergie de fermeture d'hélice."""
+        count = len(codes) - d
+        pairs = pair_indices(codes, np.arange(count), np.arange(d, d + count))
+        closing = np.where(pairs >= 0, self.closing_energy[np.maximum(pairs, 0)], np.inf)
+        return pairs, closing
+
+    def fill(self, codes):
+        """
+        Remplit les tables de programmation dynamique, diagonale par diagonale.
+
+        Pour d = j - i, V[d] et W[d] sont des tableaux (N - d, types), ligne i :
+            V[d][i, t] : énergie minimale de la chaîne de NCMs fermée par la paire (i, j), de premier NCM t
+            W[d][i, t] : énergie minimale de la suite de la chaîne après un NCM t dont (i, j) est la
+                         paire interne (hinge compris)
+        Chaque diagonale ne dépend que de diagonales plus courtes : elle est calculée pour toutes
+        les positions i à la fois.
+        """
+        size = len(codes)
+        windows = self.windows(codes)
+        V, W = [None] * size, [None] * size
+        for d in range(1, size):
+            count = size - d
+            v = self.ncm_energies(codes, windows, d)
+            for t, strands in enumerate(self.strands):
+                inner = self.inner_span(t, d)
+                if inner is not None and inner >= 1:
+                    v[:, t] += W[inner][strands[0] - 1:strands[0] - 1 + count, t]
+            V[d] = v
+
+            pairs, _ = self.diagonal_pairs(codes, d)
+            hinge = self.hinge_energy[:, :, np.maximum(pairs, 0)].transpose(2, 0, 1)
+            w = np.min(v[:, None, :] + hinge, axis=2)
+            w[pairs < 0] = np.inf
+            W[d] = w
+        return V, W
+
+    def fold(self, sequence):
+        """
+        Structure d'énergie minimale d'une séquence.
+
+        :return: FoldResult (structure dot-bracket, énergie, NCMs de la structure).
+        """
+        codes = sequence_codes(sequence)
+        size = len(codes)
+        V, _ = self.fill(codes)
+
+        # Boucle externe : best[j] = énergie minimale du préfixe de longueur j
+        helix = np.full((size, size), np.inf)
+        for d in range(1, size):
+            _, closing = self.diagonal_pairs(codes, d)
+            helix[np.arange(size - d), np.arange(d, size)] = V[d].min(axis=1) + closing
+        best = np.zeros(size + 1)
+        start = np.full(size + 1, -1)
+        for j in range(size):
+            candidates = best[:j + 1] + helix[:j + 1, j]
+            i = int(np.argmin(candidates))
+            if candidates[i] < best[j]:
+                best[j + 1], start[j + 1] = candidates[i], i
+            else:
+                best[j + 1] = best[j]
+
+        ncms = []
+        j = size
+        while j > 0:
+            if start[j] < 0:
+                j -= 1
+                continue
+            i = int(start[j])
+            ncms.extend(self.traceback(V, codes, i, j - 1))
+            j = i
+        ncms.sort(key=lambda ncm: ncm.i)
+        pairs = [(ncm.i, ncm.j) for ncm in ncms]
+        pairs += [(ncm.i + strands[0] - 1, ncm.j - strands[1] + 1)
+                  for ncm, strands in ((ncm, ncm_strands(ncm.ncm)) for ncm in ncms) if len(strands) == 2]
+        return FoldResult(sequence, get_dotb(pairs, size), float(best[size]), ncms)
+
+    def traceback(self, V, codes, i, j):
+        """NCMs de la chaîne d'énergie minimale fermée par la paire (i, j) (indices à partir de 0)."""
+        ncms = []
+        t = int(np.argmin(V[j - i][i]))
+        while True:
+            ncms.append(FoldedNcm(self.types[t], i + 1, j + 1))
+            strands = self.strands[t]
+            if len(strands) == 1:
+                return ncms
+            n, m = strands
+            i, j = i + n - 1, j - m + 1
+            pair = int(pair_indices(codes, i, j))
+            t = int(np.argmin(V[j - i][i] + self.hinge_energy[t, :, pair]))
+
+    def partition(self, sequence):
+        """
+        Fonction de partition d'une séquence sur les mêmes décompositions que fold (voir Ensemble).
+
+        Les récurrences de fill sont reprises en espace logarithmique : min devient logsumexp et
+        les énergies E deviennent -E / kT.
+        """
+        codes = sequence_codes(sequence)
+        size = len(codes)
+        windows = self.windows(codes)
+        local, V, W = [None] * size, [None] * size, [None] * size
+        helix = np.full((size, size), -np.inf)
+        for d in range(1, size):
+            count = size - d
+            local[d] = -self.ncm_energies(codes, windows, d) / KT
+            v = local[d].copy()
+            for t, strands in enumerate(self.strands):
+                inner = self.inner_span(t, d)
+                if inner is not None and inner >= 1:
+                    v[:, t] += W[inner][strands[0] - 1:strands[0] - 1 + count, t]
+            V[d] = v
+
+            pairs, closing = self.diagonal_pairs(codes, d)
+            hinge = -self.hinge_energy[:, :, np.maximum(pairs, 0)].transpose(2, 0, 1) / KT
+            w = logsumexp(v[:, None, :] + hinge, axis=2)
+            w[pairs < 0] = -np.inf
+            W[d] = w
+            helix[np.arange(count), np.arange(d, size)] = logsumexp(v, axis=1) - closing / KT
+        return Ensemble(self, sequence, codes, local, V, helix)
+
+class Ensemble:
+    """
+    Ensemble de Boltzmann des structures d'une séquence (FoldingModel.partition).
+
+    Pour d = j - i, local[d] et V[d] sont des tableaux (N - d, types), ligne i, en log des poids :
+        local[d][i, t] : -E / kT de la séquence du NCM t fermé par la paire (i, j)
+        V[d][i, t]     : log de la somme des poids des chaînes fermées par (i, j), de premier NCM t
+    helix[i, j] est le log du poids des hélices fermées par (i, j) ; prefix[j] (suffix[i]) celui
+    des structures du préfixe de longueur j (du suffixe commençant en i).
+    """
+
+    def __init__(self, model, sequence, codes, local, V, helix):
+        self.model = model
+        self.sequence = sequence
+        self.codes = codes
+        self.local = local
+        self.V = V
+        self.helix = helix
+        size = len(codes)
+        self.prefix = np.zeros(size + 1)
+        for j in range(size):
+            self.prefix[j + 1] = np.logaddexp(self.prefix[j], logsumexp(self.prefix[:j + 1] + helix[:j + 1, j], axis=0))
+        self.suffix = np.zeros(size + 1)
+        for i in range(size - 1, -1, -1):
+            self.suffix[i] = np.logaddexp(self.suffix[i + 1], logsumexp(helix[i, i:] + self.suffix[i + 1:], axis=0))
+        self.log_partition = float(self.prefix[size])
+        self._outside = None
+
+    @property
+    def free_energy(self):
+        """Énergie libre de l'ensemble : -kT ln Z."""
+        return 0.0 - KT * self.log_partition
+
+    def outside(self):
+        """
+        Poids extérieurs (log) de chaque état V[d][i, t] : somme des poids de tout ce qui entoure
+        le NCM t fermé par (i, j) dans les structures qui le contiennent.
+
+        Calculés des diagonales les plus longues aux plus courtes : un état est soit fermeture
+        d'hélice sur la boucle externe, soit NCM interne d'un NCM double brin qui l'entoure.
+        """
+        if self._outside is not None:
+            return self._outside
+        model, size = self.model, len(self.codes)
+        num_types = len(model.types)
+        outside = [None] * size
+        for d in range(size - 1, 0, -1):
+            count = size - d
+            # Poids extérieur des NCMs t_o dont (i, j) est la paire interne
+            enclosing = np.full((count, num_types), -np.inf)
+            for t, (n, *rest) in enumerate(model.strands):
+                if not rest:
+                    continue
+                outer = d + (n - 1) + (rest[0] - 1)
+                if outer < size:
+                    enclosing[n - 1:n - 1 + size - outer, t] = outside[outer][:, t] + self.local[outer][:, t]
+            pairs, closing = model.diagonal_pairs(self.codes, d)
+            hinge = -model.hinge_energy[:, :, np.maximum(pairs, 0)].transpose(2, 0, 1) / KT
+            inner = logsumexp(enclosing[:, :, None] + hinge, axis=1)
+            inner[pairs < 0] = -np.inf
+            exterior = self.prefix[:count] + self.suffix[d + 1:] - closing / KT
+            outside[d] = np.logaddexp(inner, exterior[:, None])
+        self._outside = outside
+        return outside
+
+    def pair_probabilities(self):
+        """Matrice (N, N) des probabilités des paires (i, j), i < j (indices à partir de 0)."""
+        size = len(self.codes)
+        probabilities = np.zeros((size, size))
+        for d, outside in enumerate(self.outside()):
+            if outside is None:
+                continue
+            weights = logsumexp(self.V[d] + outside, axis=1) - self.log_partition
+            probabilities[np.arange(size - d), np.arange(d, size)] = np.minimum(np.exp(weights), 1.0)
+        return probabilities
+
+    def _flat_tables(self):
+        """Tables V et local mises bout à bout : l'état (i, j) est à la ligne offsets[j - i] + i."""
+        size = len(self.codes)
+        offsets = np.zeros(size, dtype=np.int64)
+        offsets[2:] = np.cumsum(size - np.arange(1, size - 1))
+        empty = np.zeros((0, len(self.model.types)))
+        V = np.concatenate([empty] + self.V[1:])
+        local = np.concatenate([empty] + self.local[1:])
+        return V, local, offsets
+
+    def sample(self, count, rng=None):
+        """
+        Tire des structures selon leur probabilité de Boltzmann (retour sur trace stochastique).
+
+        Tous les tirages avancent ensemble : à chaque étape, un choix est fait pour chacun d'eux
+        par une seule opération vectorisée (recherche dans des distributions cumulées pour la boucle
+        externe, astuce de Gumbel pour les NCMs).
+
+        :param count: Nombre de structures.
+        :param rng: Générateur numpy.random.Generator (par défaut : non déterministe).
+        :return: Liste de (structure dot-bracket, énergie).
+        """
+        rng = rng if rng is not None else np.random.default_rng()
+        model, codes, size = self.model, self.codes, len(self.codes)
+        energies = np.zeros(count)
+        structures = np.full((count, size), ord("."), dtype=np.uint8)
+        if size == 0 or count == 0:
+            return [("", 0.0)] * count
+
+        # Boucle externe : pour le préfixe de longueur j, choix i < j (hélice (i, j - 1)) ou j (base j - 1 libre)
+        choices = np.full((size + 1, size + 1), -np.inf)
+        for j in range(1, size + 1):
+            choices[j, :j] = self.prefix[:j] + self.helix[:j, j - 1]
+            choices[j, j] = self.prefix[j - 1]
+        cumulative = np.cumsum(np.exp(choices - self.prefix[:, None]), axis=1)
+        # Lignes décalées de 2 * j : une seule recherche dichotomique pour toutes les lignes
+        flat = (cumulative + 2 * np.arange(size + 1)[:, None]).ravel()
+
+        helices = []
+        position = np.full(count, size)
+        active = np.arange(count)
+        while len(active):
+            j = position[active]
+            choice = np.searchsorted(flat, rng.random(len(active)) + 2 * j, side="right") - j * (size + 1)
+            choice = np.minimum(choice, j)
+            paired = choice < j
+            helices.append((active[paired], choice[paired], j[paired] - 1))
+            position[active] = np.where(paired, choice, j - 1)
+            active = active[position[active] > 0]
+
+        sample_ids, i, j = (np.concatenate(parts) for parts in zip(*helices))
+        np.add.at(energies, sample_ids, model.closing_energy[codes[i] * 4 + codes[j]])
+
+        # Chaînes de NCMs : premier NCM de chaque hélice, puis NCM interne tant que le NCM est double brin
+        V, local, offsets = self._flat_tables()
+        n_strand = np.array([strands[0] for strands in model.strands])
+        m_strand = np.array([strands[-1] for strands in model.strands])
+        hairpin = np.array([len(strands) == 1 for strands in model.strands])
+        t = gumbel_argmax(V[offsets[j - i] + i], rng)
+        while len(sample_ids):
+            structures[sample_ids, i] = ord("(")
+            structures[sample_ids, j] = ord(")")
+            np.add.at(energies, sample_ids, -KT * local[offsets[j - i] + i, t])
+            keep = ~hairpin[t]
+            sample_ids, t = sample_ids[keep], t[keep]
+            i, j = i[keep] + n_strand[t] - 1, j[keep] - m_strand[t] + 1
+            pair = codes[i] * 4 + codes[j]
+            next_t = gumbel_argmax(V[offsets[j - i] + i] - model.hinge_energy[t, :, pair] / KT, rng)
+            np.add.at(energies, sample_ids, model.hinge_energy[t, next_t, pair])
+            t = next_t
+
+        return list(zip(structures.view(f"S{size}").ravel().astype(str).tolist(), energies.tolist()))
+
+def read_sequences(path):
+    """Lit des séquences (FASTA, ou une par ligne) : liste de (nom, séquence)."""
+    entries = []
+    name = None
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith(">"):
+                name = line[1:].strip()
+                entries.append((name, ""))
+            elif name is not None:
+                entries[-1] = (name, entries[-1][1] + line)
+            else:
+                entries.append((None, line))
+    return entries
+
+# Résultat du mode fonction de partition : énergie libre de l'ensemble, paires (i, j, probabilité)
+# au-dessus du seuil (numérotées à partir de 1) et structures tirées (structure, énergie)
+EnsembleResult = namedtuple("EnsembleResult", ["free_energy", "pairs", "samples"])
+
+_worker_model = None
+_worker_partition = None  # None, ou (seuil des probabilités, nombre de tirages, graine)
+
+def init_worker(bundle_path, partition=None):
+    """Charge une seule fois par processus le modèle (les tables du bundle sont partagées par mmap)."""
+    global _worker_model, _worker_partition
+    _worker_model = FoldingModel.from_bundle(bundle_path)
+    _worker_partition = partition
+
+def fold_entry(task):
+    index, (name, sequence) = task
+    result = _worker_model.fold(sequence)
+    if _worker_partition is None:
+        return name, result, None
+    cutoff, num_samples, seed = _worker_partition
+    ensemble = _worker_model.partition(sequence)
+    probabilities = ensemble.pair_probabilities()
+    i, j = np.nonzero(probabilities >= cutoff)
+    pairs = list(zip((i + 1).tolist(), (j + 1).tolist(), probabilities[i, j].tolist()))
+    # Graine propre à chaque séquence : les tirages ne dépendent pas de la répartition entre processus
+    rng = np.random.default_rng(None if seed is None else [seed, index])
+    samples = ensemble.sample(num_samples, rng) if num_samples else []
+    return name, result, EnsembleResult(ensemble.free_energy, pairs, samples)
+
+def format_result(name, result, ensemble=None):
+    """
+    Résultat au format de RNAfold : nom, séquence, structure et énergie ; en mode fonction de partition,
+    énergie libre de l'ensemble entre crochets puis une structure tirée par ligne.
+    """
+    lines = [f">{name}"] if name is not None else []
+    lines += [result.sequence, f"{result.structure} ({result.energy:.2f})"]
+    if ensemble is not None:
+        lines.append(f"{' ' * len(result.sequence)} [{ensemble.free_energy:.2f}]")
+        lines += [f"{structure} ({energy:.2f})" for structure, energy in ensemble.samples]
+    return "\n".join(lines) + "\n"
+
+def main():
+    parser = argparse.ArgumentParser(description="Replie des séquences d'ARN en chaînes de NCMs d'énergie minimale.")
+    parser.add_argument("sequences", nargs="*", help="Séquences à replier")
+    parser.add_argument("-b", "--bundle", required=True, help="Bundle des tables d'énergie (energy_bundle.py build)")
+    parser.add_argument("-i", "--input", default=None, help="Fichier de séquences (FASTA, ou une par ligne)")
+    parser.add_argument("-o", "--output", default=None, help="Fichier de sortie (défaut: sortie standard)")
+    parser.add_argument("-n", "--num_workers", type=int, default=1,
+                        help=f"Nombre de processus (défaut: 1, max: {cpu_count()})")
+    parser.add_argument("-p", "--partition", action="store_true",
+                        help="Calcule aussi la fonction de partition (énergie libre de l'ensemble)")
+    parser.add_argument("--bpp-output", default=None,
+                        help="Fichier CSV des probabilités des paires de bases (active -p)")
+    parser.add_argument("--bpp-cutoff", type=float, default=1e-3,
+                        help="Probabilité minimale des paires écrites (défaut: 0.001)")
+    parser.add_argument("--samples", type=int, default=0,
+                        help="Nombre de structures tirées dans l'ensemble de Boltzmann par séquence (active -p)")
+    parser.add_argument("--seed", type=int, default=None, help="Graine des tirages (défaut: non déterministe)")
+
+    args = parser.parse_args()
+    entries = [(None, sequence) for sequence in args.sequences]
+    if args.input:
+        entries += read_sequences(args.input)
+    if not entries:
+        parser.error("aucune séquence à replier")
+    partition = None
+    if args.partition or args.bpp_output or args.samples:
+        partition = (args.bpp_cutoff, args.samples, args.seed)
+    tasks = list(enumerate(entries))
+
+    out = open(args.output, "w") if args.output else sys.stdout
+    bpp_file = open(args.bpp_output, "w", newline="") if args.bpp_output else None
+    bpp_writer = csv.writer(bpp_file) if bpp_file else None
+    if bpp_writer:
+        bpp_writer.writerow(["sequence", "i", "j", "probability"])
+    try:
+        if args.num_workers > 1 and len(entries) > 1:
+            # imap conserve l'ordre des séquences d'entrée
+            with Pool(processes=min(args.num_workers, len(entries)), initializer=init_worker,
+                      initargs=(args.bundle, partition)) as pool:
+                results = tqdm(pool.imap(fold_entry, tasks), total=len(tasks),
+                               desc="Repliement", disable=out is sys.stdout)
+                for index, (name, result, ensemble) in enumerate(results):
+                    out.write(format_result(name, result, ensemble))
+                    if bpp_writer:
+                        bpp_writer.writerows([name or index + 1, i, j, p] for i, j, p in ensemble.pairs)
+        else:
+            init_worker(args.bundle, partition)
+            for index, task in enumerate(tasks):
+                name, result, ensemble = fold_entry(task)
+                out.write(format_result(name, result, ensemble))
+                if bpp_writer:
+                    bpp_writer.writerows([name or index + 1, i, j, p] for i, j, p in ensemble.pairs)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if bpp_file:
+            bpp_file.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,47 +1,35 @@
 import argparse
-import csv
-import math
-
-def compute_energy(probability, max_value):
-    """Calcule l'énergie avec la formule E = -0.616 * ln(p * 66) en gérant les erreurs."""
-    try:
-        probability = float(probability)  # Assure que la valeur est un float
-        if probability > 0:
-            energy = -0.616 * math.log(probability * 66)
-            if max_value is not None:
-                energy = min(energy, max_value)
-            return "{:.3f}".format(energy)  # Formatage en 3 décimales
-        else:
-            return "inf"  # Cas où p = 0
-    except (ValueError, TypeError):
-        return "error"  # Pour identifier une valeur mal formatée
-
-def process_energy_table(input_file, output_file, max_value):
-    """Convertit les probabilités en énergies et sauvegarde le fichier corrigé."""
-    
-    with open(input_file, "r") as f:
-        reader = csv.reader(f)
-        data = []
+import numpy as np
+from table_engine import DEFAULT_CHUNK_SIZE, format_fixed, map_csv_values, parse_float_array, probabilities_to_energies
+
+def compute_energies(probabilities, max_value):
+    """
+    Calcule les énergies E = -0.616 * ln(p * 66) d'un tableau de probabilités, en 3 décimales.
+
+    Les valeurs illisibles sont traitées comme des probabilités nulles : leur énergie est 'inf'.
+    """
+    values = parse_float_array(probabilities)
+    return format_fixed(probabilities_to_energies(np.nan_to_num(values, nan=0.0), max_value), 3)
 
-        for row in reader:
-            values = [float(p) if p.replace(".", "", 1).isdigit() else 0 for p in row]  # Toutes les colonnes
-            energies = [compute_energy(p, max_value) for p in values]
-            data.append(energies)
+def process_energy_table(input_file, output_file, max_value, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Convertit les probabilités en énergies et sauvegarde le fichier corrigé.
 
-    # Écriture du fichier de sortie
-    with open(output_file, "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerows(data)  # Écrit toutes les lignes sans en-tête
+    Le fichier est traité par blocs de chunk_size lignes : sa taille n'est pas limitée par la mémoire.
+    """
+    map_csv_values(input_file, output_file, lambda values: compute_energies(values, max_value), chunk_size)
 
 def main():
     parser = argparse.ArgumentParser(description="Convertit un tableau de probabilités en énergies.")
     parser.add_argument("input_file", help="Fichier CSV d'entrée contenant les probabilités.")
     parser.add_argument("-o", "--output_file", required=True, help="Fichier de sortie CSV des énergies.")
     parser.add_argument("-max_value", type=float, help="Valeur maximale pour l'énergie (ex: 1, 2, 3).")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f"Nombre de lignes traitées à la fois (défaut: {DEFAULT_CHUNK_SIZE}).")
 
     args = parser.parse_args()
     
-    process_energy_table(args.input_file, args.output_file, args.max_value)
+    process_energy_table(args.input_file, args.output_file, args.max_value, args.chunk_size)
     print(f"Résultats sauvegardés dans {args.output_file}")
 
 if __name__ == "__main__":
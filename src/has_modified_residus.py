@@ -1,58 +1,158 @@
 import os
-import shutil
-from Bio import PDB
+import json
+from multiprocessing import Pool, cpu_count
+from file_links import link_or_copy
+from pdb_reader import STANDARD_AMINO_ACIDS, STANDARD_NUCLEOTIDES, iter_residue_names
+from sharding import add_shard_argument, select_shard, shard_file_name
 
-def contient_residus_modifies(pdb_file):
+# Nom par défaut du manifeste écrit dans le répertoire de sortie
+MANIFEST_NAME = "residus_modifies.manifest.jsonl"
+
+def premier_residu_modifie(pdb_file, use_biopython=False):
+    """
+    Cherche le premier résidu non standard d'un fichier PDB.
+
+    Les noms de résidus sont lus en flux : la lecture s'arrête au premier résidu non standard.
+
+    Args:
+        pdb_file (str): Chemin vers le fichier PDB.
+        use_biopython (bool): Analyse le fichier avec Bio.PDB au lieu du lecteur par colonnes.
+
+    Returns:
+        str: Nom du premier résidu non standard, ou None si tous les résidus sont standards.
+    """
+    for resname in iter_residue_names(pdb_file, use_biopython):
+        # Les résidus standards de l'ARN et les acides aminés standards sont acceptés
+        if resname not in STANDARD_NUCLEOTIDES and resname.upper() not in STANDARD_AMINO_ACIDS:
+            return resname
+    return None
+
+def contient_residus_modifies(pdb_file, use_biopython=False):
     """
     Vérifie si un fichier PDB contient des résidus non standards.
 
     Args:
         pdb_file (str): Chemin vers le fichier PDB.
+        use_biopython (bool): Analyse le fichier avec Bio.PDB au lieu du lecteur par colonnes.
 
     Returns:
         bool: True s'il contient des résidus non standards, False sinon.
     """
-    parser = PDB.PDBParser(QUIET=True)
-    structure = parser.get_structure('structure', pdb_file)
+    return premier_residu_modifie(pdb_file, use_biopython) is not None
 
-    # Liste des résidus standards de l'ARN
-    residus_standards = {'A', 'C', 'G', 'U'}
+def analyser_fichier(args):
+    """
+    Analyse un fichier dans un processus de calcul.
 
-    for model in structure:
-        for chain in model:
-            for residue in chain:
-                if not PDB.is_aa(residue, standard=True) and residue.get_resname().strip() not in residus_standards:
-                    return True
-    return False
+    Args:
+        args (tuple): (chemin du fichier PDB, utiliser Bio.PDB).
+
+    Returns:
+        dict: Entrée du manifeste : fichier, statut ('clean', 'modified' ou 'error') et détail.
+    """
+    pdb_file, use_biopython = args
+    record = {"pdb": os.path.basename(pdb_file)}
+    try:
+        residu = premier_residu_modifie(pdb_file, use_biopython)
+    except Exception as e:
+        record.update(status="error", error=str(e))
+        return record
+    if residu is None:
+        record["status"] = "clean"
+    else:
+        record.update(status="modified", residue=residu)
+    return record
 
-def copier_fichiers_sans_residus_modifies(repertoire_entree, repertoire_sortie):
+def lire_manifeste(manifest_path, status="clean"):
     """
-    Parcourt un répertoire de fichiers PDB et copie ceux sans résidus modifiés dans un répertoire de sortie.
+    Lit un manifeste écrit par copier_fichiers_sans_residus_modifies.
+
+    Args:
+        manifest_path (str): Chemin du manifeste.
+        status (str): Statut des fichiers à retourner ('clean', 'modified' ou 'error'), None pour tous.
+
+    Returns:
+        list: Noms des fichiers ayant ce statut, dans l'ordre du manifeste.
+    """
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return [record["pdb"] for record in records if status is None or record["status"] == status]
+
+def copier_fichiers_sans_residus_modifies(repertoire_entree, repertoire_sortie, use_biopython=False, num_workers=1,
+                                          manifest_path=None, allow_link=True, manifest_only=False, shard=None):
+    """
+    Parcourt un répertoire de fichiers PDB et place ceux sans résidus modifiés dans un répertoire de sortie.
+
+    Les fichiers sont analysés en parallèle. Les fichiers retenus sont liés (lien physique, ou
+    clone copy-on-write) plutôt que copiés lorsque le système de fichiers le permet. Le statut
+    de chaque fichier est enregistré dans un manifeste JSON (une entrée par ligne).
 
     Args:
         repertoire_entree (str): Chemin vers le répertoire contenant les fichiers PDB.
         repertoire_sortie (str): Chemin vers le répertoire de sortie pour les fichiers sans résidus modifiés.
+        use_biopython (bool): Analyse les fichiers avec Bio.PDB au lieu du lecteur par colonnes.
+        num_workers (int): Nombre de processus d'analyse.
+        manifest_path (str): Chemin du manifeste (par défaut : MANIFEST_NAME dans repertoire_sortie).
+        allow_link (bool): Si False, les fichiers retenus sont toujours copiés.
+        manifest_only (bool): Si True, écrit seulement le manifeste, sans placer les fichiers.
+        shard (ShardSpec): Partie des fichiers à analyser (voir sharding.py) ; chaque partie écrit
+            son propre manifeste, à réunir avec sharding.py merge-manifests.
     """
     if not os.path.exists(repertoire_sortie):
         os.makedirs(repertoire_sortie)
+    manifest_path = manifest_path or shard_file_name(os.path.join(repertoire_sortie, MANIFEST_NAME), shard)
 
-    for fichier in os.listdir(repertoire_entree):
-        if fichier.endswith('.pdb'):
-            chemin_complet = os.path.join(repertoire_entree, fichier)
-            if not contient_residus_modifies(chemin_complet):
-                shutil.copy(chemin_complet, repertoire_sortie)
-                print(f"Copié: {fichier}")
-            else:
+    fichiers = sorted(os.path.join(repertoire_entree, f) for f in os.listdir(repertoire_entree) if f.endswith('.pdb'))
+    fichiers = select_shard(fichiers, shard)
+    tasks = [(fichier, use_biopython) for fichier in fichiers]
+    chunksize = max(1, len(tasks) // (num_workers * 4))
+
+    records = []
+    with Pool(processes=num_workers) as pool:
+        for record in pool.imap_unordered(analyser_fichier, tasks, chunksize):
+            fichier = record["pdb"]
+            if record["status"] == "clean":
+                if manifest_only:
+                    print(f"Sans résidus modifiés: {fichier}")
+                else:
+                    record["method"] = link_or_copy(os.path.join(repertoire_entree, fichier), repertoire_sortie,
+                                                    allow_link)
+                    print(f"Copié: {fichier}")
+            elif record["status"] == "modified":
                 print(f"Contient des résidus modifiés: {fichier}")
+            else:
+                print(f"Erreur avec le fichier {fichier}: {record['error']}")
+            records.append(record)
 
-if __name__ == "__main__":
-    import sys
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for record in sorted(records, key=lambda r: r["pdb"]):
+            f.write(json.dumps(record, sort_keys=True) + "\n")
+    os.replace(tmp_path, manifest_path)
+
+    clean = sum(record["status"] == "clean" for record in records)
+    print(f"{clean} fichiers sans résidus modifiés sur {len(records)}")
+    print(f"Manifeste enregistré dans {manifest_path}")
 
-    if len(sys.argv) != 3:
-        print("Usage: python script.py <repertoire_entree> <repertoire_sortie>")
-        sys.exit(1)
+if __name__ == "__main__":
+    import argparse
 
-    repertoire_entree = sys.argv[1]
-    repertoire_sortie = sys.argv[2]
+    parser = argparse.ArgumentParser(description="Copie les fichiers PDB sans résidus modifiés.")
+    parser.add_argument("repertoire_entree", help="Répertoire contenant les fichiers PDB")
+    parser.add_argument("repertoire_sortie", help="Répertoire de sortie pour les fichiers sans résidus modifiés")
+    parser.add_argument("--biopython", action="store_true",
+                        help="Analyser les fichiers avec Bio.PDB (plus lent) au lieu du lecteur par colonnes")
+    parser.add_argument("-n", "--num_workers", type=int, default=cpu_count(),
+                        help="Nombre de processus d'analyse (défaut: nombre de cœurs CPU)")
+    parser.add_argument("--manifest", default=None,
+                        help=f"Manifeste des fichiers analysés (défaut: {MANIFEST_NAME} dans repertoire_sortie)")
+    parser.add_argument("--copy", action="store_true",
+                        help="Toujours copier les fichiers retenus au lieu de créer des liens")
+    parser.add_argument("--manifest-only", action="store_true",
+                        help="Écrire seulement le manifeste, sans placer les fichiers dans repertoire_sortie")
+    add_shard_argument(parser)
+    args = parser.parse_args()
 
-    copier_fichiers_sans_residus_modifies(repertoire_entree, repertoire_sortie)
+    copier_fichiers_sans_residus_modifies(args.repertoire_entree, args.repertoire_sortie, args.biopython,
+                                          args.num_workers, args.manifest, not args.copy, args.manifest_only,
+                                          args.shard)
@@ -0,0 +1,103 @@
+import os
+import re
+from collections import namedtuple
+
+# Fichier regroupant tous les scripts : chaque script y est précédé d'une ligne portant le nom du NCM
+ALL_SCRIPTS_NAME = "all_scripts.mcs"
+
+# Nom du NCM d'après le nom du fichier de script (ex: 2_2-NNNN.mcs, 1_2_NNNN.mcs, 3-NNNN.mcs)
+SCRIPT_NAME_PATTERN = re.compile(r"^(.+?)[-_]N+\.mcs$")
+NCM_NAME_PATTERN = re.compile(r"^\w+$")
+
+# Grammaire des scripts : sequence( RNA A1 NN ) et relation( A1 B2 { pairing } ... )
+SEQUENCE_PATTERN = re.compile(r"sequence\(\s*(\w+)\s+([A-Za-z]+)(-?\d+)\s+([A-Za-z]+)\s*\)")
+RELATION_BLOCK_PATTERN = re.compile(r"relation\((.*?)\)", re.DOTALL)
+RELATION_PATTERN = re.compile(r"([A-Za-z]+)(-?\d+)\s+([A-Za-z]+)(-?\d+)\s*\{([^}]*)\}")
+
+# Brin d'un motif : nom (ex: 'A'), numéro de la première position, motif de bases (ex: 'NN')
+MotifStrand = namedtuple("MotifStrand", ["name", "first_position", "pattern"])
+# Relation entre deux positions (brin, numéro) avec ses propriétés (ex: ('pairing',))
+MotifRelation = namedtuple("MotifRelation", ["position1", "position2", "properties"])
+Motif = namedtuple("Motif", ["name", "strands", "relations"])
+
+def get_ncm_name(script_path):
+    """Retourne le nom du NCM décrit par un fichier de script .mcs."""
+    file_name = os.path.basename(script_path)
+    match = SCRIPT_NAME_PATTERN.match(file_name)
+    return match.group(1) if match else os.path.splitext(file_name)[0]
+
+def split_combined_scripts(text):
+    """
+    Découpe le contenu d'un fichier de type all_scripts.mcs.
+
+    :return: Liste de tuples (nom du NCM, texte du script), dans l'ordre du fichier.
+    """
+    scripts = []
+    name, lines = None, []
+    for line in text.splitlines():
+        if NCM_NAME_PATTERN.match(line.strip()):
+            if name is not None:
+                scripts.append((name, "\n".join(lines).strip() + "\n"))
+            name, lines = line.strip(), []
+        elif name is not None:
+            lines.append(line)
+    if name is not None:
+        scripts.append((name, "\n".join(lines).strip() + "\n"))
+    return scripts
+
+def load_motif_scripts(path):
+    """
+    Charge un ou plusieurs scripts de motifs.
+
+    :param path: Script .mcs unique, fichier combiné (ex: all_scripts.mcs) ou répertoire de scripts
+                 (dans ce cas, le fichier combiné qu'il contient est ignoré).
+    :return: Dictionnaire ordonné {nom du NCM: texte du script}.
+    """
+    if os.path.isdir(path):
+        entries = []
+        for file_name in sorted(os.listdir(path)):
+            if file_name.endswith(".mcs") and file_name != ALL_SCRIPTS_NAME:
+                with open(os.path.join(path, file_name), "r") as f:
+                    entries.append((get_ncm_name(file_name), f.read()))
+    else:
+        with open(path, "r") as f:
+            text = f.read()
+        first_line = next((line.strip() for line in text.splitlines() if line.strip()), "")
+        if NCM_NAME_PATTERN.match(first_line):
+            entries = split_combined_scripts(text)
+        else:
+            entries = [(get_ncm_name(path), text)]
+
+    scripts = {}
+    for name, text in entries:
+        if name in scripts:
+            print(f"⚠️ Script en double pour le NCM {name} : seul le premier est conservé")
+            continue
+        scripts[name] = text
+    return scripts
+
+def parse_motif_script(name, text):
+    """
+    Analyse un script .mcs de NCM.
+
+    Seules les instructions utilisées par les scripts du projet sont reconnues :
+    sequence( <molécule> <brin><position> <bases> ) et relation( <pos1> <pos2> { <propriétés> } ... ).
+
+    :param name: Nom du NCM.
+    :param text: Texte du script.
+    :return: Motif décrivant les brins et les relations du script.
+    """
+    strands = [MotifStrand(strand, int(position), pattern.upper())
+               for _, strand, position, pattern in SEQUENCE_PATTERN.findall(text)]
+    if not strands:
+        raise ValueError(f"Aucune instruction sequence() dans le script du NCM {name}")
+    strand_names = {strand.name for strand in strands}
+
+    relations = []
+    for block in RELATION_BLOCK_PATTERN.findall(text):
+        for strand1, position1, strand2, position2, properties in RELATION_PATTERN.findall(block):
+            if strand1 not in strand_names or strand2 not in strand_names:
+                raise ValueError(f"Brin inconnu dans la relation {strand1}{position1} {strand2}{position2} ({name})")
+            relations.append(MotifRelation((strand1, int(position1)), (strand2, int(position2)),
+                                           tuple(properties.split())))
+    return Motif(name, strands, relations)
@@ -0,0 +1,229 @@
+import os
+import csv
+import argparse
+from collections import defaultdict, namedtuple
+from multiprocessing import Pool, cpu_count
+from tqdm import tqdm
+from annotation_parser import parse_residue_id, read_annotation
+from mcs_scripts import load_motif_scripts, parse_motif_script
+from sharding import add_shard_argument, select_shard, shard_file_name
+
+# Bases acceptées pour chaque symbole des scripts (None : toutes les bases)
+BASE_SYMBOLS = {
+    "N": None,
+    "R": {"A", "G"},
+    "Y": {"C", "U"},
+    "A": {"A"},
+    "C": {"C"},
+    "G": {"G"},
+    "U": {"U"},
+}
+
+# Index d'un modèle annoté :
+#   residue_ids   : identifiants des résidus, dans l'ordre du fichier
+#   residue_names : noms des résidus
+#   run_end       : pour chaque résidu, indice du dernier résidu de son segment continu
+#   pairs         : {résidu: {résidu apparié: ensemble des mots de la description}}
+StructureIndex = namedtuple("StructureIndex", ["residue_ids", "residue_names", "run_end", "pairs"])
+
+# Occurrence d'un motif : résidus de chaque brin et séquence (brins concaténés dans l'ordre du script)
+MotifMatch = namedtuple("MotifMatch", ["ncm", "strands", "sequence"])
+
+def are_linked(residue1, residue2):
+    """Indique si deux résidus (chaîne, numéro, code d'insertion) se suivent dans une même chaîne."""
+    if residue1 is None or residue2 is None or residue1[0] != residue2[0]:
+        return False
+    return residue2[1] == residue1[1] + 1 or (residue2[1] == residue1[1] and residue2[2] != residue1[2])
+
+def build_structure_index(model):
+    """
+    Indexe un modèle annoté : segments continus de résidus et appariements par résidu.
+
+    :param model: AnnotationModel produit par annotation_parser.
+    :return: StructureIndex du modèle.
+    """
+    residue_ids = [res_id for res_id, _ in model.residues]
+    residue_names = [name.upper() for _, name in model.residues]
+    position = {res_id: i for i, res_id in enumerate(residue_ids)}
+
+    parsed = [parse_residue_id(res_id) for res_id in residue_ids]
+    run_end = list(range(len(residue_ids)))
+    for i in range(len(residue_ids) - 2, -1, -1):
+        if are_linked(parsed[i], parsed[i + 1]):
+            run_end[i] = run_end[i + 1]
+
+    pairs = defaultdict(dict)
+    for res1, res2, _, _, description in model.base_pairs:
+        if res1 in position and res2 in position:
+            i, j = position[res1], position[res2]
+            tokens = set(description.lower().split())
+            pairs[i][j] = pairs[i].get(j, set()) | tokens
+            pairs[j][i] = pairs[j].get(i, set()) | tokens
+    return StructureIndex(residue_ids, residue_names, run_end, dict(pairs))
+
+def order_relations(motif):
+    """Ordonne les relations pour que chacune touche, si possible, un brin déjà placé."""
+    remaining = list(motif.relations)
+    ordered = []
+    placed = set()
+    while remaining:
+        relation = next((r for r in remaining if r.position1[0] in placed or r.position2[0] in placed), remaining[0])
+        remaining.remove(relation)
+        ordered.append(relation)
+        placed.update((relation.position1[0], relation.position2[0]))
+    return ordered
+
+def match_motif(motif, index):
+    """
+    Recherche toutes les occurrences d'un motif dans un modèle indexé.
+
+    Les brins sont placés à partir des appariements de l'index : chaque relation ne
+    parcourt que les partenaires du résidu déjà placé. Deux placements qui couvrent
+    exactement les mêmes résidus (ex: brins A et B échangés dans un 2_2) ne forment
+    qu'une seule occurrence.
+
+    :param motif: Motif produit par mcs_scripts.parse_motif_script.
+    :param index: StructureIndex du modèle.
+    :return: Liste de MotifMatch.
+    """
+    strands = {strand.name: strand for strand in motif.strands}
+    relations = order_relations(motif)
+    num_residues = len(index.residue_ids)
+    matches = {}
+
+    def strand_fits(name, start):
+        pattern = strands[name].pattern
+        end = start + len(pattern) - 1
+        if start < 0 or end >= num_residues or index.run_end[start] < end:
+            return False
+        for offset, symbol in enumerate(pattern):
+            allowed = BASE_SYMBOLS.get(symbol, {symbol})
+            if allowed is not None and index.residue_names[start + offset] not in allowed:
+                return False
+        return True
+
+    def start_of(name, residue, position):
+        return residue - (position - strands[name].first_position)
+
+    def place(starts, name, start):
+        if name in starts:
+            return starts if starts[name] == start else None
+        if not strand_fits(name, start):
+            return None
+        return {**starts, name: start}
+
+    def record(starts):
+        ranges = [range(starts[s.name], starts[s.name] + len(s.pattern)) for s in motif.strands]
+        residues = [i for r in ranges for i in r]
+        if len(set(residues)) != len(residues):
+            return  # Deux brins se chevauchent
+        key = tuple(sorted(residues))
+        if key not in matches:
+            matches[key] = MotifMatch(
+                motif.name,
+                tuple(tuple(index.residue_ids[i] for i in r) for r in ranges),
+                "".join(index.residue_names[i] for i in residues))
+
+    def extend(k, starts):
+        if k == len(relations):
+            unplaced = [s.name for s in motif.strands if s.name not in starts]
+            if not unplaced:
+                record(starts)
+                return
+            # Brin sans relation : toutes les positions possibles
+            for start in range(num_residues):
+                new_starts = place(starts, unplaced[0], start)
+                if new_starts is not None:
+                    extend(k, new_starts)
+            return
+
+        relation = relations[k]
+        (strand1, position1), (strand2, position2) = relation.position1, relation.position2
+        properties = [p.lower() for p in relation.properties]
+        if strand1 in starts:
+            candidates = [starts[strand1] + position1 - strands[strand1].first_position]
+        else:
+            candidates = index.pairs.keys()
+        for residue1 in candidates:
+            starts1 = place(starts, strand1, start_of(strand1, residue1, position1))
+            if starts1 is None:
+                continue
+            for residue2, tokens in index.pairs.get(residue1, {}).items():
+                if not all(p in tokens for p in properties):
+                    continue
+                starts2 = place(starts1, strand2, start_of(strand2, residue2, position2))
+                if starts2 is not None:
+                    extend(k + 1, starts2)
+
+    extend(0, {})
+    return [matches[key] for key in sorted(matches)]
+
+def match_annotation_file(annotation_file, motifs):
+    """
+    Recherche tous les motifs dans chaque modèle d'un fichier .mc-annotate.
+
+    :return: Liste de tuples (indice du modèle, MotifMatch).
+    """
+    results = []
+    for model_index, model in enumerate(read_annotation(annotation_file), start=1):
+        index = build_structure_index(model)
+        for motif in motifs:
+            for match in match_motif(motif, index):
+                results.append((model_index, match))
+    return results
+
+# Motifs partagés par les processus de calcul, initialisés une seule fois par init_worker
+_worker_motifs = None
+
+def init_worker(motifs):
+    global _worker_motifs
+    _worker_motifs = motifs
+
+def process_annotation_file(annotation_file):
+    """Traite un fichier dans un processus de calcul."""
+    try:
+        return annotation_file, match_annotation_file(annotation_file, _worker_motifs), None
+    except Exception as e:
+        return annotation_file, [], str(e)
+
+def main():
+    parser = argparse.ArgumentParser(description="Recherche les NCMs directement dans les fichiers .mc-annotate.")
+    parser.add_argument("motif_script",
+                        help="Script de motif (.mcs), fichier combiné (all_scripts.mcs) ou répertoire de scripts")
+    parser.add_argument("annotation_dir", help="Répertoire contenant les fichiers .mc-annotate")
+    parser.add_argument("-o", "--output", required=True,
+                        help="Fichier CSV des occurrences trouvées (avec --shard : un fichier par partie, "
+                             "ex: occurrences.shard-0-of-4.csv)")
+    parser.add_argument("-n", "--num_workers", type=int, default=max(1, cpu_count() // 2),
+                        help="Nombre de processus parallèles (par défaut : moitié des cœurs CPU)")
+    add_shard_argument(parser)
+    args = parser.parse_args()
+
+    motifs = [parse_motif_script(name, text) for name, text in load_motif_scripts(args.motif_script).items()]
+    annotation_files = sorted(os.path.join(args.annotation_dir, f) for f in os.listdir(args.annotation_dir)
+                              if f.endswith(".mc-annotate"))
+    annotation_files = select_shard(annotation_files, args.shard)
+    # Chaque partie écrit son propre fichier ; les lignes d'une structure sont toutes dans la même partie
+    args.output = shard_file_name(args.output, args.shard)
+
+    total_matches = 0
+    with open(args.output, "w", newline="") as csvfile, \
+            Pool(processes=args.num_workers, initializer=init_worker, initargs=(motifs,)) as pool:
+        writer = csv.writer(csvfile)
+        writer.writerow(["structure", "model", "ncm", "residues", "sequence"])
+        chunksize = max(1, len(annotation_files) // (args.num_workers * 4))
+        for annotation_file, results, error in tqdm(pool.imap(process_annotation_file, annotation_files, chunksize),
+                                                    total=len(annotation_files), desc="Recherche des NCMs"):
+            if error is not None:
+                print(f"Erreur avec le fichier {annotation_file}: {error}")
+            structure = os.path.basename(annotation_file)[:-len(".mc-annotate")]
+            for model_index, match in results:
+                residues = ";".join(",".join(strand) for strand in match.strands)
+                writer.writerow([structure, model_index, match.ncm, residues, match.sequence])
+            total_matches += len(results)
+
+    print(f"Nombre total d'occurrences trouvées : {total_matches}")
+    print(f"Résultats enregistrés dans {args.output}")
+
+if __name__ == "__main__":
+    main()
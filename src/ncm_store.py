@@ -0,0 +1,202 @@
+import os
+import io
+import zlib
+import sqlite3
+import argparse
+from functools import lru_cache
+from multiprocessing import Pool, cpu_count
+from tqdm import tqdm
+
+# Archive d'un type de NCM : <racine>/<ncm>.ncm.sqlite, une ligne par fichier de l'arborescence d'origine
+STORE_SUFFIX = ".ncm.sqlite"
+
+# Fichiers que run_mc-annotate écrit à côté des fragments et qui n'en sont pas : texte brut compressé
+# (--keep-raw), manifestes (y compris ceux des parties --shard) et écritures en cours
+RAW_ANNOTATION_SUFFIX = ".mc-annotate.gz"
+MANIFEST_MARKER = ".manifest."
+PARTIAL_SUFFIXES = (".part", ".tmp")
+
+# Connexions ouvertes par processus : une connexion SQLite ne doit pas être partagée après un fork
+_connections = {}
+
+@lru_cache(maxsize=None)
+def is_packed_store(root):
+    """Indique si root contient des archives NCM plutôt que des sous-répertoires de fichiers (résultat mis en cache)."""
+    return any(name.endswith(STORE_SUFFIX) for name in os.listdir(root))
+
+def get_store_path(root, ncm):
+    """Chemin de l'archive d'un type de NCM."""
+    return os.path.join(root, ncm + STORE_SUFFIX)
+
+def _connect(path):
+    key = (os.getpid(), path)
+    if key not in _connections:
+        connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        compression = connection.execute("SELECT value FROM meta WHERE key = 'compression'").fetchone()
+        _connections[key] = (connection, compression is not None and compression[0] == "zlib")
+    return _connections[key]
+
+def _decode(data, compressed):
+    return (zlib.decompress(data) if compressed else data).decode("utf-8", errors="replace")
+
+def is_fragment_name(name):
+    """Indique si un nom de fichier d'un répertoire de NCM est un fragment (et non un fichier annexe)."""
+    if name.endswith(RAW_ANNOTATION_SUFFIX) or name.endswith(PARTIAL_SUFFIXES):
+        return False
+    return not (MANIFEST_MARKER in name and name.endswith(".jsonl"))
+
+def list_ncm_types(root):
+    """Retourne la liste triée des types de NCM, quelle que soit la disposition de root."""
+    if is_packed_store(root):
+        return sorted(name[:-len(STORE_SUFFIX)] for name in os.listdir(root) if name.endswith(STORE_SUFFIX))
+    return sorted(d for d in os.listdir(root) if os.path.isdir(os.path.join(root, d)))
+
+def list_fragments(root, ncm):
+    """Retourne l'ensemble des noms de fichiers d'un type de NCM."""
+    if is_packed_store(root):
+        connection, _ = _connect(get_store_path(root, ncm))
+        return {name for (name,) in connection.execute("SELECT name FROM fragments")}
+    return {name for name in os.listdir(os.path.join(root, ncm)) if is_fragment_name(name)}
+
+def list_all_fragments(root):
+    """Retourne le dictionnaire {type de NCM: ensemble des noms de fichiers}."""
+    return {ncm: list_fragments(root, ncm) for ncm in list_ncm_types(root)}
+
+def read_fragment(root, ncm, name):
+    """
+    Lit le contenu d'un fichier d'un type de NCM (accès direct).
+
+    :param root: Répertoire de NCMs (sous-répertoires ou archives).
+    :param ncm: Type de NCM (ex: '2_2').
+    :param name: Nom du fichier dans l'arborescence d'origine.
+    :return: Contenu du fichier (texte).
+    """
+    if not is_packed_store(root):
+        with open(os.path.join(root, ncm, name), "r", encoding="utf-8", errors="replace") as f:
+            return f.read()
+    connection, compressed = _connect(get_store_path(root, ncm))
+    row = connection.execute("SELECT data FROM fragments WHERE name = ?", (name,)).fetchone()
+    if row is None:
+        raise FileNotFoundError(f"{name} absent de l'archive {ncm}")
+    return _decode(row[0], compressed)
+
+def open_fragment(root, ncm, name):
+    """Ouvre un fichier d'un type de NCM en lecture texte, comme open()."""
+    if not is_packed_store(root):
+        return open(os.path.join(root, ncm, name), "r", encoding="utf-8", errors="replace")
+    return io.StringIO(read_fragment(root, ncm, name))
+
+def iter_fragments(root, ncm, names=None):
+    """
+    Parcourt séquentiellement les fichiers d'un type de NCM, dans l'ordre des noms.
+
+    :param names: Noms des fichiers à lire (par défaut : tous).
+    :return: Générateur de tuples (nom du fichier, contenu).
+    """
+    if names is None:
+        names = list_fragments(root, ncm)
+    names = sorted(names)
+    if not is_packed_store(root):
+        for name in names:
+            with open(os.path.join(root, ncm, name), "r", encoding="utf-8", errors="replace") as f:
+                yield name, f.read()
+        return
+    for name, data in _iter_raw_fragments(root, ncm, names):
+        yield name, data.decode("utf-8", errors="replace")
+
+def _iter_raw_fragments(root, ncm, names):
+    connection, compressed = _connect(get_store_path(root, ncm))
+    # Requêtes par lots : le nombre de paramètres d'une requête SQLite est limité
+    for i in range(0, len(names), 500):
+        batch = names[i:i + 500]
+        placeholders = ",".join("?" * len(batch))
+        for name, data in connection.execute(
+                f"SELECT name, data FROM fragments WHERE name IN ({placeholders}) ORDER BY name", batch):
+            yield name, zlib.decompress(data) if compressed else data
+
+def pack_ncm_directory(args):
+    """
+    Regroupe les fichiers d'un répertoire de NCM dans une archive SQLite.
+
+    L'archive est écrite sous un nom temporaire puis renommée.
+
+    :param args: Tuple (répertoire source, chemin de l'archive, compression zlib).
+    :return: Tuple (chemin de l'archive, nombre de fichiers).
+    """
+    source_dir, store_path, compress = args
+    tmp_path = store_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    names = sorted(f for f in os.listdir(source_dir)
+                   if os.path.isfile(os.path.join(source_dir, f)) and is_fragment_name(f))
+
+    connection = sqlite3.connect(tmp_path)
+    try:
+        connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        connection.execute("CREATE TABLE fragments (name TEXT PRIMARY KEY, data BLOB NOT NULL)")
+        connection.execute("INSERT INTO meta VALUES ('compression', ?)", ("zlib" if compress else "none",))
+        for name in names:
+            with open(os.path.join(source_dir, name), "rb") as f:
+                data = f.read()
+            connection.execute("INSERT INTO fragments VALUES (?, ?)", (name, zlib.compress(data) if compress else data))
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(tmp_path, store_path)
+    return store_path, len(names)
+
+def import_directory_tree(source_root, dest_root, compress=False, num_workers=1):
+    """
+    Convertit une arborescence root/<ncm>/<fichier> en une archive par type de NCM.
+
+    :param source_root: Répertoire contenant les sous-répertoires de NCMs.
+    :param dest_root: Répertoire de destination des archives.
+    :param compress: Si True, compresse chaque fichier avec zlib.
+    :param num_workers: Nombre de types de NCM traités en parallèle.
+    """
+    os.makedirs(dest_root, exist_ok=True)
+    tasks = [(os.path.join(source_root, ncm), get_store_path(dest_root, ncm), compress)
+             for ncm in list_ncm_types(source_root)]
+    with Pool(processes=num_workers) as pool:
+        for store_path, count in tqdm(pool.imap_unordered(pack_ncm_directory, tasks), total=len(tasks),
+                                      desc="Import des NCMs"):
+            print(f"{store_path} : {count} fichiers")
+
+def export_store(source_root, dest_root):
+    """Recrée l'arborescence root/<ncm>/<fichier> à partir d'archives NCM."""
+    for ncm in list_ncm_types(source_root):
+        ncm_dir = os.path.join(dest_root, ncm)
+        os.makedirs(ncm_dir, exist_ok=True)
+        for name, data in _iter_raw_fragments(source_root, ncm, sorted(list_fragments(source_root, ncm))):
+            with open(os.path.join(ncm_dir, name), "wb") as f:
+                f.write(data)
+
+def main():
+    parser = argparse.ArgumentParser(description="Archives NCM : un fichier SQLite par type de NCM.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser("import", help="Convertit une arborescence root/<ncm>/<fichier> en archives")
+    import_parser.add_argument("source_root", help="Répertoire contenant les sous-répertoires de NCMs")
+    import_parser.add_argument("dest_root", help="Répertoire de destination des archives")
+    import_parser.add_argument("--compress", action="store_true", help="Compresse chaque fichier avec zlib")
+    import_parser.add_argument("-n", "--num_workers", type=int, default=max(1, cpu_count() // 2),
+                               help="Nombre de types de NCM traités en parallèle (par défaut : moitié des cœurs CPU)")
+
+    export_parser = subparsers.add_parser("export", help="Recrée l'arborescence de fichiers à partir des archives")
+    export_parser.add_argument("source_root", help="Répertoire contenant les archives")
+    export_parser.add_argument("dest_root", help="Répertoire de destination")
+
+    list_parser = subparsers.add_parser("list", help="Affiche le nombre de fichiers par type de NCM")
+    list_parser.add_argument("root", help="Répertoire de NCMs (sous-répertoires ou archives)")
+
+    args = parser.parse_args()
+    if args.command == "import":
+        import_directory_tree(args.source_root, args.dest_root, args.compress, args.num_workers)
+    elif args.command == "export":
+        export_store(args.source_root, args.dest_root)
+    else:
+        for ncm, names in list_all_fragments(args.root).items():
+            print(f"{ncm}\t{len(names)}")
+
+if __name__ == "__main__":
+    main()
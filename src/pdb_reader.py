@@ -0,0 +1,273 @@
+import io
+import re
+
+# Résidus standards de l'ARN et acides aminés standards (équivalent de PDB.is_aa(..., standard=True))
+STANDARD_NUCLEOTIDES = {"A", "C", "G", "U"}
+STANDARD_AMINO_ACIDS = {
+    "ALA", "ARG", "ASN", "ASP", "CYS", "GLN", "GLU", "GLY", "HIS", "ILE",
+    "LEU", "LYS", "MET", "PHE", "PRO", "SER", "THR", "TRP", "TYR", "VAL"
+}
+
+# Valeurs mmCIF : entre apostrophes ou guillemets (fermés seulement s'ils sont suivis d'un blanc) ou mots simples
+CIF_TOKEN_PATTERN = re.compile(r"""'(?:[^']|'(?=\S))*'|"(?:[^"]|"(?=\S))*"|\S+""")
+CIF_UNASSIGNED = {".", "?"}
+CIF_EXTENSIONS = (".cif", ".mmcif")
+
+def is_cif_file(file_path):
+    """Indique si le fichier est au format mmCIF d'après son extension."""
+    return file_path.lower().endswith(CIF_EXTENSIONS)
+
+def iter_cif_tokens(lines):
+    """
+    Découpe un fichier mmCIF en jetons bruts.
+
+    Les champs texte délimités par ';' sont renvoyés en un seul jeton préfixé par ';'.
+    """
+    text_field = None
+    for line in lines:
+        if text_field is not None:
+            if line.startswith(";"):
+                yield ";" + "\n".join(text_field)
+                text_field = None
+                line = line[1:]
+            else:
+                text_field.append(line.rstrip("\n"))
+                continue
+        elif line.startswith(";"):
+            text_field = [line[1:].rstrip("\n")]
+            continue
+
+        if "'" not in line and '"' not in line and "#" not in line:
+            yield from line.split()
+            continue
+        for match in CIF_TOKEN_PATTERN.finditer(line):
+            token = match.group()
+            if token.startswith("#"):
+                break
+            yield token
+
+def unquote_cif_value(token):
+    """Retire les délimiteurs d'une valeur mmCIF."""
+    if token[:1] == ";":
+        return token[1:].strip()
+    if len(token) > 1 and token[0] == token[-1] and token[0] in "'\"":
+        return token[1:-1]
+    return token
+
+def _is_cif_keyword(token):
+    lowered = token.lower()
+    return token.startswith("_") or lowered == "loop_" or lowered.startswith(("data_", "save_", "global_", "stop_"))
+
+def iter_cif_category(lines, category):
+    """
+    Parcourt les lignes d'une catégorie mmCIF (ex: '_atom_site') sans charger le reste du fichier.
+
+    La lecture s'arrête dès que la catégorie a été entièrement lue.
+
+    :param lines: Itérable de lignes au format mmCIF.
+    :param category: Nom de la catégorie, avec le '_' initial.
+    :return: Générateur de dictionnaires {champ: valeur}, un par ligne de la catégorie.
+    """
+    prefix = category + "."
+    tokens = iter_cif_tokens(lines)
+    token = next(tokens, None)
+    single_row = {}
+    while token is not None:
+        if token.lower() == "loop_":
+            fields = []
+            token = next(tokens, None)
+            while token is not None and token.startswith("_"):
+                fields.append(token)
+                token = next(tokens, None)
+            in_category = bool(fields) and fields[0].startswith(prefix)
+            names = [field[len(prefix):] for field in fields]
+            row = []
+            while token is not None and not _is_cif_keyword(token):
+                if in_category:
+                    row.append(unquote_cif_value(token))
+                    if len(row) == len(names):
+                        yield dict(zip(names, row))
+                        row = []
+                token = next(tokens, None)
+            if in_category:
+                return
+        elif token.startswith("_"):
+            value = next(tokens, None)
+            if token.startswith(prefix) and value is not None:
+                single_row[token[len(prefix):]] = unquote_cif_value(value)
+            elif single_row:
+                break
+            token = next(tokens, None)
+        else:
+            token = next(tokens, None)
+    if single_row:
+        yield single_row
+
+def read_entity_sequences(file_path):
+    """
+    Lit les séquences déclarées d'un fichier mmCIF (_entity_poly et _entity_poly_seq), sans les coordonnées.
+
+    Ces catégories précèdent _atom_site dans les fichiers de la PDB : la lecture s'arrête avant
+    les coordonnées. Les séquences incluent les résidus non observés. En cas de microhétérogénéité,
+    seul le premier résidu de chaque position est conservé.
+
+    :param file_path: Chemin vers le fichier mmCIF.
+    :return: Liste de (chaîne, liste des noms de résidus), par entité puis dans l'ordre de pdbx_strand_id.
+    """
+    with open(file_path, "r") as f:
+        entity_chains = [(row["entity_id"], row.get("pdbx_strand_id", row["entity_id"]))
+                         for row in iter_cif_category(f, "_entity_poly")]
+    residues = {}
+    with open(file_path, "r") as f:
+        for row in iter_cif_category(f, "_entity_poly_seq"):
+            residues.setdefault(row["entity_id"], {}).setdefault(int(row["num"]), row["mon_id"])
+
+    sequences = []
+    for entity_id, strand_ids in entity_chains:
+        names = [name for _, name in sorted(residues.get(entity_id, {}).items())]
+        for chain in strand_ids.split(","):
+            sequences.append((chain.strip(), names))
+    return sequences
+
+def iter_pdb_residue_records(lines):
+    """
+    Parcourt les enregistrements ATOM/HETATM d'un fichier PDB par colonnes fixes.
+
+    Un enregistrement est produit à chaque début de résidu, selon les mêmes règles que PDBParser.
+
+    :param lines: Itérable de lignes au format PDB.
+    :return: Générateur de tuples (modèle, chaîne, identifiant du résidu, nom du résidu).
+    """
+    model = -1
+    model_open = False
+    current_chain = None
+    current_residue = None
+    for line in lines:
+        record = line[:6]
+        if record == "ATOM  " or record == "HETATM":
+            if not model_open:
+                model += 1
+                model_open = True
+            resname = line[17:20].strip()
+            chain = line[21]
+            resseq = int(line[22:26].split()[0])
+            if record == "HETATM":
+                hetero_flag = "W" if resname in ("HOH", "WAT") else "H_" + resname
+            else:
+                hetero_flag = " "
+            residue = ((hetero_flag, resseq, line[26]), resname)
+            if chain != current_chain or residue != current_residue:
+                current_chain = chain
+                current_residue = residue
+                yield model, chain, residue[0], resname
+        elif record == "MODEL ":
+            model += 1
+            model_open = True
+            current_chain = current_residue = None
+        elif record == "ENDMDL":
+            model_open = False
+            current_chain = current_residue = None
+        elif record == "CONECT" or line.rstrip("\n")[:6] == "END   ":
+            break
+
+def iter_cif_residue_records(lines):
+    """
+    Parcourt la catégorie _atom_site d'un fichier mmCIF, selon les mêmes règles que MMCIFParser.
+
+    :param lines: Itérable de lignes au format mmCIF.
+    :return: Générateur de tuples (modèle, chaîne, identifiant du résidu, nom du résidu).
+    """
+    current_model = None
+    current_chain = None
+    current_residue = None
+    for row in iter_cif_category(lines, "_atom_site"):
+        resseq = row.get("auth_seq_id", row.get("label_seq_id"))
+        if resseq == ".":
+            continue
+        resname = row["label_comp_id"]
+        chain = row["auth_asym_id"]
+        icode = row.get("pdbx_PDB_ins_code", "?")
+        if icode in CIF_UNASSIGNED:
+            icode = " "
+        if row.get("group_PDB") == "HETATM":
+            hetero_flag = "W" if resname in ("HOH", "WAT") else "H_" + resname
+        else:
+            hetero_flag = " "
+        model = row.get("pdbx_PDB_model_num", "1")
+        if model != current_model:
+            current_model = model
+            current_chain = current_residue = None
+        residue = ((hetero_flag, int(resseq), icode), resname)
+        if chain != current_chain or residue != current_residue:
+            current_chain = chain
+            current_residue = residue
+            yield model, chain, residue[0], resname
+
+def iter_biopython_residue_records(file_path, text=None):
+    """Équivalent de iter_residue_records reposant sur Bio.PDB (chemin de repli, plus lent)."""
+    from Bio.PDB import MMCIFParser, PDBParser
+
+    parser = MMCIFParser(QUIET=True) if is_cif_file(file_path) else PDBParser(QUIET=True)
+    structure = parser.get_structure("structure", file_path if text is None else io.StringIO(text))
+    for model in structure:
+        for chain in model:
+            for residue in chain:
+                yield model.id, chain.id, residue.get_id(), residue.get_resname().strip()
+
+def iter_residue_records(file_path, use_biopython=False, text=None):
+    """
+    Parcourt les résidus d'un fichier PDB ou mmCIF en flux, dans l'ordre du fichier.
+
+    Un même résidu peut apparaître plusieurs fois si sa chaîne est discontinue :
+    utiliser read_model_sequences pour obtenir le regroupement de Biopython.
+
+    :param file_path: Chemin vers le fichier PDB ou mmCIF (son extension indique le format).
+    :param use_biopython: Si True, utilise Bio.PDB au lieu de la lecture par colonnes.
+    :param text: Contenu du fichier s'il a déjà été lu (ex: fragment d'une archive ncm_store).
+    :return: Générateur de tuples (modèle, chaîne, identifiant du résidu, nom du résidu).
+    """
+    if use_biopython:
+        yield from iter_biopython_residue_records(file_path, text)
+        return
+    with (open(file_path, "r") if text is None else io.StringIO(text)) as f:
+        if is_cif_file(file_path):
+            yield from iter_cif_residue_records(f)
+        else:
+            yield from iter_pdb_residue_records(f)
+
+def iter_residue_names(file_path, use_biopython=False):
+    """Parcourt en flux les noms de résidus d'un fichier PDB ou mmCIF."""
+    for _, _, _, resname in iter_residue_records(file_path, use_biopython):
+        yield resname
+
+def group_residue_records(records):
+    """
+    Regroupe des résidus par modèle puis par chaîne, comme le fait Biopython.
+
+    :param records: Itérable de tuples (modèle, chaîne, identifiant du résidu, nom du résidu).
+    :return: Liste de modèles, chacun étant une liste de (chaîne, liste des noms de résidus).
+    """
+    models = []
+    chains = None
+    current_model = None
+    for model, chain, residue_id, resname in records:
+        if chains is None or model != current_model:
+            current_model = model
+            chains = {}
+            models.append(chains)
+        residues = chains.setdefault(chain, {})
+        # Un résidu hétéro redéfini garde son premier nom, un résidu standard prend le dernier
+        if residue_id not in residues or residue_id[0] == " ":
+            residues[residue_id] = resname
+    return [[(chain, list(residues.values())) for chain, residues in chains.items()] for chains in models]
+
+def read_model_sequences(file_path, use_biopython=False, text=None):
+    """
+    Lit les noms de résidus d'un fichier PDB ou mmCIF, par modèle et par chaîne.
+
+    :param file_path: Chemin vers le fichier PDB ou mmCIF.
+    :param use_biopython: Si True, utilise Bio.PDB au lieu de la lecture par colonnes.
+    :param text: Contenu du fichier s'il a déjà été lu.
+    :return: Liste de modèles, chacun étant une liste de (chaîne, liste des noms de résidus).
+    """
+    return group_residue_records(iter_residue_records(file_path, use_biopython, text))
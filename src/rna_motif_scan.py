@@ -1,52 +1,115 @@
 import os
-import subprocess
 import argparse
-from concurrent.futures import ProcessPoolExecutor, as_completed
+import tempfile
 from tqdm import tqdm
 import time
 import multiprocessing
+from async_runner import Job, run_jobs
+from mcs_scripts import load_motif_scripts
+from sharding import add_shard_argument, select_shard
 
-def process_pdb_file(pdb_file, motif_script):
+# Chemin par défaut de mcsearch (peut être remplacé par --mcsearch ou la variable MCSEARCH)
+DEFAULT_MCSEARCH_EXECUTABLE = "/u/sagnioln/stage-E24/tools/mcsearch"
+
+def write_motif_scripts(motif_scripts, script_dir):
+    """Écrit chaque script de motif dans script_dir et retourne {nom du NCM: chemin du script}."""
+    paths = {}
+    for name, text in motif_scripts.items():
+        paths[name] = os.path.join(script_dir, f"{name}.mcs")
+        with open(paths[name], "w") as f:
+            f.write(text)
+    return paths
+
+def build_jobs(pdb_files, script_paths, mcsearch_executable, output_dir):
     """
-    Fonction pour traiter un fichier PDB en exécutant mcsearch.
+    Construit les tâches (pdb, motif), regroupées par fichier PDB.
+
+    Tous les motifs d'un même PDB sont lancés à la suite, tant que le fichier est en cache.
+    Sans répertoire de sortie, la sortie de mcsearch est affichée telle quelle ; sinon, elle
+    est écrite dans output_dir/<NCM>/<fichier PDB>, et mcsearch est lancé depuis output_dir/<NCM>.
     """
-    command = ["/u/sagnioln/stage-E24/tools/mcsearch", motif_script, pdb_file]
-    try:
-        subprocess.run(command, capture_output=False, text=True, check=True)
-        return f"Succès: {pdb_file}"
-    except subprocess.CalledProcessError as e:
-        return f"Échec: {pdb_file} - {e}"
-
-def main(directory, motif_script, num_jobs):
+    for pdb in pdb_files:
+        for name, script_path in script_paths.items():
+            command = [mcsearch_executable, script_path, pdb]
+            if output_dir is None:
+                yield Job(command, tag=(pdb, name))
+            else:
+                ncm_dir = os.path.join(output_dir, name)
+                yield Job(command, os.path.join(ncm_dir, os.path.basename(pdb)), (pdb, name), ncm_dir)
+
+def main(directory, motif_script, num_jobs, timeout=None, retries=0, output_dir=None, mcsearch_executable=None,
+         shard=None):
     start_time = time.time()
+    mcsearch_executable = mcsearch_executable or os.environ.get("MCSEARCH", DEFAULT_MCSEARCH_EXECUTABLE)
+    # Avec --output_dir, mcsearch est lancé depuis output_dir/<NCM> : les chemins doivent être absolus
+    # (un nom sans répertoire, comme 'mcsearch', reste cherché dans le PATH)
+    if os.path.dirname(mcsearch_executable):
+        mcsearch_executable = os.path.abspath(mcsearch_executable)
 
     # Obtenir tous les fichiers PDB dans le répertoire
-    pdb_files = [os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(".pdb")]
+    pdb_files = sorted(os.path.abspath(os.path.join(directory, f)) for f in os.listdir(directory) if f.endswith(".pdb"))
+    # Avec --shard, seule une partie des fichiers est traitée ; les sorties par fichier ne se recouvrent pas
+    pdb_files = select_shard(pdb_files, shard)
     total_files = len(pdb_files)
 
     if total_files == 0:
         print("Aucun fichier PDB trouvé.")
         return
 
+    motif_scripts = load_motif_scripts(motif_script)
+    if len(motif_scripts) > 1 and output_dir is None:
+        print("Plusieurs motifs à rechercher : un répertoire de sortie (--output_dir) est nécessaire.")
+        return
+    if output_dir is not None:
+        for name in motif_scripts:
+            os.makedirs(os.path.join(output_dir, name), exist_ok=True)
+
     print(f"Nombre total de fichiers PDB à traiter : {total_files}")
+    print(f"Nombre de motifs recherchés : {len(motif_scripts)}")
     print(f"Utilisation de {num_jobs} jobs en parallèle.")
 
-    # Utilisation du parallélisme avec un nombre défini de processus
-    with ProcessPoolExecutor(max_workers=num_jobs) as executor:
-        futures = {executor.submit(process_pdb_file, pdb, motif_script): pdb for pdb in pdb_files}
-        for future in tqdm(as_completed(futures), total=total_files, desc="Progression", unit="file"):
-            result = future.result()
-            print(result)
+    with tempfile.TemporaryDirectory() as script_dir:
+        if os.path.isfile(motif_script) and len(motif_scripts) == 1:
+            script_paths = {name: os.path.abspath(motif_script) for name in motif_scripts}
+        else:
+            script_paths = write_motif_scripts(motif_scripts, script_dir)
+
+        # mcsearch est lancé directement depuis une boucle asyncio, sans processus Python intermédiaire
+        jobs = build_jobs(pdb_files, script_paths, mcsearch_executable, output_dir)
+        with tqdm(total=total_files * len(script_paths), desc="Progression", unit="job") as progress:
+            def report(result):
+                pdb, name = result.job.tag
+                if result.returncode == 0:
+                    print(f"Succès: {pdb} ({name})")
+                    # Aucune occurrence du motif : inutile de conserver un fichier vide
+                    if result.job.stdout_path and os.path.getsize(result.job.stdout_path) == 0:
+                        os.remove(result.job.stdout_path)
+                else:
+                    print(f"Échec: {pdb} ({name}) - {result.error}")
+                progress.update(1)
+
+            run_jobs(jobs, num_jobs, timeout, retries, on_result=report)
 
     end_time = time.time()
     print(f"Traitement terminé en {end_time - start_time:.2f} secondes.")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Recherche de motifs dans les fichiers PDB en parallèle.")
-    parser.add_argument("motif_script", help="Fichier du script de motif (.mcs)")
+    parser.add_argument("motif_script",
+                        help="Script de motif (.mcs), fichier combiné (all_scripts.mcs) ou répertoire de scripts")
     parser.add_argument("directory", help="Répertoire contenant les fichiers PDB")
     parser.add_argument("--num_jobs", type=int, default=multiprocessing.cpu_count(),
                         help="Nombre de processus à exécuter en parallèle (défaut: nombre de cœurs CPU)")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="Délai maximal par fichier en secondes (défaut: aucun)")
+    parser.add_argument("--retries", type=int, default=0,
+                        help="Nombre de nouvelles tentatives après un échec transitoire (défaut: 0)")
+    parser.add_argument("-o", "--output_dir", default=None,
+                        help="Répertoire de sortie : les résultats sont rangés par NCM (obligatoire pour plusieurs motifs)")
+    parser.add_argument("--mcsearch", default=None,
+                        help=f"Chemin vers mcsearch (défaut: variable MCSEARCH, sinon {DEFAULT_MCSEARCH_EXECUTABLE})")
+    add_shard_argument(parser)
 
     args = parser.parse_args()
-    main(args.directory, args.motif_script, args.num_jobs)
+    main(args.directory, args.motif_script, args.num_jobs, args.timeout, args.retries, args.output_dir, args.mcsearch,
+         args.shard)
@@ -1,61 +1,222 @@
 import os
 import sys
+import gzip
+import json
+import time
+import shutil
+import hashlib
 import argparse
-import subprocess
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from annotation_parser import STRUCTURED_SUFFIX, AnnotationStreamParser, dump_structured_annotation
+from async_runner import Job, run_jobs
+from compute_bps_by_hinges_tab import accepted_pairs_from_models
+from sharding import add_shard_argument, select_shard, shard_file_name
 
-def process_pdb_file(pdb_path, mc_annotate_executable):
+# Nom par défaut du manifeste écrit dans le répertoire d'entrée (ignoré, comme les <pdb>.mc-annotate.gz,
+# par ncm_store.list_fragments et donc par les scripts de comptage)
+MANIFEST_NAME = "mc-annotate.manifest.jsonl"
+
+def get_output_path(pdb_path, suffix=".mc-annotate"):
+    """Retourne le chemin du fichier .mc-annotate (ou d'un autre suffixe) associé à un fichier PDB."""
+    base_name = os.path.splitext(os.path.basename(pdb_path))[0]
+    return os.path.join(os.path.dirname(pdb_path), base_name + suffix)
+
+class StreamingAnnotation:
     """
-    Exécute la commande mc-annotate sur un fichier PDB et enregistre la sortie dans un fichier.
-    
-    :param pdb_path: Chemin complet vers le fichier PDB.
-    :param mc_annotate_executable: Chemin vers l'exécutable mc-annotate.
-    :return: Message de résultat pour le fichier traité.
+    Consommateur de la sortie de mc-annotate pour async_runner (Job.stdout_handler).
+
+    Les lignes sont analysées pendant l'exécution ; seul le résultat structuré (modèles et
+    paires de bases acceptées) est écrit, dans output_path, si l'exécution réussit. Le texte
+    brut peut être conservé en parallèle, compressé avec gzip, dans raw_path.
+    """
+
+    def __init__(self, output_path, raw_path=None):
+        self.output_path = output_path
+        self.raw_path = raw_path
+        self.parser = AnnotationStreamParser()
+        self.models = []
+        self.raw = gzip.open(raw_path + ".part", "wt") if raw_path else None
+
+    def feed(self, line):
+        if self.raw is not None:
+            self.raw.write(line)
+        model = self.parser.feed(line)
+        if model is not None:
+            self.models.append(model)
+
+    def close(self, success):
+        """Écrit le résultat si l'exécution a réussi, sinon supprime les fichiers partiels."""
+        if self.raw is not None:
+            self.raw.close()
+            if success:
+                os.replace(self.raw_path + ".part", self.raw_path)
+            else:
+                os.remove(self.raw_path + ".part")
+        if not success:
+            return None
+        model = self.parser.close()
+        if model is not None:
+            self.models.append(model)
+        tmp_path = self.output_path + ".part"
+        with open(tmp_path, "w") as f:
+            dump_structured_annotation(self.models, accepted_pairs_from_models(self.models), f)
+        os.replace(tmp_path, self.output_path)
+        return self.output_path
+
+def file_sha256(file_path, block_size=1 << 20):
+    """Calcule l'empreinte SHA-256 du contenu d'un fichier."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def get_executable_digest(mc_annotate_executable):
+    """
+    Identifie l'exécutable mc-annotate par son chemin réel et l'empreinte de son binaire.
+
+    L'empreinte du binaire change avec la version de l'outil, ce qui invalide le cache.
     """
-    command = [mc_annotate_executable, pdb_path]
-    try:
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
-        output = result.stdout
-        # Générer le nom de fichier de sortie : même nom que pdb avec extension .mc-annotate
-        base_name = os.path.splitext(os.path.basename(pdb_path))[0]
-        output_file = os.path.join(os.path.dirname(pdb_path), base_name + ".mc-annotate")
-        with open(output_file, "w", encoding="utf-8") as f:
-            f.write(output)
-        return f"[OK] {pdb_path} -> {output_file}"
-    except subprocess.CalledProcessError as e:
-        return f"[ERREUR] {pdb_path} : {e}"
-    except Exception as e:
-        return f"[ERREUR] {pdb_path} : {e}"
-
-def process_directory(input_dir, mc_annotate_executable, num_workers):
+    executable = shutil.which(mc_annotate_executable) or mc_annotate_executable
+    real_path = os.path.realpath(executable)
+    return hashlib.sha256(f"{real_path}:{file_sha256(real_path)}".encode()).hexdigest()
+
+def get_cache_key(pdb_path, executable_digest):
+    """Clé de cache d'un fichier PDB : contenu du fichier et identité de l'annotateur."""
+    return hashlib.sha256(f"{file_sha256(pdb_path)}:{executable_digest}".encode()).hexdigest()
+
+def load_manifest(manifest_path):
+    """
+    Lit le manifeste (une entrée JSON par ligne) et retourne la dernière entrée de chaque fichier.
+
+    Une dernière ligne tronquée par une interruption est ignorée.
+    """
+    records = {}
+    if not os.path.exists(manifest_path):
+        return records
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            records[record["pdb"]] = record
+    return records
+
+def compact_manifest(manifest_path, records):
+    """Réécrit le manifeste avec une seule entrée par fichier."""
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for name in sorted(records):
+            f.write(json.dumps(records[name], sort_keys=True) + "\n")
+    os.replace(tmp_path, manifest_path)
+
+def select_pdb_files(pdb_files, records, executable_digest, force=False, resume=False, suffix=".mc-annotate"):
+    """
+    Sépare les fichiers à annoter de ceux dont le résultat en cache est encore valide.
+
+    :param pdb_files: Chemins des fichiers PDB.
+    :param records: Dernière entrée du manifeste pour chaque fichier.
+    :param executable_digest: Identité de l'exécutable mc-annotate.
+    :param force: Si True, ignore le cache et annote tous les fichiers.
+    :param resume: Si True, ne relance pas non plus les fichiers déjà en échec avec la même clé.
+    :param suffix: Suffixe du fichier de sortie attendu (voir get_output_path).
+    :return: Liste de (chemin, clé de cache) à annoter, et nombre de fichiers ignorés.
+    """
+    to_process = []
+    skipped = 0
+    for pdb_path in pdb_files:
+        key = get_cache_key(pdb_path, executable_digest)
+        record = records.get(os.path.basename(pdb_path))
+        if not force and record is not None and record["key"] == key:
+            if record["status"] == "ok" and os.path.exists(get_output_path(pdb_path, suffix)):
+                skipped += 1
+                continue
+            if resume and record["status"] == "error":
+                skipped += 1
+                continue
+        to_process.append((pdb_path, key))
+    return to_process, skipped
+
+def process_directory(input_dir, mc_annotate_executable, num_workers, manifest_path=None, force=False, resume=False,
+                      timeout=None, retries=0, stream=False, keep_raw=False, shard=None):
     """
     Parcourt un répertoire et exécute mc-annotate sur tous les fichiers PDB en parallèle.
-    
+
+    Les fichiers dont le contenu et l'annotateur n'ont pas changé depuis la dernière
+    exécution réussie sont ignorés. Chaque résultat est ajouté au manifeste dès qu'il
+    est connu, ce qui permet de reprendre une exécution interrompue.
+
     :param input_dir: Répertoire contenant les fichiers PDB.
     :param mc_annotate_executable: Chemin vers l'exécutable mc-annotate.
-    :param num_workers: Nombre de processus parallèles à utiliser.
+    :param num_workers: Nombre d'exécutions simultanées de mc-annotate.
+    :param manifest_path: Chemin du manifeste (par défaut : MANIFEST_NAME dans input_dir).
+    :param force: Si True, ignore le cache et annote tous les fichiers.
+    :param resume: Si True, reprend une exécution interrompue sans relancer les échecs connus.
+    :param timeout: Délai maximal par fichier, en secondes.
+    :param retries: Nombre de nouvelles tentatives après un échec transitoire.
+    :param stream: Si True, analyse la sortie de mc-annotate pendant l'exécution et n'écrit que
+                   le résultat structuré (<pdb>.mc-annotate.json) au lieu du texte brut.
+    :param keep_raw: En mode stream, conserve aussi le texte brut compressé (<pdb>.mc-annotate.gz).
+    :param shard: Partie des fichiers à traiter (sharding.ShardSpec) ; chaque partie écrit son propre
+                  manifeste, à réunir avec sharding.py merge-manifests.
     """
     if not os.path.isdir(input_dir):
         print(f"Erreur : {input_dir} n'est pas un répertoire valide.")
         sys.exit(1)
-    
-    pdb_files = [os.path.join(input_dir, f) for f in os.listdir(input_dir)
-                 if os.path.isfile(os.path.join(input_dir, f)) and f.lower().endswith(".pdb")]
-    
+
+    pdb_files = sorted(os.path.join(input_dir, f) for f in os.listdir(input_dir)
+                       if os.path.isfile(os.path.join(input_dir, f)) and f.lower().endswith(".pdb"))
+    pdb_files = select_shard(pdb_files, shard)
+
     total_files = len(pdb_files)
     if total_files == 0:
         print("Aucun fichier PDB trouvé dans le répertoire spécifié.")
         return
 
+    manifest_path = manifest_path or shard_file_name(os.path.join(input_dir, MANIFEST_NAME), shard)
+    records = load_manifest(manifest_path)
+    executable_digest = get_executable_digest(mc_annotate_executable)
+    suffix = STRUCTURED_SUFFIX if stream else ".mc-annotate"
+    to_process, skipped = select_pdb_files(pdb_files, records, executable_digest, force, resume, suffix)
+
     print(f"Nombre total de fichiers PDB à traiter: {total_files}")
+    print(f"Fichiers inchangés ignorés (cache): {skipped}")
     print(f"Utilisation de {num_workers} processus en parallèle.")
-    
+
+    def make_job(pdb, key):
+        if not stream:
+            return Job([mc_annotate_executable, pdb], get_output_path(pdb), (pdb, key))
+        raw_path = get_output_path(pdb, ".mc-annotate.gz") if keep_raw else None
+        handler = lambda: StreamingAnnotation(get_output_path(pdb, suffix), raw_path)
+        return Job([mc_annotate_executable, pdb], tag=(pdb, key), stdout_handler=handler)
+
+    jobs = [make_job(pdb, key) for pdb, key in to_process]
     results = []
-    with ProcessPoolExecutor(max_workers=num_workers) as executor:
-        futures = {executor.submit(process_pdb_file, pdb, mc_annotate_executable): pdb for pdb in pdb_files}
-        for future in as_completed(futures):
-            results.append(future.result())
-    
+    with open(manifest_path, "a", encoding="utf-8") as manifest:
+        def record_result(result):
+            pdb_path, key = result.job.tag
+            output_file = get_output_path(pdb_path, suffix)
+            status = "ok" if result.returncode == 0 else "error"
+            record = {
+                "pdb": os.path.basename(pdb_path),
+                "key": key,
+                "status": status,
+                "elapsed": round(result.elapsed, 3),
+                "output": os.path.basename(output_file),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
+            manifest.write(json.dumps(record, sort_keys=True) + "\n")
+            manifest.flush()
+            records[record["pdb"]] = record
+            if status == "ok":
+                results.append(f"[OK] {pdb_path} -> {output_file}")
+            else:
+                results.append(f"[ERREUR] {pdb_path} : {result.error}")
+
+        run_jobs(jobs, num_workers, timeout, retries, on_result=record_result)
+
+    compact_manifest(manifest_path, records)
+
     # Afficher les messages de résultat
     for res in results:
         print(res)
@@ -68,10 +229,26 @@ def main():
     parser.add_argument("mc_annotate", type=str, help="Chemin vers l'exécutable mc-annotate")
     parser.add_argument("--num_workers", type=int, default=1,
                         help="Nombre de processus parallèles à utiliser (défaut: 1)")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="Délai maximal par fichier en secondes (défaut: aucun)")
+    parser.add_argument("--retries", type=int, default=0,
+                        help="Nombre de nouvelles tentatives après un échec transitoire (défaut: 0)")
+    parser.add_argument("--manifest", type=str, default=None,
+                        help=f"Manifeste des fichiers traités (défaut: {MANIFEST_NAME} dans input_dir)")
+    parser.add_argument("--force", action="store_true",
+                        help="Ignorer le cache et annoter de nouveau tous les fichiers")
+    parser.add_argument("--resume", action="store_true",
+                        help="Reprendre une exécution interrompue sans relancer les fichiers déjà en échec")
+    parser.add_argument("--stream", action="store_true",
+                        help=f"Analyser la sortie pendant l'exécution et n'écrire que le résultat structuré "
+                             f"(<pdb>{STRUCTURED_SUFFIX}) au lieu du texte brut")
+    parser.add_argument("--keep-raw", action="store_true",
+                        help="Avec --stream, conserver aussi le texte brut compressé (<pdb>.mc-annotate.gz)")
+    add_shard_argument(parser)
     args = parser.parse_args()
-    
-    process_directory(args.input_dir, args.mc_annotate, args.num_workers)
+
+    process_directory(args.input_dir, args.mc_annotate, args.num_workers, args.manifest, args.force, args.resume,
+                      args.timeout, args.retries, args.stream, args.keep_raw, args.shard)
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,243 @@
+import sys
+import argparse
+from collections import deque
+from multiprocessing import Pool, cpu_count
+import numpy as np
+from tqdm import tqdm
+from fold_sequence import FoldingModel
+from seq_codec import ALPHABET
+from table_engine import format_fixed, iter_row_chunks
+
+# Évaluation de structures données (séquence, structure dot-bracket) avec le modèle d'énergie de
+# fold_sequence, sans repliement. La décomposition d'une structure en NCMs est unique :
+#   paire sans paire interne              : NCM tige-boucle 'p' (p = j - i + 1)
+#   paire avec une seule paire interne    : NCM double brin 'n_m', hinge sur la paire interne
+#   paire avec plusieurs paires internes  : jonction multiple, hors du modèle (énergie inf)
+# Une structure mal formée (parenthèses non appariées, caractère autre que '(', ')' ou '.', longueur
+# différente de celle de la séquence) a une énergie NaN.
+
+# Nombre de candidats évalués à la fois par défaut
+DEFAULT_BATCH_SIZE = 10_000
+
+# Codes des nucléotides (ordre ALPHABET, T lu comme U, minuscules acceptées) ; -1 pour un autre octet
+_CODES = np.full(256, -1, dtype=np.int64)
+for _code, _base in enumerate(ALPHABET):
+    _CODES[ord(_base)] = _CODES[ord(_base.lower())] = _code
+_CODES[ord("T")] = _CODES[ord("t")] = ALPHABET.index("U")
+
+class StructureScorer:
+    """
+    Évalue des lots de structures par des lectures groupées (NumPy) dans les tables d'un FoldingModel.
+
+    Les énergies de séquence de tous les types de NCM sont mises bout à bout : le NCM t de rang r
+    est à la position sequence_offsets[t] + r de sequence_energy.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        sizes = [len(table) for table in model.sequence_energy]
+        self.sequence_offsets = np.concatenate(([0], np.cumsum(sizes)[:-1])).astype(np.int64)
+        self.sequence_energy = np.concatenate(model.sequence_energy) if sizes else np.zeros(0)
+        self.max_strand = max((max(strands) for strands in model.strands), default=0)
+        # Type de NCM d'après les longueurs des brins ; -1 si le type n'est pas dans le modèle
+        self.hairpin_type = np.full(self.max_strand + 1, -1, dtype=np.int64)
+        self.double_type = np.full((self.max_strand + 1, self.max_strand + 1), -1, dtype=np.int64)
+        for t, strands in enumerate(model.strands):
+            if len(strands) == 1:
+                self.hairpin_type[strands[0]] = t
+            else:
+                self.double_type[strands] = t
+
+    @classmethod
+    def from_bundle(cls, path):
+        """Charge le modèle d'un fichier bundle."""
+        return cls(FoldingModel.from_bundle(path))
+
+    def _window_ranks(self, codes, starts, lengths):
+        """Rangs des sous-séquences codes[start:start + length] (longueurs <= max_strand) ; -1 si non codable."""
+        ranks = np.zeros(len(starts), dtype=np.int64)
+        valid = np.ones(len(starts), dtype=bool)
+        for k in range(self.max_strand):
+            inside = k < lengths
+            code = codes[np.minimum(starts + k, len(codes) - 1)]
+            ranks = np.where(inside, ranks * 4 + code, ranks)
+            valid &= ~inside | (code >= 0)
+        return np.where(valid, ranks, -1)
+
+    def score(self, sequences, structures):
+        """
+        Énergies d'un lot de structures.
+
+        Toutes les structures du lot sont mises bout à bout : l'appariement des parenthèses, la
+        décomposition en NCMs et les lectures dans les tables sont faits en une fois pour le lot.
+
+        :param sequences: Séquences.
+        :param structures: Structures dot-bracket, une par séquence.
+        :return: Tableau des énergies (inf : structure hors du modèle, NaN : structure mal formée).
+        """
+        sequences, structures = list(sequences), list(structures)
+        count = len(sequences)
+        lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=count)
+        malformed = lengths != np.fromiter(map(len, structures), dtype=np.int64, count=count)
+        total = int(lengths.sum())
+        if total == 0:
+            return np.where(malformed, np.nan, 0.0)
+
+        codes = _CODES[np.frombuffer("".join(sequences).encode("ascii", errors="replace"), dtype=np.uint8)]
+        text = "".join("." * n if bad else structure for structure, n, bad in zip(structures, lengths, malformed))
+        brackets = np.frombuffer(text.encode("ascii", errors="replace"), dtype=np.uint8)
+        opening, closing = brackets == ord("("), brackets == ord(")")
+        rows = np.repeat(np.arange(count), lengths)
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+
+        # Profondeur après chaque position, propre à chaque structure
+        depth = np.cumsum(opening.astype(np.int64) - closing)
+        depth -= np.concatenate(([0], depth))[starts][rows]
+        nonempty = lengths > 0
+        lowest = np.zeros(count, dtype=np.int64)
+        lowest[nonempty] = np.minimum.reduceat(depth, starts[nonempty])
+        final = np.zeros(count, dtype=np.int64)
+        final[nonempty] = depth[starts[nonempty] + lengths[nonempty] - 1]
+        malformed |= (lowest < 0) | (final != 0)
+        malformed[rows[~(opening | closing | (brackets == ord(".")))]] = True
+
+        # Appariement : dans chaque structure, les parenthèses d'un même niveau alternent ouvrante,
+        # fermante ; triées par (niveau, position), elles se suivent deux à deux
+        positions = np.flatnonzero((opening | closing) & ~malformed[rows])
+        levels = np.where(opening[positions], depth[positions], depth[positions] + 1)
+        order = np.lexsort((positions, levels))
+        i, j = positions[order][0::2], positions[order][1::2]
+        level = levels[order][0::2]
+
+        # Paires internes directes de (i, j) : paires du niveau suivant entre i et j, contiguës
+        # dans l'ordre (niveau, position)
+        keys = level * (total + 1) + i
+        first = np.searchsorted(keys, (level + 1) * (total + 1) + i)
+        inner_count = np.searchsorted(keys, (level + 1) * (total + 1) + j) - first
+        child = np.minimum(first, len(i) - 1)
+        single = inner_count == 1
+        k, l = np.where(single, i[child], i), np.where(single, j[child], j)
+
+        # Type et séquence du NCM fermé par chaque paire
+        limit = self.max_strand
+        span = j - i + 1
+        n, m = k - i + 1, j - l + 1
+        hairpin = self.hairpin_type[np.minimum(span, limit)]
+        double = self.double_type[np.minimum(n, limit), np.minimum(m, limit)]
+        t = np.where(single, double, hairpin)
+        t[np.where(single, (n > limit) | (m > limit), span > limit) | (inner_count > 1)] = -1
+        first_strand = np.where(single, n, span)
+        second_strand = np.where(single, m, 0)
+        first_rank = self._window_ranks(codes, i, np.minimum(first_strand, limit))
+        second_rank = self._window_ranks(codes, l, np.minimum(second_strand, limit))
+        combined = first_rank * 4 ** np.minimum(second_strand, limit) + second_rank
+        rank = np.where((first_rank >= 0) & (second_rank >= 0), combined, -1)
+        known = (t >= 0) & (rank >= 0)
+        energy = np.full(len(i), np.inf)
+        energy[known] = self.sequence_energy[self.sequence_offsets[t[known]] + rank[known]]
+
+        # Hinge sur la paire interne (NCM double brin) et fermeture des hélices (paires du niveau 1)
+        inner_pair = np.where((codes[k] >= 0) & (codes[l] >= 0), codes[k] * 4 + codes[l], -1)
+        hinged = single & known & (t[child] >= 0) & (inner_pair >= 0)
+        energy[hinged] += self.model.hinge_energy[t[hinged], t[child][hinged], inner_pair[hinged]]
+        outer_pair = np.where((codes[i] >= 0) & (codes[j] >= 0), codes[i] * 4 + codes[j], -1)
+        exterior = level == 1
+        energy[exterior] += np.where(outer_pair[exterior] >= 0,
+                                     self.model.closing_energy[np.maximum(outer_pair[exterior], 0)], np.inf)
+        energy[single & ~hinged] = np.inf
+
+        with np.errstate(invalid="ignore"):
+            energies = np.bincount(rows[i], weights=energy, minlength=count)
+        energies[malformed] = np.nan
+        return energies
+
+def score_stream(scorer, candidates, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Évalue un flux de candidats (séquence, structure) lot par lot.
+
+    :param candidates: Itérable de (séquence, structure), lu au fur et à mesure.
+    :return: Itérateur de (séquence, structure, énergie), dans l'ordre des candidats ; seul le
+             lot en cours est gardé en mémoire.
+    """
+    for batch in iter_row_chunks(candidates, batch_size):
+        sequences, structures = zip(*batch)
+        energies = scorer.score(sequences, structures)
+        yield from zip(sequences, structures, energies.tolist())
+
+def parse_candidate_line(line):
+    """Lit une ligne 'séquence structure [champs...]' (séparateurs : espaces ou tabulations) ; None si vide."""
+    fields = line.split()
+    if not fields:
+        return None
+    return fields[0], fields[1] if len(fields) > 1 else ""
+
+_worker_scorer = None
+
+def init_worker(bundle_path):
+    """Charge une seule fois par processus le modèle (les tables du bundle sont partagées par mmap)."""
+    global _worker_scorer
+    _worker_scorer = StructureScorer.from_bundle(bundle_path)
+
+def score_lines(lines):
+    """
+    Évalue un bloc de lignes d'entrée et retourne les lignes de sortie (ligne d'entrée + énergie).
+
+    Une ligne vide est recopiée telle quelle : la sortie reste alignée ligne à ligne sur l'entrée.
+    """
+    lines = [line.rstrip("\n") for line in lines]
+    candidates = [parse_candidate_line(line) for line in lines]
+    kept = [index for index, candidate in enumerate(candidates) if candidate is not None]
+    energies = _worker_scorer.score([candidates[index][0] for index in kept],
+                                    [candidates[index][1] for index in kept])
+    output = [f"{line}\n" for line in lines]
+    for index, value in zip(kept, format_fixed(energies, 2).tolist()):
+        output[index] = f"{lines[index]}\t{value}\n"
+    return output
+
+def imap_bounded(pool, function, tasks, window):
+    """
+    Comme pool.imap (résultats dans l'ordre des tâches), mais au plus window tâches sont en cours :
+    l'entrée est lue au rythme des résultats et la mémoire reste bornée.
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(function, (task,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+def main():
+    parser = argparse.ArgumentParser(description="Évalue l'énergie de structures données (séquence, structure dot-bracket).")
+    parser.add_argument("-b", "--bundle", required=True, help="Bundle des tables d'énergie (energy_bundle.py build)")
+    parser.add_argument("-i", "--input", default=None,
+                        help="Fichier de candidats, une ligne 'séquence structure' par candidat (défaut: entrée standard)")
+    parser.add_argument("-o", "--output", default=None,
+                        help="Fichier de sortie : chaque ligne d'entrée suivie de l'énergie (défaut: sortie standard)")
+    parser.add_argument("-n", "--num_workers", type=int, default=1,
+                        help=f"Nombre de processus (défaut: 1, max: {cpu_count()})")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"Nombre de candidats évalués à la fois (défaut: {DEFAULT_BATCH_SIZE})")
+
+    args = parser.parse_args()
+    source = open(args.input, "r") if args.input else sys.stdin
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        chunks = iter_row_chunks(source, args.batch_size)
+        if args.num_workers > 1:
+            with Pool(processes=args.num_workers, initializer=init_worker, initargs=(args.bundle,)) as pool:
+                for lines in tqdm(imap_bounded(pool, score_lines, chunks, 2 * args.num_workers),
+                                  desc="Évaluation", unit="lot", disable=out is sys.stdout):
+                    out.writelines(lines)
+        else:
+            init_worker(args.bundle)
+            for chunk in chunks:
+                out.writelines(score_lines(chunk))
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+
+if __name__ == "__main__":
+    main()
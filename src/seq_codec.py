@@ -0,0 +1,166 @@
+import numpy as np
+import pandas as pd
+
+# Codage des séquences : chaque nucléotide sur 2 bits (A=0, C=1, G=2, U=3).
+# Le rang d'une séquence de longueur n est l'entier formé par ses n codes (base 4) : les 4^n
+# séquences de longueur n ont des rangs denses 0..4^n-1, dans l'ordre lexicographique.
+# La clé d'une séquence, unique toutes longueurs confondues, est (4^n - 1) / 3 + rang.
+ALPHABET = "ACGU"
+MAX_PACKED_LENGTH = 31  # 2 bits par nucléotide dans un int64 (clés comprises)
+
+_CODES = np.full(256, 255, dtype=np.uint8)
+for _code, _base in enumerate(ALPHABET):
+    _CODES[ord(_base)] = _CODES[ord(_base.lower())] = _code
+_LETTERS = np.frombuffer(ALPHABET.encode("ascii"), dtype=np.uint8)
+
+def ncm_sequence_length(ncm_type):
+    """
+    Nombre de nucléotides d'un NCM d'après son nom ('n_m' pour double-strands ou 'p' pour single-strands).
+
+    :raises ValueError: si le nom n'est pas valide.
+    """
+    return sum(map(int, ncm_type.split("_")))
+
+def _check_length(length):
+    if not 0 <= length <= MAX_PACKED_LENGTH:
+        raise ValueError(f"Longueur {length} hors de [0, {MAX_PACKED_LENGTH}] pour le codage sur 2 bits")
+
+def encode_ranks(sequences, length):
+    """
+    Rangs de séquences de même longueur.
+
+    :param sequences: Séquences (chaînes).
+    :param length: Longueur attendue.
+    :return: Tableau int64 ; -1 pour une séquence d'une autre longueur ou contenant un autre caractère.
+    """
+    _check_length(length)
+    sequences = list(sequences)
+    ranks = np.full(len(sequences), -1, dtype=np.int64)
+    valid = np.fromiter((len(seq) == length for seq in sequences), dtype=bool, count=len(sequences))
+    if not valid.any() or length == 0:
+        ranks[valid] = 0
+        return ranks
+    data = "".join(seq for seq, ok in zip(sequences, valid) if ok).encode("ascii", errors="replace")
+    codes = _CODES[np.frombuffer(data, dtype=np.uint8)].reshape(-1, length)
+    known = (codes != 255).all(axis=1)
+    weights = np.int64(4) ** np.arange(length - 1, -1, -1, dtype=np.int64)
+    selected = np.flatnonzero(valid)
+    ranks[selected[known]] = codes[known].astype(np.int64) @ weights
+    return ranks
+
+def decode_ranks(ranks, length):
+    """Séquences (tableau de chaînes) de rangs donnés, pour une longueur donnée."""
+    _check_length(length)
+    ranks = np.asarray(ranks, dtype=np.int64)
+    if length == 0:
+        return np.full(len(ranks), "", dtype="<U1")
+    shifts = np.arange(2 * (length - 1), -1, -2, dtype=np.int64)
+    letters = _LETTERS[(ranks[:, None] >> shifts) & 3]
+    return np.ascontiguousarray(letters).view(f"S{length}").ravel().astype(str)
+
+def all_sequences(length):
+    """Les 4^length séquences de longueur length, dans l'ordre des rangs."""
+    return decode_ranks(np.arange(4 ** length, dtype=np.int64), length)
+
+def length_offset(length):
+    """Première clé des séquences de longueur length : nombre de séquences plus courtes."""
+    return (4 ** length - 1) // 3
+
+def encode_keys(sequences):
+    """Clés (int64) de séquences de longueurs quelconques ; -1 pour une séquence non codable."""
+    sequences = list(sequences)
+    lengths = np.fromiter((len(seq) for seq in sequences), dtype=np.int64, count=len(sequences))
+    keys = np.full(len(sequences), -1, dtype=np.int64)
+    for length in np.unique(lengths).tolist():
+        if length > MAX_PACKED_LENGTH:
+            continue
+        selected = np.flatnonzero(lengths == length)
+        ranks = encode_ranks([sequences[i] for i in selected], length)
+        keys[selected] = np.where(ranks >= 0, ranks + length_offset(length), -1)
+    return keys
+
+def decode_keys(keys):
+    """Séquences (liste de chaînes) de clés données."""
+    keys = np.asarray(keys, dtype=np.int64)
+    # Longueur : plus grand n tel que (4^n - 1) / 3 <= clé
+    offsets = np.array([length_offset(n) for n in range(MAX_PACKED_LENGTH + 1)], dtype=np.int64)
+    lengths = np.searchsorted(offsets, keys, side="right") - 1
+    sequences = np.empty(len(keys), dtype=object)
+    for length in np.unique(lengths).tolist():
+        selected = lengths == length
+        sequences[selected] = decode_ranks(keys[selected] - offsets[length], length)
+    return sequences.tolist()
+
+def dense_table(values_by_sequence, length, dtype=np.int64, fill=0):
+    """
+    Tableau dense de 4^length valeurs, indexé par rang, à partir de {séquence: valeur}.
+
+    Les séquences d'une autre longueur ou non codables sont ignorées ; les valeurs répétées
+    (minuscules et majuscules) sont additionnées.
+    """
+    table = np.full(4 ** length, fill, dtype=dtype)
+    if values_by_sequence:
+        ranks = encode_ranks(values_by_sequence.keys(), length)
+        values = np.fromiter(values_by_sequence.values(), dtype=dtype, count=len(ranks))
+        keep = ranks >= 0
+        if fill == 0:
+            np.add.at(table, ranks[keep], values[keep])
+        else:
+            table[ranks[keep]] = values[keep]
+    return table
+
+def table_length(table):
+    """Longueur des séquences d'un tableau dense (4^n valeurs)."""
+    length = (len(table).bit_length() - 1) // 2
+    if 4 ** length != len(table):
+        raise ValueError(f"Tableau de {len(table)} valeurs : pas un tableau dense de séquences")
+    return length
+
+def lookup(table, sequences, fill=0):
+    """Valeurs d'un tableau dense pour des séquences ; fill pour les séquences d'une autre longueur."""
+    ranks = encode_ranks(sequences, table_length(table))
+    values = np.full(len(ranks), fill, dtype=np.result_type(table.dtype, fill))
+    values[ranks >= 0] = table[ranks[ranks >= 0]]
+    return values
+
+def save_dense_tables(path, tables):
+    """Écrit des tableaux denses {NCM: tableau} dans un fichier .npz."""
+    np.savez(path, **tables)
+
+def load_dense_tables(path):
+    """Lit des tableaux denses écrits par save_dense_tables."""
+    with np.load(path, allow_pickle=False) as data:
+        return {ncm: data[ncm] for ncm in data.files}
+
+def dense_tables_from_csv(path, dtype=np.int64, fill=0):
+    """
+    Convertit une table séquence x NCM (CSV de compute_ncm_by_seq_tab ou compute_ncm_by_seq_energy)
+    en tableaux denses, un par NCM, de la longueur du NCM.
+
+    Les lignes dont la longueur ne correspond pas au NCM sont ignorées ; les séquences absentes
+    du CSV valent fill.
+    """
+    frame = pd.read_csv(path, index_col=0, dtype={0: str}, keep_default_na=False, float_precision="round_trip")
+    sequences = frame.index.astype(str).tolist()
+    tables = {}
+    for ncm in frame.columns:
+        length = ncm_sequence_length(str(ncm))
+        ranks = encode_ranks(sequences, length)
+        keep = ranks >= 0
+        table = np.full(4 ** length, fill, dtype=dtype)
+        table[ranks[keep]] = frame[ncm].to_numpy(dtype=dtype)[keep]
+        tables[str(ncm)] = table
+    return tables
+
+def dense_tables_to_frame(tables, sequences=None, fill=0):
+    """
+    Table séquence x NCM (format CSV de compute_ncm_by_seq_tab) à partir de tableaux denses.
+
+    :param sequences: Lignes de la table (par défaut : toutes les séquences des longueurs des NCMs).
+    :param fill: Valeur des séquences dont la longueur ne correspond pas au NCM.
+    """
+    if sequences is None:
+        lengths = sorted({table_length(table) for table in tables.values()})
+        sequences = [seq for length in lengths for seq in all_sequences(length).tolist()]
+    index = pd.Index(list(dict.fromkeys(sequences)))
+    return pd.DataFrame({ncm: lookup(table, index, fill) for ncm, table in tables.items()}, index=index)
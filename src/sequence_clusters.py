@@ -0,0 +1,149 @@
+import hashlib
+import numpy as np
+
+# Codage 2 bits des nucléotides pour les k-mers
+NUCLEOTIDE_CODES = {"A": 0, "C": 1, "G": 2, "U": 3}
+
+# Hachage universel (a * x + b) mod P, avec x et a sur 32 bits pour rester dans des entiers 64 bits
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+def identity_to_jaccard(identity, k):
+    """
+    Convertit un seuil d'identité de séquence en seuil de Jaccard sur les ensembles de k-mers.
+
+    Avec une proportion p de positions identiques, une fraction p**k des k-mers est conservée,
+    d'où un indice de Jaccard d'environ p**k / (2 - p**k).
+    """
+    shared = identity ** k
+    return shared / (2 - shared)
+
+def choose_bands(num_perm, threshold):
+    """
+    Choisit le découpage de la signature en bandes (b bandes de r lignes, b * r <= num_perm).
+
+    Le seuil de l'approximation (1/b)**(1/r) est choisi le plus proche possible de threshold,
+    en privilégiant à écart égal les bandes plus nombreuses (moins de faux négatifs).
+
+    :return: Tuple (nombre de bandes, lignes par bande).
+    """
+    best = None
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        error = abs((1 / bands) ** (1 / rows) - threshold)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+def make_hash_parameters(num_perm, seed=1):
+    """Tire les coefficients (a, b) des num_perm fonctions de hachage."""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 32, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, 1 << 32, size=num_perm, dtype=np.uint64)
+    return a, b
+
+def kmer_codes(sequence, k):
+    """
+    Retourne les codes entiers (2 bits par base) des k-mers distincts d'une séquence d'ARN.
+
+    Les k-mers contenant une base autre que A, C, G ou U sont ignorés.
+    """
+    if not 1 <= k <= 16:
+        raise ValueError("La taille des k-mers doit être comprise entre 1 et 16")
+    if len(sequence) < k:
+        return np.empty(0, dtype=np.uint64)
+    codes = np.frombuffer(sequence.encode("ascii"), dtype=np.uint8)
+    values = np.full(256, 255, dtype=np.uint8)
+    for base, code in NUCLEOTIDE_CODES.items():
+        values[ord(base)] = code
+    codes = values[codes]
+    valid = codes != 255
+
+    windows = np.lib.stride_tricks.sliding_window_view(codes.astype(np.uint64), k)
+    shifts = np.arange(2 * (k - 1), -1, -2, dtype=np.uint64)
+    kmers = (windows << shifts).sum(axis=1, dtype=np.uint64)
+    kmers = kmers[np.lib.stride_tricks.sliding_window_view(valid, k).all(axis=1)]
+    return np.unique(kmers)
+
+def minhash_signature(sequence, k, hash_parameters):
+    """
+    Calcule la signature MinHash d'une séquence (minimum de chaque fonction de hachage sur ses k-mers).
+
+    Une séquence sans k-mer reçoit une signature remplie de la valeur maximale.
+    """
+    a, b = hash_parameters
+    kmers = kmer_codes(sequence, k)
+    if len(kmers) == 0:
+        return np.full(len(a), MAX_HASH, dtype=np.uint64)
+    hashes = ((np.outer(kmers, a) + b) % MERSENNE_PRIME) & MAX_HASH
+    return hashes.min(axis=0)
+
+class UnionFind:
+    """Partition d'éléments 0..n-1 en ensembles disjoints."""
+
+    def __init__(self, size):
+        self.parent = list(range(size))
+
+    def find(self, x):
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[x] != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, x, y):
+        root_x, root_y = self.find(x), self.find(y)
+        if root_x != root_y:
+            # La plus petite racine est conservée : le résultat ne dépend pas de l'ordre des unions
+            if root_y < root_x:
+                root_x, root_y = root_y, root_x
+            self.parent[root_y] = root_x
+
+def cluster_signatures(signatures, threshold, bands, rows):
+    """
+    Regroupe les signatures dont l'indice de Jaccard estimé atteint threshold.
+
+    Les signatures sont découpées en bandes : seules les signatures partageant une bande
+    entière sont comparées, chacune au premier élément de la bande (coût quasi linéaire).
+
+    :param signatures: Tableau (n, num_perm) de signatures MinHash.
+    :return: Liste des indices de groupe (le plus petit indice de chaque groupe), un par signature.
+    """
+    signatures = np.asarray(signatures)
+    size = len(signatures)
+    clusters = UnionFind(size)
+    empty = (signatures == MAX_HASH).all(axis=1)
+    for band in range(bands):
+        buckets = {}
+        block = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        for i in range(size):
+            if empty[i]:
+                continue
+            first = buckets.setdefault(block[i].tobytes(), i)
+            if first != i and clusters.find(first) != clusters.find(i):
+                if np.mean(signatures[first] == signatures[i]) >= threshold:
+                    clusters.union(first, i)
+    return [clusters.find(i) for i in range(size)]
+
+def split_clusters(clusters, test_fraction, seed=1):
+    """
+    Répartit des groupes entre apprentissage et test, sans jamais couper un groupe.
+
+    Les groupes sont ordonnés par une empreinte de leur nom et de la graine, puis ajoutés
+    à l'ensemble de test jusqu'à atteindre test_fraction des éléments.
+
+    :param clusters: Dictionnaire {nom du groupe: liste des éléments}.
+    :return: Tuple (noms des groupes d'apprentissage, noms des groupes de test), triés.
+    """
+    total = sum(len(members) for members in clusters.values())
+    order = sorted(clusters, key=lambda name: hashlib.blake2b(f"{seed}:{name}".encode()).digest())
+    train, test = [], []
+    test_size = 0
+    for name in order:
+        if test_size < test_fraction * total:
+            test.append(name)
+            test_size += len(clusters[name])
+        else:
+            train.append(name)
+    return sorted(train), sorted(test)
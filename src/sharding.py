@@ -0,0 +1,119 @@
+import os
+import re
+import sys
+import json
+import hashlib
+import argparse
+from collections import Counter, namedtuple
+
+# Partie i (0 <= i < N) d'une partition des fichiers d'entrée en N parties
+ShardSpec = namedtuple("ShardSpec", ["index", "count"])
+
+SHARD_SPEC_PATTERN = re.compile(r"^(\d+)/(\d+)$")
+
+def structure_key(file_name):
+    """Identifiant de la structure d'un fichier, sans extension (ex: '1abc_A.mc-annotate' -> '1abc_A')."""
+    return os.path.basename(file_name).split(".", 1)[0]
+
+def parse_shard_spec(spec):
+    """Lit une spécification 'i/N' (type argparse)."""
+    match = SHARD_SPEC_PATTERN.match(spec)
+    if not match:
+        raise argparse.ArgumentTypeError(f"spécification de partie invalide : {spec} (attendu : i/N)")
+    index, count = map(int, match.groups())
+    if count < 1 or index >= count:
+        raise argparse.ArgumentTypeError(f"partie {index} hors de [0, {count})")
+    return ShardSpec(index, count)
+
+def add_shard_argument(parser):
+    """Ajoute l'option --shard i/N à un parseur argparse."""
+    parser.add_argument("--shard", type=parse_shard_spec, default=None, metavar="i/N",
+                        help="Ne traiter que la partie i (0 <= i < N) d'une partition stable des fichiers d'entrée")
+
+def shard_of(file_name, count):
+    """
+    Partie d'un fichier dans une partition en count parties.
+
+    La partie ne dépend que de l'identifiant de structure (blake2b, indépendant de la machine, de
+    PYTHONHASHSEED et de la liste des autres fichiers) : les fichiers d'une même structure
+    (.cif, .pdb, .mc-annotate) sont toujours dans la même partie.
+    """
+    digest = hashlib.blake2b(structure_key(file_name).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+def in_shard(file_name, shard):
+    """Indique si un fichier appartient à la partie shard (toujours vrai si shard est None)."""
+    return shard is None or shard_of(file_name, shard.count) == shard.index
+
+def select_shard(file_names, shard):
+    """Restreint une liste de fichiers à la partie shard, dans le même ordre."""
+    return [name for name in file_names if in_shard(name, shard)]
+
+def shard_file_name(path, shard):
+    """Nom du fragment de sortie propre à une partie (ex: a.manifest.jsonl -> a.manifest.shard-0-of-4.jsonl)."""
+    if shard is None:
+        return path
+    base, ext = os.path.splitext(path)
+    return f"{base}.shard-{shard.index}-of-{shard.count}{ext}"
+
+def merge_manifests(fragment_paths, output_path, key):
+    """
+    Réunit les manifestes JSON (une entrée par ligne) écrits par les différentes parties.
+
+    Les entrées sont triées par clé et écrites comme par une exécution en un seul processus.
+    Une clé présente dans deux fragments indique des parties qui se recouvrent.
+
+    :param fragment_paths: Manifestes des parties.
+    :param output_path: Manifeste réuni.
+    :param key: Champ identifiant une entrée (ex: 'pdb').
+    """
+    records = {}
+    for path in fragment_paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record[key] in records:
+                    raise ValueError(f"{record[key]} présent dans plusieurs fragments ({path})")
+                records[record[key]] = record
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for name in sorted(records):
+            f.write(json.dumps(records[name], sort_keys=True) + "\n")
+    os.replace(tmp_path, output_path)
+    return len(records)
+
+def main():
+    parser = argparse.ArgumentParser(description="Partition stable des fichiers d'entrée pour une exécution sur plusieurs nœuds.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    plan_parser = subparsers.add_parser("plan", help="Affiche la partie de chaque fichier d'un répertoire")
+    plan_parser.add_argument("input_dir", help="Répertoire des fichiers d'entrée")
+    plan_parser.add_argument("count", type=int, help="Nombre de parties N")
+    plan_parser.add_argument("-o", "--output", default=None, help="Manifeste de la partition (défaut: sortie standard)")
+
+    merge_parser = subparsers.add_parser("merge-manifests", help="Réunit les manifestes écrits par les parties")
+    merge_parser.add_argument("fragments", nargs="+", help="Manifestes des parties")
+    merge_parser.add_argument("-o", "--output", required=True, help="Manifeste réuni")
+    merge_parser.add_argument("--key", default="pdb", help="Champ identifiant une entrée (défaut: pdb)")
+
+    args = parser.parse_args()
+    if args.command == "plan":
+        if args.count < 1:
+            parser.error("le nombre de parties doit être au moins 1")
+        lines = [json.dumps({"file": name, "shard": shard_of(name, args.count)}, sort_keys=True)
+                 for name in sorted(os.listdir(args.input_dir))]
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                f.writelines(line + "\n" for line in lines)
+        else:
+            print("\n".join(lines))
+        sizes = Counter(json.loads(line)["shard"] for line in lines)
+        print(", ".join(f"partie {i}: {sizes[i]} fichiers" for i in range(args.count)), file=sys.stderr)
+    else:
+        total = merge_manifests(args.fragments, args.output, args.key)
+        print(f"{total} entrées enregistrées dans {args.output}")
+
+if __name__ == "__main__":
+    main()
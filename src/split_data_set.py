@@ -1,70 +1,215 @@
 import os
+import csv
 import shutil
-from Bio.PDB import MMCIFParser
+import hashlib
+from collections import defaultdict
+from multiprocessing import Pool, cpu_count
+import numpy as np
+from tqdm import tqdm
+from pdb_reader import STANDARD_NUCLEOTIDES, read_entity_sequences, read_model_sequences
+from sequence_clusters import (choose_bands, cluster_signatures, identity_to_jaccard, make_hash_parameters,
+                               minhash_signature, split_clusters)
 
-def extract_sequence_from_cif(file_path):
+# Sources possibles de la séquence d'un fichier CIF
+SEQUENCE_SOURCES = ("atoms", "entity")
+
+def extract_sequence_from_cif(file_path, use_biopython=False, source="atoms", verbose=True):
     """
-    Extrait la séquence d'ARN à partir d'un fichier CIF en utilisant Biopython.
+    Extrait la séquence d'ARN à partir d'un fichier CIF.
     
     :param file_path: Chemin du fichier CIF
+    :param use_biopython: Si True, analyse le fichier avec Biopython au lieu du lecteur en flux
+    :param source: 'atoms' pour les résidus des coordonnées (tous les modèles), 'entity' pour les
+                   séquences déclarées dans _entity_poly_seq (sans lire les coordonnées)
+    :param verbose: Si False, n'affiche que les erreurs
     :return: Séquence d'ARN sous forme de chaîne
     """
-    print(f"Lecture du fichier : {file_path}")
-    parser = MMCIFParser(QUIET=True)
+    if verbose:
+        print(f"Lecture du fichier : {file_path}")
     sequence = []
 
     try:
-        structure = parser.get_structure("RNA_structure", file_path)
-        for model in structure:
-            for chain in model:
-                for residue in chain:
-                    # Vérifie si le résidu est un nucléotide (A, U, C, G)
-                    if residue.resname in ['A', 'U', 'C', 'G']:
-                        sequence.append(residue.resname)
+        if source == "entity":
+            models = [read_entity_sequences(file_path)]
+        else:
+            models = read_model_sequences(file_path, use_biopython)
+        for chains in models:
+            for _, residue_names in chains:
+                # Vérifie si le résidu est un nucléotide (A, U, C, G)
+                sequence.extend(name for name in residue_names if name in STANDARD_NUCLEOTIDES)
     except Exception as e:
         print(f"Erreur lors du traitement du fichier {file_path} : {e}")
         return ""
     
     if sequence:
         sequence_str = ''.join(sequence)
-        print(f"Séquence extraite : {sequence_str[:30]}")
+        if verbose:
+            print(f"Séquence extraite : {sequence_str[:30]}")
         return sequence_str
     else:
-        print("Aucune séquence trouvée.")
+        if verbose:
+            print("Aucune séquence trouvée.")
         return ""
 
-def remove_redundant_sequences_keep_one(input_dir, output_dir):
+def sequence_digest(sequence):
+    """Empreinte compacte (16 octets) d'une séquence, utilisée comme clé de déduplication."""
+    return hashlib.blake2b(sequence.encode("ascii"), digest_size=16).digest()
+
+def digest_cif_file(args):
+    """
+    Extrait la séquence d'un fichier dans un processus de calcul.
+
+    :param args: Tuple (chemin du fichier CIF, utiliser Biopython, source de la séquence).
+    :return: Tuple (nom du fichier, empreinte ou None, début de la séquence).
+    """
+    file_path, use_biopython, source = args
+    sequence = extract_sequence_from_cif(file_path, use_biopython, source, verbose=False)
+    if not sequence:
+        return os.path.basename(file_path), None, ""
+    return os.path.basename(file_path), sequence_digest(sequence), sequence[:30]
+
+def remove_redundant_sequences_keep_one(input_dir, output_dir, use_biopython=False, num_workers=1, source="atoms"):
     """
     Copie les fichiers CIF uniques (par séquence) dans un répertoire de sortie,
     tout en conservant une seule copie pour chaque séquence redondante.
+
+    Les séquences sont extraites en parallèle et comparées par empreinte (blake2b). Pour chaque
+    séquence, le fichier retenu est celui dont le nom est le plus petit dans l'ordre
+    lexicographique : le résultat ne dépend pas de l'ordre de fin des processus.
     
     :param input_dir: Chemin du répertoire contenant les fichiers CIF
     :param output_dir: Chemin du répertoire de sortie
+    :param use_biopython: Si True, analyse les fichiers avec Biopython
+    :param num_workers: Nombre de processus d'extraction
+    :param source: Source de la séquence ('atoms' ou 'entity', voir extract_sequence_from_cif)
     """
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
-    
-    sequence_to_file = {}  # Dictionnaire pour associer une séquence à un fichier
-    for file_name in os.listdir(input_dir):
-        if file_name.endswith('.cif'):
-            file_path = os.path.join(input_dir, file_name)
-            sequence = extract_sequence_from_cif(file_path)
-            
-            if sequence:  # Si une séquence a été trouvée
-                if sequence not in sequence_to_file:
-                    sequence_to_file[sequence] = file_name
-                    shutil.copy(file_path, output_dir)  # Copie le fichier pour la première occurrence
-            else:
+
+    file_names = sorted(f for f in os.listdir(input_dir) if f.endswith('.cif'))
+    tasks = [(os.path.join(input_dir, f), use_biopython, source) for f in file_names]
+    chunksize = max(1, len(tasks) // (num_workers * 4))
+
+    digest_to_file = {}  # Empreinte de la séquence -> (fichier retenu, début de la séquence)
+    with Pool(processes=num_workers) as pool:
+        for file_name, digest, preview in tqdm(pool.imap_unordered(digest_cif_file, tasks, chunksize),
+                                               total=len(tasks), desc="Extraction des séquences"):
+            if digest is None:
                 print(f"Aucune séquence valide trouvée pour {file_name}")
-    
-    # Affiche les correspondances fichier-séquence retenues
-    if sequence_to_file:
+            elif digest not in digest_to_file or file_name < digest_to_file[digest][0]:
+                digest_to_file[digest] = (file_name, preview)
+
+    # Copie un fichier par séquence et affiche les correspondances fichier-séquence retenues
+    if digest_to_file:
         print("Fichiers retenus pour chaque séquence unique :")
-        for seq, file in sequence_to_file.items():
-            print(f"Sequence: {seq[:30]}... -> Fichier: {file}")
+        for file_name, preview in sorted(digest_to_file.values()):
+            shutil.copy(os.path.join(input_dir, file_name), output_dir)
+            print(f"Sequence: {preview}... -> Fichier: {file_name}")
     else:
         print("Aucune séquence unique trouvée. Vérifiez les fichiers CIF dans le répertoire d'entrée.")
 
+# Paramètres MinHash partagés par les processus de calcul, initialisés une seule fois par init_sketch_worker
+_worker_kmer_size = None
+_worker_hash_parameters = None
+
+def init_sketch_worker(kmer_size, hash_parameters):
+    global _worker_kmer_size, _worker_hash_parameters
+    _worker_kmer_size = kmer_size
+    _worker_hash_parameters = hash_parameters
+
+def sketch_cif_file(args):
+    """
+    Extrait la séquence d'un fichier et calcule sa signature MinHash dans un processus de calcul.
+
+    :param args: Tuple (chemin du fichier CIF, utiliser Biopython, source de la séquence).
+    :return: Tuple (nom du fichier, empreinte ou None, signature ou None).
+    """
+    file_path, use_biopython, source = args
+    sequence = extract_sequence_from_cif(file_path, use_biopython, source, verbose=False)
+    if not sequence:
+        return os.path.basename(file_path), None, None
+    signature = minhash_signature(sequence, _worker_kmer_size, _worker_hash_parameters)
+    return os.path.basename(file_path), sequence_digest(sequence), signature
+
+def cluster_similar_sequences(input_dir, output_dir, identity, use_biopython=False, num_workers=1, source="atoms",
+                              kmer_size=5, num_perm=128, test_fraction=0.2, seed=1):
+    """
+    Regroupe les fichiers CIF de séquences proches et répartit les groupes entre apprentissage et test.
+
+    Chaque séquence est résumée par une signature MinHash de ses k-mers. Le seuil d'identité est
+    converti en seuil de Jaccard sur les k-mers, et seules les séquences partageant une bande de
+    leur signature sont comparées (pas de comparaison de toutes les paires). Les séquences
+    identiques sont d'abord regroupées par empreinte.
+
+    Écrit dans output_dir :
+      - un fichier représentatif par groupe (le plus petit nom de fichier du groupe) ;
+      - clusters.csv : groupe et ensemble (train/test) de chaque fichier ;
+      - train.txt et test.txt : fichiers de chaque ensemble, un groupe n'étant jamais partagé.
+
+    :param identity: Seuil d'identité de séquence (entre 0 et 1) pour regrouper deux fichiers
+    :param kmer_size: Taille des k-mers (au plus 16)
+    :param num_perm: Nombre de fonctions de hachage de la signature
+    :param test_fraction: Fraction des fichiers placés dans l'ensemble de test
+    :param seed: Graine des fonctions de hachage et de la répartition
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    threshold = identity_to_jaccard(identity, kmer_size)
+    bands, rows = choose_bands(num_perm, threshold)
+    print(f"Seuil de Jaccard sur les {kmer_size}-mers : {threshold:.3f} ({bands} bandes de {rows} lignes)")
+
+    file_names = sorted(f for f in os.listdir(input_dir) if f.endswith('.cif'))
+    tasks = [(os.path.join(input_dir, f), use_biopython, source) for f in file_names]
+    chunksize = max(1, len(tasks) // (num_workers * 4))
+
+    files_by_digest = defaultdict(list)
+    signature_by_digest = {}
+    with Pool(processes=num_workers, initializer=init_sketch_worker,
+              initargs=(kmer_size, make_hash_parameters(num_perm, seed))) as pool:
+        for file_name, digest, signature in tqdm(pool.imap_unordered(sketch_cif_file, tasks, chunksize),
+                                                 total=len(tasks), desc="Signatures des séquences"):
+            if digest is None:
+                print(f"Aucune séquence valide trouvée pour {file_name}")
+                continue
+            files_by_digest[digest].append(file_name)
+            signature_by_digest[digest] = signature
+
+    # Séquences uniques, ordonnées par leur plus petit nom de fichier
+    digests = sorted(files_by_digest, key=lambda d: min(files_by_digest[d]))
+    if not digests:
+        print("Aucune séquence trouvée. Vérifiez les fichiers CIF dans le répertoire d'entrée.")
+        return
+    roots = cluster_signatures(np.array([signature_by_digest[d] for d in digests]), threshold, bands, rows)
+
+    members_by_root = defaultdict(list)
+    for digest, root in zip(digests, roots):
+        members_by_root[root].extend(files_by_digest[digest])
+    clusters = {min(members): sorted(members) for members in members_by_root.values()}
+    train, test = split_clusters(clusters, test_fraction, seed)
+
+    for representative in sorted(clusters):
+        shutil.copy(os.path.join(input_dir, representative), output_dir)
+
+    subset_of = {name: "train" for name in train}
+    subset_of.update({name: "test" for name in test})
+    with open(os.path.join(output_dir, "clusters.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["file", "cluster", "subset"])
+        for representative in sorted(clusters):
+            for file_name in clusters[representative]:
+                writer.writerow([file_name, representative, subset_of[representative]])
+    for subset, names in (("train", train), ("test", test)):
+        with open(os.path.join(output_dir, f"{subset}.txt"), "w") as f:
+            for file_name in sorted(file_name for name in names for file_name in clusters[name]):
+                f.write(file_name + "\n")
+
+    num_files = sum(len(members) for members in clusters.values())
+    num_test = sum(len(clusters[name]) for name in test)
+    print(f"{num_files} fichiers, {len(digests)} séquences uniques, {len(clusters)} groupes")
+    print(f"Apprentissage : {num_files - num_test} fichiers ({len(train)} groupes), "
+          f"test : {num_test} fichiers ({len(test)} groupes)")
+
 def main():
     """
     Point d'entrée du programme pour exécution en ligne de commande.
@@ -74,10 +219,33 @@ def main():
     parser = argparse.ArgumentParser(description="Éliminer les redondances de séquences dans une base de données CIF.")
     parser.add_argument("input_dir", help="Chemin du répertoire contenant les fichiers CIF en entrée")
     parser.add_argument("output_dir", help="Chemin du répertoire où sauvegarder les fichiers uniques")
+    parser.add_argument("--biopython", action="store_true",
+                        help="Analyser les fichiers avec Biopython (plus lent) au lieu du lecteur en flux")
+    parser.add_argument("-n", "--num_workers", type=int, default=cpu_count(),
+                        help="Nombre de processus d'extraction (défaut: nombre de cœurs CPU)")
+    parser.add_argument("--seq-source", choices=SEQUENCE_SOURCES, default="atoms",
+                        help="Séquence tirée des coordonnées (atoms, défaut) ou des séquences déclarées "
+                             "dans _entity_poly_seq (entity, sans lire les coordonnées)")
+    parser.add_argument("--cluster-identity", type=float, default=None,
+                        help="Regroupe les séquences d'identité au moins égale à ce seuil (ex: 0.9) et "
+                             "écrit une répartition apprentissage/test par groupe, au lieu de retirer "
+                             "seulement les doublons exacts")
+    parser.add_argument("--kmer-size", type=int, default=5, help="Taille des k-mers des signatures (défaut: 5)")
+    parser.add_argument("--num-perm", type=int, default=128,
+                        help="Nombre de fonctions de hachage des signatures (défaut: 128)")
+    parser.add_argument("--test-fraction", type=float, default=0.2,
+                        help="Fraction des fichiers placés dans l'ensemble de test (défaut: 0.2)")
+    parser.add_argument("--seed", type=int, default=1, help="Graine du hachage et de la répartition (défaut: 1)")
     
     args = parser.parse_args()
     
-    remove_redundant_sequences_keep_one(args.input_dir, args.output_dir)
+    if args.cluster_identity is None:
+        remove_redundant_sequences_keep_one(args.input_dir, args.output_dir, args.biopython, args.num_workers,
+                                            args.seq_source)
+    else:
+        cluster_similar_sequences(args.input_dir, args.output_dir, args.cluster_identity, args.biopython,
+                                  args.num_workers, args.seq_source, args.kmer_size, args.num_perm,
+                                  args.test_fraction, args.seed)
 
 if __name__ == "__main__":
     main()
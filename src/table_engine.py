@@ -0,0 +1,121 @@
+import csv
+from itertools import islice
+import numpy as np
+import pandas as pd
+
+# Énergie d'une probabilité : E = -ENERGY_SCALE * ln(ENERGY_REFERENCE * p)
+ENERGY_SCALE = 0.616
+ENERGY_REFERENCE = 66
+
+# Nombre de lignes lues à la fois en mode flux
+DEFAULT_CHUNK_SIZE = 100_000
+
+def count_matrix(row_keys, col_keys, counts, row_labels, col_labels, dtype=np.int64):
+    """
+    Construit une matrice de comptes à partir de triplets (ligne, colonne, compte).
+
+    Les triplets dont la ligne ou la colonne n'est pas dans les étiquettes sont ignorés ;
+    les triplets répétés sont additionnés.
+
+    :param row_keys: Étiquette de ligne de chaque triplet.
+    :param col_keys: Étiquette de colonne de chaque triplet.
+    :param counts: Compte de chaque triplet.
+    :param row_labels: Étiquettes des lignes de la matrice, dans l'ordre.
+    :param col_labels: Étiquettes des colonnes de la matrice, dans l'ordre.
+    :return: Matrice (len(row_labels), len(col_labels)).
+    """
+    rows = pd.Index(row_labels).get_indexer(pd.Index(row_keys, dtype=object))
+    cols = pd.Index(col_labels).get_indexer(pd.Index(col_keys, dtype=object))
+    counts = np.asarray(counts, dtype=dtype)
+    keep = (rows >= 0) & (cols >= 0)
+    matrix = np.zeros((len(row_labels), len(col_labels)), dtype=dtype)
+    np.add.at(matrix, (rows[keep], cols[keep]), counts[keep])
+    return matrix
+
+def normalize(counts, axis=None, total=None):
+    """
+    Divise des comptes par leur somme (totale ou selon un axe) ; une somme nulle donne 0.
+
+    :param counts: Tableau de comptes.
+    :param axis: Axe de normalisation (None : somme de tout le tableau).
+    :param total: Somme à utiliser à la place de celle du tableau (ex: comptes hors matrice inclus).
+    :return: Tableau de probabilités (float64).
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    if total is None:
+        total = counts.sum(axis=axis, keepdims=axis is not None)
+    total = np.asarray(total, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(total > 0, counts / np.where(total > 0, total, 1), 0.0)
+
+def probabilities_to_energies(probabilities, max_value=None):
+    """
+    Convertit des probabilités en énergies : E = -0.616 * ln(66 * p).
+
+    Une probabilité nulle (ou négative) donne +inf, qui n'est pas plafonné par max_value.
+
+    :param probabilities: Tableau de probabilités.
+    :param max_value: Énergie maximale (None : pas de plafond).
+    """
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    positive = probabilities > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        energies = -ENERGY_SCALE * np.log(np.where(positive, probabilities, 1.0) * ENERGY_REFERENCE)
+    if max_value is not None:
+        energies = np.minimum(energies, max_value)
+    return np.where(positive, energies, np.inf)
+
+def _parse_float(value):
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return np.nan
+
+def parse_float_array(values):
+    """
+    Convertit des chaînes en float64 avec float() (arrondi exact) ; les valeurs illisibles ou non
+    finies donnent NaN.
+    """
+    parsed = np.fromiter((_parse_float(value) for value in values), dtype=np.float64, count=len(values))
+    parsed[~np.isfinite(parsed)] = np.nan
+    return parsed
+
+def format_rounded(values, decimals):
+    """
+    Écrit des nombres comme str(round(x, decimals)) le ferait valeur par valeur.
+
+    L'arrondi décimal exact ('%.nf') est relu en float, puis écrit sous sa forme la plus courte.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    return np.char.mod(f"%.{decimals}f", values).astype(np.float64).astype(str)
+
+def format_fixed(values, decimals):
+    """Écrit des nombres avec un nombre fixe de décimales ('{:.nf}'.format(x) valeur par valeur)."""
+    return np.char.mod(f"%.{decimals}f", np.asarray(values, dtype=np.float64))
+
+def iter_row_chunks(rows, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Regroupe un itérable de lignes en listes d'au plus chunk_size lignes."""
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def map_csv_values(input_file, output_file, function, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Applique une fonction vectorisée à toutes les valeurs d'un CSV sans en-tête, par blocs de lignes.
+
+    Les lignes peuvent avoir des longueurs différentes : les valeurs d'un bloc sont mises à plat,
+    transformées en une seule opération, puis redécoupées en lignes.
+
+    :param function: Fonction (tableau de chaînes) -> tableau de chaînes de même taille.
+    """
+    with open(input_file, "r", newline="") as fin, open(output_file, "w", newline="") as fout:
+        writer = csv.writer(fout)
+        for chunk in iter_row_chunks(csv.reader(fin), chunk_size):
+            lengths = np.fromiter((len(row) for row in chunk), dtype=np.int64, count=len(chunk))
+            flat = [value for row in chunk for value in row]
+            results = function(np.asarray(flat, dtype=object)).tolist() if flat else []
+            bounds = np.concatenate(([0], np.cumsum(lengths))).tolist()
+            writer.writerows(results[bounds[i]:bounds[i + 1]] for i in range(len(chunk)))